@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks for the chess library. See benchmarks.run
+"""
@@ -0,0 +1,304 @@
+"""
+Times the public operations of the chess library on a fixed set of positions,
+writes the results as JSON and optionally compares them against a stored
+baseline.
+
+Usage, from the repository root:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+The exit status is 1 if any operation regressed beyond its tolerance.
+benchmarks/baseline.json is the reference baseline, written by --output;
+timings are machine-specific, so to check a change, compare against a
+baseline made on the same machine from the unchanged tree.
+
+Memory is reported as the retained size, in bytes, of the objects each
+operation returns (measured with sys.getsizeof, recursively), as there is no
+allocation tracer available to Python 2.
+
+Startup is reported as the median milliseconds taken to import each of
+IMPORTS in a fresh interpreter, once the table cache (see chess.tables) has
+been written. Compile the package first (python -m compileall chess) so
+that's not timed too.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from timeit import default_timer
+
+import chess
+from chess import Game, BasicMove, BoardSquare, fen_to_unicode
+
+#(name, FEN, a legal move for the side to move)
+POSITIONS = [
+    ('start', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     'e2e4'),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+     'w KQkq - 0 1', 'e1g1'),
+    ('rook_endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', 'e2e4'),
+    ('promotions', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 '
+     'w kq - 0 1', 'b4c5'),
+    ('middlegame', 'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R '
+     'w KQ - 0 8', 'c4d5'),
+    ('in_check', 'rnbqkbnr/8/8/1B6/8/8/8/RNBQK1NR b KQkq - 1 1', 'd8d7'),
+    ('checkmate', 'rr2k3/8/8/8/8/8/8/K7 w - - 0 1', None),
+    ('stalemate', 'r1r5/1K6/7r/8/8/8/8/8 w - - 0 1', None),
+]
+
+#Modules whose import time is measured
+IMPORTS = ['chess', 'chess.search', 'chess.pgn']
+
+_IMPORT_SCRIPT = ('from timeit import default_timer\n'
+                  'started = default_timer()\n'
+                  'import %s\n'
+                  'print default_timer() - started\n')
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_ALL_SQUARES = [BoardSquare(file_, rank_) for rank_ in xrange(8, 0, -1)
+                for file_ in 'abcdefgh']
+
+def _own_squares(game):
+    return [square for square in _ALL_SQUARES
+            if game.board.piece_at_board_square(square) is not None and
+            chess._colour_of_piece(
+                game.board.piece_at_board_square(square)) == game.active]
+
+def _bind(func, *args):
+    return lambda: func(*args)
+
+def operations():
+    """
+    Returns a list of (name, [callable, ...]); each callable performs one
+    operation on one of the fixed positions
+    """
+    games = [(Game(fen), move) for _, fen, move in POSITIONS]
+    fens = [fen for _, fen, _ in POSITIONS]
+    mapped = [(Game(fen), move) for _, fen, move in POSITIONS]
+    for game, _ in mapped:
+        game.board.enable_attack_map()
+
+    valid_ends = []
+    for game, _ in games:
+        for square in _own_squares(game):
+            valid_ends.append(_bind(game.valid_ends, square))
+
+    return [
+        ('Game(fen)', [_bind(Game, fen) for fen in fens]),
+        ('Game(fen, lazy)', [_bind(Game, fen, True) for fen in fens]),
+        ('Game(fen, lazy).fen', [_bind(lambda fen: Game(fen, lazy=True).fen(),
+                                       fen) for fen in fens]),
+        ('Game.fen', [game.fen for game, _ in games]),
+        ('valid_ends', valid_ends),
+        ('move', [_bind(game.move, BasicMove.from_coordinates(move))
+                  for game, move in games if move is not None]),
+        ('move (attack map)', [_bind(game.move,
+                                     BasicMove.from_coordinates(move))
+                               for game, move in mapped if move is not None]),
+        ('check_status', [game.board.check_status for game, _ in games]),
+        ('check_status (attack map)', [game.board.check_status
+                                       for game, _ in mapped]),
+        ('in_check', [_bind(game.board.in_check, game.active)
+                      for game, _ in games]),
+        ('in_check (attack map)', [_bind(game.board.in_check, game.active)
+                                   for game, _ in mapped]),
+        ('is_checkmate', [game.is_checkmate for game, _ in games]),
+        ('is_stalemate', [game.is_stalemate for game, _ in games]),
+        ('fen_to_unicode', [_bind(lambda board: [
+            [fen_to_unicode(piece) for piece in row] for row in board.squares],
+            game.board) for game, _ in games]),
+    ]
+
+def _deep_sizeof(obj, seen=None):
+    """
+    Returns the size in bytes of obj and everything reachable from it
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += _deep_sizeof(key, seen) + _deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _deep_sizeof(item, seen)
+    elif hasattr(obj, '__dict__'):
+        size += _deep_sizeof(obj.__dict__, seen)
+    return size
+
+def measure(calls, min_time=0.2, repeat=3):
+    """
+    Times one pass over calls, repeated until a pass takes at least min_time,
+    and returns a dict of ops_per_sec (best of repeat) and bytes_per_op
+    """
+    loops = 1
+    while True:
+        started = default_timer()
+        for _ in xrange(loops):
+            for call in calls:
+                call()
+        elapsed = default_timer() - started
+        if elapsed >= min_time:
+            break
+        loops *= 2
+
+    best = elapsed
+    for _ in xrange(repeat - 1):
+        started = default_timer()
+        for _ in xrange(loops):
+            for call in calls:
+                call()
+        best = min(best, default_timer() - started)
+
+    total_bytes = sum(_deep_sizeof(call()) for call in calls)
+
+    return {
+        'ops_per_sec': loops * len(calls) / best,
+        'bytes_per_op': total_bytes / float(len(calls)),
+    }
+
+def import_time(module, runs=9):
+    """
+    Returns the median milliseconds taken to import module, each of runs
+    times in a new interpreter. A first, untimed, import makes sure any
+    cached tables exist
+    """
+    command = [sys.executable, '-c', _IMPORT_SCRIPT % module]
+    subprocess.check_output(command, cwd=_ROOT)
+    timings = sorted(float(subprocess.check_output(command, cwd=_ROOT))
+                     for _ in xrange(runs))
+    return timings[len(timings) // 2] * 1000
+
+def run(min_time=0.2, repeat=3, only=None, import_runs=9):
+    """
+    Runs every benchmark (or those named in only, where the import of a
+    module is named 'import module'), returning the JSON-able results
+    document
+    """
+    results = {}
+    for name, calls in operations():
+        if only and name not in only:
+            continue
+        results[name] = measure(calls, min_time, repeat)
+    imports = {}
+    for module in IMPORTS:
+        if only and 'import ' + module not in only:
+            continue
+        imports[module] = import_time(module, import_runs)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'positions': [name for name, _, _ in POSITIONS],
+        'results': results,
+        'imports': imports,
+    }
+
+def compare(results, baseline, tolerance=0.1, memory_tolerance=0.1,
+            overrides=None, import_tolerance=0.5):
+    """
+    Compares a results document against a baseline one. An operation regresses
+    if its ops/sec fall by more than its tolerance (a fraction; overrides maps
+    operation names to their own tolerance), or its bytes per operation grow by
+    more than memory_tolerance. An import regresses if its time grows by more
+    than import_tolerance. Returns a list of (name, metric, baseline, current,
+    regressed) rows
+    """
+    overrides = overrides or {}
+    rows = []
+    for name in sorted(results['results']):
+        if name not in baseline['results']:
+            continue
+        current = results['results'][name]
+        previous = baseline['results'][name]
+        allowed = overrides.get(name, tolerance)
+
+        regressed = current['ops_per_sec'] < \
+            previous['ops_per_sec'] * (1 - allowed)
+        rows.append((name, 'ops_per_sec', previous['ops_per_sec'],
+                     current['ops_per_sec'], regressed))
+
+        regressed = current['bytes_per_op'] > \
+            previous['bytes_per_op'] * (1 + memory_tolerance)
+        rows.append((name, 'bytes_per_op', previous['bytes_per_op'],
+                     current['bytes_per_op'], regressed))
+
+    #Older results documents have no import times
+    previous_imports = baseline.get('imports', {})
+    for module, current in sorted(results.get('imports', {}).iteritems()):
+        if module not in previous_imports:
+            continue
+        previous = previous_imports[module]
+        rows.append(('import ' + module, 'import_ms', previous, current,
+                     current > previous * (1 + import_tolerance)))
+    return rows
+
+def _parse_overrides(values):
+    overrides = {}
+    for value in values or []:
+        name, _, tolerance = value.rpartition('=')
+        overrides[name] = float(tolerance)
+    return overrides
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='write results JSON to this file')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed fractional ops/sec drop (default 0.1)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+                        help='allowed fractional bytes/op growth '
+                        '(default 0.1)')
+    parser.add_argument('--operation-tolerance', action='append',
+                        metavar='NAME=TOLERANCE',
+                        help='per-operation ops/sec tolerance override')
+    parser.add_argument('--import-tolerance', type=float, default=0.5,
+                        help='allowed fractional import time growth '
+                        '(default 0.5)')
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        help='only run the named operation(s), or '
+                        '"import MODULE"')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds per timed pass (default 0.2)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed passes per operation (default 3)')
+    parser.add_argument('--import-runs', type=int, default=9,
+                        help='interpreters timed per import (default 9)')
+    args = parser.parse_args(argv)
+
+    results = run(args.min_time, args.repeat, args.only, args.import_runs)
+
+    document = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(document + '\n')
+    else:
+        print document
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    rows = compare(results, baseline, args.tolerance, args.memory_tolerance,
+                   _parse_overrides(args.operation_tolerance),
+                   args.import_tolerance)
+    regressions = 0
+    for name, metric, previous, current, regressed in rows:
+        if regressed:
+            regressions += 1
+        sys.stderr.write('%-16s %-12s %14.1f %14.1f %+7.1f%%%s\n' % (
+            name, metric, previous, current,
+            100.0 * (current - previous) / previous if previous else 0.0,
+            '  REGRESSION' if regressed else ''))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,7 @@ Python chess library by Kristian Glass (mail@doismellburning.co.uk)
 """
 
 import copy
+import re
 import pieces
 
 WHITE_PIECES = frozenset('PRNBKQ')
@@ -51,6 +52,19 @@ class InvalidPromotionDataException(Exception):
     promotion, or is not a valid promotion
     """
 
+class InvalidReplayException(Exception):
+    """
+    Raised by Game.replay when a move in the sequence is invalid. The offending
+    (zero-based) ply index, the move and the underlying exception are available
+    as ply, move and error respectively
+    """
+    def __init__(self, ply, move, error):
+        Exception.__init__(self, 'Invalid move at ply %d (%s): %s' % (
+            ply, move, error.__class__.__name__))
+        self.ply = ply
+        self.move = move
+        self.error = error
+
 def _colour_of_piece(piece):
     """
     Returns "w" or "b" depending on colour of piece string
@@ -68,6 +82,23 @@ def _colour_of_piece(piece):
     if "a" <= piece <= "z":
         return "b"
 
+def _other_colour(colour):
+    """
+    Returns the opposing colour
+
+    >>> _other_colour('w')
+    'b'
+    """
+    return 'b' if colour == 'w' else 'w'
+
+#(row, column) offsets in _Board coordinates
+_KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                   (1, -2), (1, 2), (2, -1), (2, 1))
+_KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
+                 (0, 1), (1, -1), (1, 0), (1, 1))
+_ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+_BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
 class BoardSquare(object):
     """
     Small wrapper around what is essentially a (file,rank) pair. Note that
@@ -134,9 +165,30 @@ class BoardSquare(object):
 
         return self.rank_ == other.rank_ and self.file_ == other.file_
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
     def __hash__(self):
         return hash(self.rank_) ^ hash(self.file_)
 
+#BoardSquare instances indexed by _Board coordinates, i.e. _SQUARES[row][col]
+_SQUARES = tuple(tuple(BoardSquare(chr(ord('a') + col), 8 - row)
+                       for col in xrange(8)) for row in xrange(8))
+
+#Per piece kind: (offsets or directions, whether the piece slides)
+_PIECE_MOVEMENT = {
+    'N': (_KNIGHT_OFFSETS, False),
+    'K': (_KING_OFFSETS, False),
+    'B': (_BISHOP_DIRECTIONS, True),
+    'R': (_ROOK_DIRECTIONS, True),
+    'Q': (_ROOK_DIRECTIONS + _BISHOP_DIRECTIONS, True),
+}
+
+#Order in which promotion moves are generated
+_PROMOTION_ORDER = 'QNRB'
+
+#Rough piece values, used to order captures
+_ORDERING_VALUES = {'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0}
 
 class _CastlingState(object):
     """
@@ -201,6 +253,37 @@ class BasicMove(object):
         self.end = end
         self.promotion = promotion
 
+    @classmethod
+    def from_coordinates(cls, coordinates):
+        """
+        Builds a move from a coordinate string such as 'e2e4' or 'e7e8q'. Any
+        promotion piece is returned lowercase, as its colour is unknown here
+
+        >>> str(BasicMove.from_coordinates('e7e8q'))
+        '(e7 -> e8) -> q'
+        """
+        if len(coordinates) not in (4, 5) or \
+                not (coordinates[1].isdigit() and coordinates[3].isdigit()):
+            raise InvalidSquareException('"%s" is not a valid move' %
+                                         coordinates)
+        promotion = None
+        if len(coordinates) == 5:
+            promotion = coordinates[4].lower()
+        return cls(coordinates[0:2], coordinates[2:4], promotion)
+
+    def coordinates(self):
+        """
+        Returns the move as a coordinate string, the inverse of
+        from_coordinates
+
+        >>> BasicMove('e7', 'e8', 'Q').coordinates()
+        'e7e8q'
+        """
+        string = "%s%s" % (self.start, self.end)
+        if self.promotion is not None:
+            string += self.promotion.lower()
+        return string
+
     def __repr__(self):
         return '%s.%s(%r, %r, %r)' % (self.__class__.__module__,
                                       self.__class__.__name__,
@@ -220,31 +303,66 @@ class BasicMove(object):
         #TODO This means reverse move has same hash - consider fixing?
         return hash(self.start) ^ hash(self.end)
 
+def _expand_board_rows(fen):
+    """
+    Expands the digits in the board field of a FEN string, keeping the '/'
+    separators, so a well-formed board gives 71 characters with '.' for empty
+    squares
+
+    >>> _expand_board_rows('8/8/8/8/8/8/8/R3K2R')[-8:]
+    'R...K..R'
+    """
+    expanded = fen
+    for digit in '2345678':
+        if digit in expanded:
+            expanded = expanded.replace(digit, '.' * int(digit))
+    return expanded.replace('1', '.')
+
+def _expand_board_fen(fen):
+    """
+    Expands the board field of a FEN string into a string of 64 characters,
+    one per square from a8 to h1, with '.' for empty squares
+
+    >>> _expand_board_fen('8/8/8/8/8/8/8/R3K2R')[-8:]
+    'R...K..R'
+    """
+    return _expand_board_rows(fen).replace('/', '')
+
+#Two digits in a row mean a board FEN isn't in its canonical form
+_ADJACENT_DIGITS = re.compile(r'\d\d')
+
+#Every ninth character of a well-formed expanded board is a separator
+_ROW_SEPARATORS = '/' * 7
+
+def _parse_board_fen(fen):
+    """
+    Parses the board field of a FEN string into _Board squares
+    """
+    expanded = _expand_board_rows(fen)
+    assert(len(expanded) == 71 and expanded[8::9] == _ROW_SEPARATORS)
+    return [[None if piece == '.' else piece for piece in expanded[i:i + 8]]
+            for i in xrange(0, 71, 9)]
+
 class _Board(object):
     """
     Represents a chess board...
+
+    The FEN of the board is cached, so squares should only be changed through
+    apply_move. So is the optional attack map (see enable_attack_map)
     """
     def __init__(self, squares=None, fen=None):
+        self._fen = None
+        self.attack_map = None
         if squares is not None:
             assert(len(squares) == 8)
             for rank_or_file_i_forget in squares:
                 assert(len(rank_or_file_i_forget) == 8)
             self.squares = squares
         elif fen is not None:
-            fen_lines = fen.split('/')
-            squares = []
-            for line in fen_lines:
-                row = []
-                for char in line:
-                    if char >= '1' and char <= '8':
-                        for _ in xrange(int(char)):
-                            row.append(None)
-                    else:
-                        row.append(char)
-                assert(len(row) == 8)
-                squares.append(row)
-            assert(len(squares) == 8)
-            self.squares = squares
+            self.squares = _parse_board_fen(fen)
+            if not _ADJACENT_DIGITS.search(fen):
+                #Already canonical, so fen() can hand it straight back
+                self._fen = fen
         else:
             self.squares = [[None for _ in xrange(8)] for _ in xrange(8)]
             self.squares[0] = list('rnbqkbnr')
@@ -262,6 +380,9 @@ class _Board(object):
         >>> _Board().fen()
         'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR'
         """
+        if self._fen is not None:
+            return self._fen
+
         rows = list()
         for row in self.squares:
             row_str = ''
@@ -278,7 +399,8 @@ class _Board(object):
                 row_str += "%d" % empty_count
             rows.append(row_str)
 
-        return "/".join(rows)
+        self._fen = "/".join(rows)
+        return self._fen
 
     def piece_at_board_square(self, board_square):
         """
@@ -289,6 +411,27 @@ class _Board(object):
         coords = board_square.to_board_coordinates()
         return self.squares[coords[0]][coords[1]]
 
+    def enable_attack_map(self):
+        """
+        Builds an attack map for this board (see chess.attacks), which is then
+        kept up to date by apply_move and carried over by copies. Check and
+        attack queries become lookups in it
+        """
+        if self.attack_map is None:
+            #Imported here so that boards without maps don't pay for the
+            #attack tables
+            from chess import attacks
+            self.attack_map = attacks.AttackMap(self.squares)
+
+    def _copy(self):
+        """
+        Returns an independent copy of this board, with any attack map
+        """
+        board = _Board(squares=[row[:] for row in self.squares])
+        if self.attack_map is not None:
+            board.attack_map = self.attack_map.copy()
+        return board
+
     def check_status(self):
         """
         Returns a set containing any colours in check in the current game state
@@ -296,6 +439,9 @@ class _Board(object):
         TODO: Optimisation for later - have an is_colour_in_check boolean, then
         we can stop generating moves for opposite colour once this becomes true
         """
+        if self.attack_map is not None:
+            return set(colour for colour in ('w', 'b')
+                       if self.attack_map.in_check(colour))
         white_threats = set()
         black_threats = set()
         white_king_square = None
@@ -344,20 +490,117 @@ class _Board(object):
                 threat_squares.update(piece_object.threat_squares(self, square))
         return threat_squares
 
+    def is_attacked(self, square, colour):
+        """
+        Returns True if the given square is attacked by any piece of the given
+        colour. Unlike _threat_squares this only looks outwards from the square
+        itself, so is much cheaper for a single query
+
+        >>> _Board().is_attacked('f3', 'w')
+        True
+        >>> _Board().is_attacked('f4', 'w')
+        False
+        """
+        if not isinstance(square, BoardSquare):
+            square = BoardSquare(square)
+        row, col = square.to_board_coordinates()
+        if self.attack_map is not None:
+            return self.attack_map.is_attacked(row, col, colour)
+        return self._is_attacked_coords(row, col, colour)
+
+    def _is_attacked_coords(self, row, col, colour):
+        """
+        As is_attacked, but takes _Board coordinates. Always scans the board,
+        so it also answers for squares changed in place since the last move
+        """
+        squares = self.squares
+        if colour == 'w':
+            pawn, knight, bishop, rook, queen, king = 'PNBRQK'
+            pawn_row = row + 1
+        else:
+            pawn, knight, bishop, rook, queen, king = 'pnbrqk'
+            pawn_row = row - 1
+
+        if 0 <= pawn_row < 8:
+            if col > 0 and squares[pawn_row][col - 1] == pawn:
+                return True
+            if col < 7 and squares[pawn_row][col + 1] == pawn:
+                return True
+
+        for offsets, attacker in ((_KNIGHT_OFFSETS, knight),
+                                  (_KING_OFFSETS, king)):
+            for row_delta, col_delta in offsets:
+                r = row + row_delta
+                c = col + col_delta
+                if 0 <= r < 8 and 0 <= c < 8 and squares[r][c] == attacker:
+                    return True
+
+        for directions, slider in ((_ROOK_DIRECTIONS, rook),
+                                   (_BISHOP_DIRECTIONS, bishop)):
+            for row_delta, col_delta in directions:
+                r = row + row_delta
+                c = col + col_delta
+                while 0 <= r < 8 and 0 <= c < 8:
+                    piece = squares[r][c]
+                    if piece is not None:
+                        if piece == slider or piece == queen:
+                            return True
+                        break
+                    r += row_delta
+                    c += col_delta
+
+        return False
+
+    def _king_coords(self, colour):
+        """
+        Returns the _Board coordinates of the king of the given colour, or None
+        if there isn't one
+        """
+        king = 'K' if colour == 'w' else 'k'
+        for row, pieces_in_row in enumerate(self.squares):
+            if king in pieces_in_row:
+                return (row, pieces_in_row.index(king))
+        return None
+
+    def in_check(self, colour):
+        """
+        Returns True if the king of the given colour is attacked
+        """
+        if self.attack_map is not None:
+            return self.attack_map.in_check(colour)
+        coords = self._king_coords(colour)
+        if coords is None:
+            return False
+        return self._is_attacked_coords(coords[0], coords[1],
+                                        _other_colour(colour))
+
     def board_from_move(self, move, en_passant):
         """
         Returns a new board to which the supplied move has been applied
         """
-        new_board_squares = copy.deepcopy(self.squares)
+        new_board = self._copy()
+        new_board.apply_move(move, en_passant)
+        return new_board
+
+    def apply_move(self, move, en_passant):
+        """
+        Applies the supplied move to this board in place. No validation is
+        performed
+        """
+        self._fen = None
+        new_board_squares = self.squares
 
         start_coords = move.start.to_board_coordinates()
         end_coords = move.end.to_board_coordinates()
+        moving_piece = new_board_squares[start_coords[0]][start_coords[1]]
         if move.promotion is not None:
             piece = move.promotion
         else:
-            piece = new_board_squares[start_coords[0]][start_coords[1]]
+            piece = moving_piece
         new_board_squares[end_coords[0]][end_coords[1]] = piece
         new_board_squares[start_coords[0]][start_coords[1]] = None
+        changed = [start_coords[0] * 8 + start_coords[1],
+                   end_coords[0] * 8 + end_coords[1]]
 
         #Castling... (consider a refactor)
         if piece == 'k' or piece == 'K':
@@ -380,8 +623,10 @@ class _Board(object):
                 piece = new_board_squares[rook_start[0]][rook_start[1]]
                 new_board_squares[rook_start[0]][rook_start[1]] = None
                 new_board_squares[rook_end[0]][rook_end[1]] = piece
+                changed.append(rook_start[0] * 8 + rook_start[1])
+                changed.append(rook_end[0] * 8 + rook_end[1])
 
-        if move.end == en_passant:
+        if move.end == en_passant and moving_piece in ('p', 'P'):
             #Feels like a bit of a hack, but can only be one of two ranks...
             if en_passant.rank_ == 3:
                 taken_pawn_coords = move.end.delta(0, 1).to_board_coordinates()
@@ -390,8 +635,10 @@ class _Board(object):
             else:
                 raise Exception() #TODO
             new_board_squares[taken_pawn_coords[0]][taken_pawn_coords[1]] = None
+            changed.append(taken_pawn_coords[0] * 8 + taken_pawn_coords[1])
 
-        return _Board(squares=new_board_squares)
+        if self.attack_map is not None:
+            self.attack_map.update(new_board_squares, changed)
 
 
 class Game(object):
@@ -400,8 +647,14 @@ class Game(object):
     such as turn)
     """
 	
-    def __init__(self, fen=None):
-        self.board = _Board()
+    def __init__(self, fen=None, lazy=False):
+        """
+        Creates a game from the given FEN, or the starting position. If lazy is
+        True, parsing the board is put off until it is first used, which makes
+        constructing games only to read their other fields or fen() cheap. An
+        invalid board is then only reported when first used
+        """
+        self._board_fen = None
         self.active = "w"
         self.castling = _CastlingState()
         self.en_passant = None
@@ -411,7 +664,10 @@ class Game(object):
         if fen:
             (board_str, active, castling, en_passant, halfmove, fullmove) = \
                 fen.split(' ')
-            self.board = _Board(fen=board_str)
+            if lazy and not _ADJACENT_DIGITS.search(board_str):
+                self._board_fen = board_str
+            else:
+                self.board = _Board(fen=board_str)
             self.active = active
             self.castling = _CastlingState(castling)
             if en_passant == "-":
@@ -420,15 +676,36 @@ class Game(object):
                 self.en_passant = BoardSquare(en_passant)
             self.halfmove = int(halfmove)
             self.fullmove = int(fullmove)
+        else:
+            self.board = _Board()
+
+    def __getattr__(self, name):
+        #Only called for attributes that aren't set, i.e. a lazy board that
+        #hasn't been parsed yet
+        if name == 'board' and self.__dict__.get('_board_fen') is not None:
+            self.board = _Board(fen=self._board_fen)
+            return self.board
+        raise AttributeError(name)
 
     def fen(self):
         """
         Returns game state in Forsyth-Edwards Notation (FEN)
 
         http://en.wikipedia.org/wiki/Forsyth-Edwards_Notation
+
+        >>> game = Game('8/8/8/8/8/8/8/K6k w - - 0 1', lazy=True)
+        >>> game.fen()
+        '8/8/8/8/8/8/8/K6k w - - 0 1'
+        >>> 'board' in game.__dict__
+        False
         """
+        board = self.__dict__.get('board')
+        if board is None:
+            board_fen = self._board_fen
+        else:
+            board_fen = board.fen()
         en_passant_str = self.en_passant or "-"
-        return '%s %s %s %s %d %d' % (self.board.fen(), self.active,
+        return '%s %s %s %s %d %d' % (board_fen, self.active,
                                       self.castling, en_passant_str,
                                       self.halfmove, self.fullmove)
 
@@ -454,9 +731,192 @@ class Game(object):
         if piece is None:
             raise NoPieceAtSquareException()
 
-        if not move.end in self.valid_ends(move.start):
+        if self.active != _colour_of_piece(piece):
+            raise NotYourTurnException()
+
+        if not self._is_legal_move(move, piece):
             raise InvalidMoveException() #TODO More specific exception?
 
+        self._validate_promotion(move, piece)
+
+    def is_legal(self, move):
+        """
+        Returns True if the given move (a BasicMove or coordinate string) is
+        legal in the current position, including its promotion data.
+
+        Unlike validate_move this never raises, and unlike valid_ends it only
+        considers the one move: the piece's geometry and path are checked
+        directly, then the resulting king safety with a single attack query
+
+        >>> Game().is_legal(BasicMove('e2', 'e4'))
+        True
+        >>> Game().is_legal('e1e2')
+        False
+        """
+        try:
+            move = self._coerce_move(move)
+        except InvalidSquareException:
+            return False
+
+        piece = self.board.piece_at_board_square(move.start)
+        if piece is None or self.active != _colour_of_piece(piece):
+            return False
+
+        if not self._is_legal_move(move, piece):
+            return False
+
+        try:
+            self._validate_promotion(move, piece)
+        except (MoveMissingPromotionException, InvalidPromotionDataException):
+            return False
+
+        return True
+
+    def _is_legal_move(self, move, piece):
+        """
+        Returns True if the given piece, belonging to the side to move, can make
+        move. Promotion data is not checked
+        """
+        squares = self.board.squares
+        start_row, start_col = move.start.to_board_coordinates()
+        end_row, end_col = move.end.to_board_coordinates()
+        row_delta = end_row - start_row
+        col_delta = end_col - start_col
+        colour = self.active
+
+        target = squares[end_row][end_col]
+        if target is not None and _colour_of_piece(target) == colour:
+            return False
+
+        kind = piece.upper()
+        en_passant = False
+
+        if kind == 'N':
+            if (abs(row_delta), abs(col_delta)) not in ((1, 2), (2, 1)):
+                return False
+        elif kind in 'BRQ':
+            straight = row_delta == 0 or col_delta == 0
+            diagonal = abs(row_delta) == abs(col_delta)
+            if (row_delta == 0 and col_delta == 0) or not (
+                (straight and kind != 'B') or (diagonal and kind != 'R')):
+                return False
+            row_step = cmp(row_delta, 0)
+            col_step = cmp(col_delta, 0)
+            row = start_row + row_step
+            col = start_col + col_step
+            while (row, col) != (end_row, end_col):
+                if squares[row][col] is not None:
+                    return False
+                row += row_step
+                col += col_step
+        elif kind == 'K':
+            if abs(row_delta) > 1:
+                return False
+            if abs(col_delta) == 2 and row_delta == 0:
+                return self._is_legal_castle(move, piece)
+            if abs(col_delta) > 1:
+                return False
+        elif kind == 'P':
+            forward = -1 if colour == 'w' else 1
+            if col_delta == 0:
+                if target is not None:
+                    return False
+                if row_delta == 2 * forward:
+                    if start_row != (6 if colour == 'w' else 1):
+                        return False
+                    if squares[start_row + forward][start_col] is not None:
+                        return False
+                elif row_delta != forward:
+                    return False
+            elif abs(col_delta) == 1 and row_delta == forward:
+                if target is None:
+                    if move.end != self.en_passant:
+                        return False
+                    en_passant = True
+            else:
+                return False
+        else:
+            return False
+
+        attack_map = self.board.attack_map
+        if attack_map is not None and not en_passant and \
+                not attack_map.in_check(colour):
+            #Out of check, a king move is safe unless its destination is
+            #attacked, and moving any other piece can only expose the king
+            #along a line through its start square, which would have to be
+            #attacked already
+            enemy = attack_map.attackers[_other_colour(colour)]
+            if kind == 'K':
+                return not enemy[end_row * 8 + end_col]
+            if not enemy[start_row * 8 + start_col]:
+                return True
+
+        #Make the move in place, test king safety, then unmake it
+        squares[end_row][end_col] = piece
+        squares[start_row][start_col] = None
+        if en_passant:
+            taken = squares[start_row][end_col]
+            squares[start_row][end_col] = None
+        try:
+            if kind == 'K':
+                king_row, king_col = end_row, end_col
+            else:
+                king_coords = self.board._king_coords(colour)
+                if king_coords is None:
+                    return True
+                king_row, king_col = king_coords
+            return not self.board._is_attacked_coords(king_row, king_col,
+                                                      _other_colour(colour))
+        finally:
+            squares[start_row][start_col] = piece
+            squares[end_row][end_col] = target
+            if en_passant:
+                squares[start_row][end_col] = taken
+
+    def _is_legal_castle(self, move, piece):
+        """
+        Returns True if the given king move of two files is a legal castle
+        """
+        if piece == 'K':
+            rank = '1'
+            kingside, queenside = (self.castling.white_kingside,
+                                   self.castling.white_queenside)
+        else:
+            rank = '8'
+            kingside, queenside = (self.castling.black_kingside,
+                                   self.castling.black_queenside)
+
+        if move.start != BoardSquare('e' + rank):
+            return False
+        if move.end.file_ == 'g':
+            if not kingside:
+                return False
+            rook_file, through = 'h', 'fg'
+        else:
+            if not queenside:
+                return False
+            rook_file, through = 'a', 'bcd'
+
+        if self.board.piece_at_board_square(rook_file + rank) != (
+            'R' if piece == 'K' else 'r'):
+            return False
+
+        other_colour = _other_colour(self.active)
+        if self.board.is_attacked(move.start, other_colour):
+            return False
+        for file_ in through:
+            square = file_ + rank
+            if self.board.piece_at_board_square(square) is not None:
+                return False
+            #The king passes through every square but the b file
+            if file_ != 'b' and self.board.is_attacked(square, other_colour):
+                return False
+        return True
+
+    def _validate_promotion(self, move, piece):
+        """
+        Raises if the move's promotion data doesn't match the moving piece
+        """
         if move.promotion:
             if not self._is_promotion_move(move):
                 raise InvalidPromotionDataException()
@@ -486,6 +946,29 @@ class Game(object):
         if self.active != color:
             raise NotYourTurnException()
 
+        ends = self._pseudo_ends(start, piece)
+
+        if check_check:
+            # Generate potential boards
+            move_boards = zip(ends, [
+            self.board.board_from_move(BasicMove(start, end), self.en_passant)
+            for end in ends])
+
+            # Determine check, prune
+            valid_ends = set([move_board[0] for move_board in move_boards if
+                               self.active not in move_board[1].check_status()])
+        else:
+            valid_ends = ends
+
+        return valid_ends
+
+    def _pseudo_ends(self, start, piece):
+        """
+        Returns the set of squares the given piece at start could move to,
+        ignoring whether doing so would leave its own king in check
+        """
+        color = _colour_of_piece(piece)
+
         # Generate end squares
         ends = set()
         piece_object = pieces.PIECE_MAP[piece]()
@@ -501,48 +984,40 @@ class Game(object):
                 if piece == 'p' or piece == 'P':
                     ends.add(threat_square)
 
-        other_color = 'b' if color == 'w' else 'w' #Ugh
-        opposing_threats = self.board._threat_squares(other_color)
-        if piece == 'k' or piece == 'K' and start not in opposing_threats:
+        other_color = _other_colour(color)
+        if piece in ('k', 'K') and not self.board.is_attacked(start,
+                                                               other_color):
             def _can_castle_through_or_to(square_str):
                 return self.board.piece_at_board_square(
-                    square_str) is None and BoardSquare(
-                    square_str) not in opposing_threats
+                    square_str) is None and not self.board.is_attacked(
+                    square_str, other_color)
+
+            def _has_rook(square_str):
+                return self.board.piece_at_board_square(square_str) == (
+                    'R' if piece == 'K' else 'r')
 
             if piece == 'k':
-                if self.castling.black_kingside:
+                if self.castling.black_kingside and _has_rook('h8'):
                     if _can_castle_through_or_to(
                         'f8') and _can_castle_through_or_to('g8'):
                         ends.add(BoardSquare('g8'))
-                if self.castling.black_queenside:
-                    if _can_castle_through_or_to(
-                        'b8') and _can_castle_through_or_to(
+                if self.castling.black_queenside and _has_rook('a8'):
+                    if self.board.piece_at_board_square(
+                        'b8') is None and _can_castle_through_or_to(
                         'c8') and _can_castle_through_or_to('d8'):
                         ends.add(BoardSquare('c8'))
             elif piece == 'K':
-                if self.castling.white_kingside:
+                if self.castling.white_kingside and _has_rook('h1'):
                     if _can_castle_through_or_to(
                         'f1') and _can_castle_through_or_to('g1'):
                         ends.add(BoardSquare('g1'))
-                if self.castling.white_queenside:
-                    if _can_castle_through_or_to(
-                        'b1') and _can_castle_through_or_to(
+                if self.castling.white_queenside and _has_rook('a1'):
+                    if self.board.piece_at_board_square(
+                        'b1') is None and _can_castle_through_or_to(
                         'c1') and _can_castle_through_or_to('d1'):
                         ends.add(BoardSquare('c1'))
 
-        if check_check:
-            # Generate potential boards
-            move_boards = zip(ends, [
-            self.board.board_from_move(BasicMove(start, end), self.en_passant)
-            for end in ends])
-
-            # Determine check, prune
-            valid_ends = set([move_board[0] for move_board in move_boards if
-                               self.active not in move_board[1].check_status()])
-        else:
-            valid_ends = ends
-
-        return valid_ends
+        return ends
 
     def _generate_ends(self, color, start, rank_delta, file_delta, limit,
                       can_take=True, must_take=False, can_en_passant=False):
@@ -589,63 +1064,332 @@ class Game(object):
         """
         self.validate_move(move)
 
+        new_game = self._copy()
+        new_game._apply_move(move)
+
+        return new_game
+
+    def _copy(self):
+        """
+        Returns an independent copy of this game, without going via FEN
+        """
+        return Game._from_state(
+            self.board._copy(),
+            self.active, copy.copy(self.castling), self.en_passant,
+            self.halfmove, self.fullmove)
+
+    @classmethod
+    def _from_state(cls, board, active, castling, en_passant, halfmove,
+                    fullmove):
+        """
+        Returns a new Game built directly from its parts, without going via
+        FEN. The parts are used as-is, not copied
+        """
+        game = cls.__new__(cls)
+        game._board_fen = None
+        game.board = board
+        game.active = active
+        game.castling = castling
+        game.en_passant = en_passant
+        game.halfmove = halfmove
+        game.fullmove = fullmove
+        return game
+
+    def _apply_move(self, move):
+        """
+        Applies move to this game in place, updating board and game state. No
+        validation is performed
+        """
         piece = self.board.piece_at_board_square(move.start)
 
-        new_game = Game(self.fen())
-        new_game.board = new_game.board.board_from_move(move, self.en_passant)
+        self.board.apply_move(move, self.en_passant)
 
         #TODO Update check
 
         assert(self.active in ('b', 'w'))
         if self.active == 'b':
-            new_game.active = 'w'
-            new_game.fullmove += 1
+            self.active = 'w'
+            self.fullmove += 1
         elif self.active == 'w':
-            new_game.active = 'b'
+            self.active = 'b'
 
-        new_game.en_passant = None
+        self.en_passant = None
         if piece == 'p' or piece == 'P':
-            new_game.halfmove = 0
+            self.halfmove = 0
             if move.end.rank_ - move.start.rank_ == 2:
-                new_game.en_passant = move.start.delta(0, 1)
+                self.en_passant = move.start.delta(0, 1)
             elif move.end.rank_ - move.start.rank_ == -2:
-                new_game.en_passant = move.start.delta(0, -1)
+                self.en_passant = move.start.delta(0, -1)
         else:
-            new_game.halfmove += 1
+            self.halfmove += 1
 
         #Loose but sufficient checks for castling
         if piece == 'r':
             if move.start.file_ == 'a':
-                new_game.castling.black_queenside = False
+                self.castling.black_queenside = False
             elif move.start.file_ == 'h':
-                new_game.castling.black_kingside = False
+                self.castling.black_kingside = False
         elif piece == 'k':
-            new_game.castling.black_queenside = False
-            new_game.castling.black_kingside = False
+            self.castling.black_queenside = False
+            self.castling.black_kingside = False
         elif piece == 'R':
             if move.start.file_ == 'a':
-                new_game.castling.white_queenside = False
+                self.castling.white_queenside = False
             elif move.start.file_ == 'h':
-                new_game.castling.white_kingside = False
+                self.castling.white_kingside = False
         elif piece == 'K':
-            new_game.castling.white_queenside = False
-            new_game.castling.white_kingside = False
+            self.castling.white_queenside = False
+            self.castling.white_kingside = False
 
-        return new_game
+    def _coerce_move(self, move):
+        """
+        Accepts either a BasicMove or a coordinate string such as 'e7e8q',
+        returning a BasicMove. Promotion pieces given in coordinate strings are
+        coloured for the side to move
+        """
+        if isinstance(move, BasicMove):
+            return move
+        move = BasicMove.from_coordinates(move)
+        if move.promotion is not None and self.active == 'w':
+            move.promotion = move.promotion.upper()
+        return move
+
+    def _replay_move(self, move):
+        """
+        Validates move and applies it to this game in place, raising the same
+        exceptions as validate_move
+        """
+        self.validate_move(move)
+        self._apply_move(move)
 
-    def _can_move(self):
-        """Returns True if the current side cannot move"""
-        for file_ in [chr(ord('a') + x - 1) for x in xrange(1, 9)]:
-            for rank_ in xrange(1, 9):
-                square = BoardSquare(file_, rank_)
-                piece = self.board.piece_at_board_square(square)
-                if piece is None:
+    def _replay(self, moves):
+        """
+        Generator behind replay and iter_replay. Yields the same, mutated, Game
+        after every ply
+        """
+        game = self._copy()
+        for ply, move in enumerate(moves):
+            try:
+                move = game._coerce_move(move)
+                game._replay_move(move)
+            except (InvalidSquareException, NoPieceAtSquareException,
+                    NotYourTurnException, InvalidMoveException,
+                    MoveMissingPromotionException,
+                    InvalidPromotionDataException) as error:
+                raise InvalidReplayException(ply, move, error)
+            yield game
+
+    def replay(self, moves):
+        """
+        Applies a sequence of moves (BasicMoves or coordinate strings) in one
+        pass, returning a new Game instance with all of them applied. This game
+        is left unchanged. Raises InvalidReplayException naming the first
+        invalid ply
+
+        >>> Game().replay(['f2f3', 'e7e5', 'g2g4', 'd8h4']).is_checkmate()
+        True
+        """
+        game = self
+        for game in self._replay(moves):
+            pass
+        if game is self:
+            game = self._copy()
+        return game
+
+    def iter_replay(self, moves):
+        """
+        As replay, but lazily yields a new Game instance after every ply
+
+        >>> [g.active for g in Game().iter_replay(['e2e4', 'e7e5'])]
+        ['b', 'w']
+        """
+        for game in self._replay(moves):
+            yield game._copy()
+
+    def _own_pieces(self):
+        """
+        Yields (row, col, piece) in _Board coordinates for every piece
+        belonging to the side to move
+        """
+        colour = self.active
+        for row, pieces_in_row in enumerate(self.board.squares):
+            for col, piece in enumerate(pieces_in_row):
+                if piece is not None and _colour_of_piece(piece) == colour:
+                    yield row, col, piece
+
+    def _promotions(self, start, end):
+        """
+        Yields one move per promotion option for the side to move
+        """
+        for promotion in _PROMOTION_ORDER:
+            if self.active == 'b':
+                promotion = promotion.lower()
+            yield BasicMove(start, end, promotion)
+
+    def pseudo_legal_captures(self):
+        """
+        Lazily yields captures (including en passant) and promotions for the
+        side to move, without checking whether they leave the king in check
+        """
+        squares = self.board.squares
+        colour = self.active
+        en_passant = self.en_passant
+        if en_passant is not None:
+            en_passant = en_passant.to_board_coordinates()
+
+        for row, col, piece in self._own_pieces():
+            start = _SQUARES[row][col]
+            kind = piece.upper()
+            if kind == 'P':
+                end_row = row - 1 if colour == 'w' else row + 1
+                promoting = end_row in (0, 7)
+                for end_col in (col - 1, col + 1):
+                    if not 0 <= end_col < 8:
+                        continue
+                    target = squares[end_row][end_col]
+                    if (target is not None and
+                        _colour_of_piece(target) != colour) or (
+                        (end_row, end_col) == en_passant):
+                        end = _SQUARES[end_row][end_col]
+                        if promoting:
+                            for move in self._promotions(start, end):
+                                yield move
+                        else:
+                            yield BasicMove(start, end)
+                if promoting and squares[end_row][col] is None:
+                    for move in self._promotions(start,
+                                                 _SQUARES[end_row][col]):
+                        yield move
+                continue
+
+            offsets, slides = _PIECE_MOVEMENT[kind]
+            for row_delta, col_delta in offsets:
+                end_row = row + row_delta
+                end_col = col + col_delta
+                while 0 <= end_row < 8 and 0 <= end_col < 8:
+                    target = squares[end_row][end_col]
+                    if target is not None:
+                        if _colour_of_piece(target) != colour:
+                            yield BasicMove(start, _SQUARES[end_row][end_col])
+                        break
+                    if not slides:
+                        break
+                    end_row += row_delta
+                    end_col += col_delta
+
+    def pseudo_legal_quiets(self):
+        """
+        Lazily yields non-capturing, non-promoting moves (including castling)
+        for the side to move, without checking whether they leave the king in
+        check
+        """
+        squares = self.board.squares
+        colour = self.active
+
+        for row, col, piece in self._own_pieces():
+            start = _SQUARES[row][col]
+            kind = piece.upper()
+            if kind == 'P':
+                forward = -1 if colour == 'w' else 1
+                end_row = row + forward
+                if end_row in (0, 7) or squares[end_row][col] is not None:
                     continue
-                colour = _colour_of_piece(piece)
-                if colour != self.active:
+                yield BasicMove(start, _SQUARES[end_row][col])
+                if row == (6 if colour == 'w' else 1) and \
+                        squares[end_row + forward][col] is None:
+                    yield BasicMove(start, _SQUARES[end_row + forward][col])
+                continue
+
+            offsets, slides = _PIECE_MOVEMENT[kind]
+            for row_delta, col_delta in offsets:
+                end_row = row + row_delta
+                end_col = col + col_delta
+                while 0 <= end_row < 8 and 0 <= end_col < 8:
+                    if squares[end_row][end_col] is not None:
+                        break
+                    yield BasicMove(start, _SQUARES[end_row][end_col])
+                    if not slides:
+                        break
+                    end_row += row_delta
+                    end_col += col_delta
+
+            if kind == 'K' and col == 4 and row == (7 if colour == 'w' else 0):
+                if colour == 'w':
+                    kingside = self.castling.white_kingside
+                    queenside = self.castling.white_queenside
+                else:
+                    kingside = self.castling.black_kingside
+                    queenside = self.castling.black_queenside
+                if kingside:
+                    yield BasicMove(start, _SQUARES[row][6])
+                if queenside:
+                    yield BasicMove(start, _SQUARES[row][2])
+
+    def generate_moves(self, hash_move=None, quiets=True):
+        """
+        Lazily yields legal moves for the side to move in stages: the supplied
+        hash_move first (if legal), then captures and promotions (most valuable
+        victim first), then quiet moves (unless quiets is False). Legality is
+        only checked as each move is taken, so stopping early skips the
+        remaining work
+
+        >>> len(list(Game().generate_moves()))
+        20
+        >>> next(Game().generate_moves(hash_move=BasicMove('g1', 'f3')))
+        chess.BasicMove(chess.BoardSquare('g', 1), chess.BoardSquare('f', 3), None)
+        """
+        squares = self.board.squares
+
+        if hash_move is not None:
+            if self.is_legal(hash_move):
+                yield hash_move
+            else:
+                hash_move = None
+
+        stages = [sorted(self.pseudo_legal_captures(),
+                         key=self._capture_order)]
+        if quiets:
+            stages.append(self.pseudo_legal_quiets())
+
+        for stage in stages:
+            for move in stage:
+                if hash_move is not None and move == hash_move and \
+                        move.promotion == hash_move.promotion:
                     continue
-                if self.valid_ends(square):
-                    return True
+                start_row, start_col = move.start.to_board_coordinates()
+                if self._is_legal_move(move, squares[start_row][start_col]):
+                    yield move
+
+    def _capture_order(self, move):
+        """
+        Sort key putting captures of the most valuable victim (counting the
+        gain from any promotion) first, then the least valuable attacker
+        """
+        squares = self.board.squares
+        start_row, start_col = move.start.to_board_coordinates()
+        end_row, end_col = move.end.to_board_coordinates()
+        attacker = squares[start_row][start_col].upper()
+        victim = squares[end_row][end_col]
+        if victim is not None:
+            gain = _ORDERING_VALUES[victim.upper()]
+        elif attacker == 'P' and move.end == self.en_passant:
+            gain = _ORDERING_VALUES['P']
+        else:
+            gain = 0
+        if move.promotion is not None:
+            gain += _ORDERING_VALUES[move.promotion.upper()] - 1
+        return (-gain, _ORDERING_VALUES[attacker])
+
+    def legal_moves(self):
+        """
+        Returns a list of all legal moves for the side to move
+        """
+        return list(self.generate_moves())
+
+    def _can_move(self):
+        """Returns True if the current side can move"""
+        for _ in self.generate_moves():
+            return True
         return False
 
     def is_checkmate(self):
@@ -662,7 +1406,7 @@ class Game(object):
         >>> g.is_checkmate()
         True
         """
-        if self.active not in self.board.check_status():
+        if not self.board.in_check(self.active):
             return False
 
         return not self._can_move()
@@ -682,7 +1426,7 @@ class Game(object):
         >>> g.is_stalemate()
         True
         """
-        if self.active in self.board.check_status():
+        if self.board.in_check(self.active):
             return False
 
         return not self._can_move()
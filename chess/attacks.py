@@ -0,0 +1,214 @@
+# encoding: utf-8
+
+"""
+Attack maps: for each square, the set of pieces of each colour attacking it,
+kept up to date as moves are made
+
+    >>> game = chess.Game('4k3/8/8/8/8/8/8/R3K3 w - - 0 1')
+    >>> game.board.enable_attack_map()
+    >>> game.board.attack_map.attacker_count(0, 0, 'w')
+    1
+    >>> game.move(chess.BasicMove('a1', 'a8')).board.attack_map.in_check('b')
+    True
+
+Squares are numbered row * 8 + col in _Board coordinates, and each square's
+attackers are held as a bitmask of the squares they stand on. Making a move
+only recomputes the attacks of pieces on the squares it changes, and of the
+sliders whose rays reach those squares (and so may now be blocked or
+extended). Check, and whether a square is attacked, are then single lookups
+instead of a scan of the board. The tables behind this are built once and
+cached on disk by chess.tables.
+"""
+
+import chess
+from chess import tables
+
+def _build_tables():
+    """
+    Returns the attack tables by name, for chess.tables to cache
+    """
+    knight_offsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2),
+                      (2, -1), (2, 1))
+    king_offsets = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1),
+                    (1, 0), (1, 1))
+    rook_directions = ((-1, 0), (1, 0), (0, -1), (0, 1))
+    bishop_directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+    def leaper_targets(offsets):
+        targets = []
+        for square in xrange(64):
+            row, col = divmod(square, 8)
+            targets.append(tuple((row + row_delta) * 8 + col + col_delta
+                                 for row_delta, col_delta in offsets
+                                 if 0 <= row + row_delta < 8 and
+                                 0 <= col + col_delta < 8))
+        return targets
+
+    def rays(directions):
+        rays = []
+        for square in xrange(64):
+            row, col = divmod(square, 8)
+            square_rays = []
+            for row_delta, col_delta in directions:
+                ray = []
+                r, c = row + row_delta, col + col_delta
+                while 0 <= r < 8 and 0 <= c < 8:
+                    ray.append((r, c, r * 8 + c))
+                    r += row_delta
+                    c += col_delta
+                if ray:
+                    square_rays.append(ray)
+            rays.append(square_rays)
+        return rays
+
+    return {'knight': leaper_targets(knight_offsets),
+            'king': leaper_targets(king_offsets),
+            'pawn': {'w': leaper_targets(((-1, -1), (-1, 1))),
+                     'b': leaper_targets(((1, -1), (1, 1)))},
+            'sliders': {'R': rays(rook_directions),
+                        'B': rays(bishop_directions),
+                        'Q': rays(rook_directions + bishop_directions)}}
+
+_TABLES = tables.cached('attacks', _build_tables)
+
+#Squares attacked by non-sliding pieces, by square
+KNIGHT_TARGETS = _TABLES['knight']
+KING_TARGETS = _TABLES['king']
+PAWN_TARGETS = _TABLES['pawn']
+
+#(row, col, square) along each ray from each square, nearest first
+_SLIDER_RAYS = _TABLES['sliders']
+
+_SLIDERS = frozenset('RBQrbq')
+
+def _squares_of(mask):
+    """
+    Yields the square numbers set in mask
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def targets(squares, square, piece):
+    """
+    Returns the squares attacked by piece standing on square of the board
+    with the given squares, as a sequence of numbers
+    """
+    kind = piece.upper()
+    if kind == 'P':
+        return PAWN_TARGETS['w' if piece == 'P' else 'b'][square]
+    if kind == 'N':
+        return KNIGHT_TARGETS[square]
+    if kind == 'K':
+        return KING_TARGETS[square]
+    attacked = []
+    for ray in _SLIDER_RAYS[kind][square]:
+        for row, col, target in ray:
+            attacked.append(target)
+            if squares[row][col] is not None:
+                break
+    return attacked
+
+class AttackMap(object):
+    """
+    Which pieces attack each square of a board. Kept in step with the board
+    by update, which _Board.apply_move calls for a board with a map enabled
+    """
+    def __init__(self, squares):
+        #Attacked squares by the square of the attacking piece
+        self.targets = [()] * 64
+        #Mask of the squares of attacking pieces by colour and attacked
+        #square
+        self.attackers = {'w': [0] * 64, 'b': [0] * 64}
+        self.kings = {'w': None, 'b': None}
+        for row, pieces_in_row in enumerate(squares):
+            for col, piece in enumerate(pieces_in_row):
+                if piece is not None:
+                    self._add(squares, row * 8 + col, piece)
+
+    def copy(self):
+        attack_map = AttackMap.__new__(AttackMap)
+        attack_map.targets = self.targets[:]
+        attack_map.attackers = {'w': self.attackers['w'][:],
+                                'b': self.attackers['b'][:]}
+        attack_map.kings = dict(self.kings)
+        return attack_map
+
+    def _add(self, squares, square, piece):
+        attacked = self.targets[square] = targets(squares, square, piece)
+        attackers = self.attackers['w' if piece.isupper() else 'b']
+        bit = 1 << square
+        for target in attacked:
+            attackers[target] |= bit
+        if piece == 'K':
+            self.kings['w'] = square
+        elif piece == 'k':
+            self.kings['b'] = square
+
+    def _remove(self, square):
+        attacked = self.targets[square]
+        if not attacked:
+            return
+        self.targets[square] = ()
+        bit = 1 << square
+        #Whichever colour the piece was, its bit is set on every square
+        #it attacked
+        attackers = self.attackers['w']
+        if not attackers[attacked[0]] & bit:
+            attackers = self.attackers['b']
+        keep = ~bit
+        for target in attacked:
+            attackers[target] &= keep
+
+    def update(self, squares, changed):
+        """
+        Brings the map up to date with squares, where only the squares
+        numbered in changed have had pieces come or go
+        """
+        white, black = self.attackers['w'], self.attackers['b']
+        affected = set(changed)
+        for square in changed:
+            for attacker in _squares_of(white[square] | black[square]):
+                row, col = divmod(attacker, 8)
+                if squares[row][col] in _SLIDERS:
+                    affected.add(attacker)
+        for square in affected:
+            self._remove(square)
+        for square in affected:
+            piece = squares[square // 8][square % 8]
+            if piece is not None:
+                self._add(squares, square, piece)
+
+    def is_attacked(self, row, col, colour):
+        """
+        Returns True if the square at row, col is attacked by colour
+        """
+        return self.attackers[colour][row * 8 + col] != 0
+
+    def attacker_count(self, row, col, colour):
+        """
+        Returns the number of colour's pieces attacking the square at row, col
+        """
+        return bin(self.attackers[colour][row * 8 + col]).count('1')
+
+    def in_check(self, colour):
+        """
+        Returns True if colour's king is attacked
+        """
+        king = self.kings[colour]
+        if king is None:
+            return False
+        return self.attackers['b' if colour == 'w' else 'w'][king] != 0
+
+    def king_zone_attacks(self, colour):
+        """
+        Returns the number of attacks by the other colour on colour's king
+        and the squares around it, a measure of king safety
+        """
+        king = self.kings[colour]
+        if king is None:
+            return 0
+        attackers = self.attackers['b' if colour == 'w' else 'w']
+        return sum(bin(attackers[square]).count('1')
+                   for square in KING_TARGETS[king] + (king,))
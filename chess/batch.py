@@ -0,0 +1,371 @@
+# encoding: utf-8
+
+"""
+Compact, column-wise storage for large numbers of positions.
+
+Each position takes 71 bytes: one byte per square, then side to move, castling
+bits, en passant square, half move clock and full move number. Games are only
+materialised on demand.
+
+    >>> batch = PositionBatch()
+    >>> batch.append_fen('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
+    >>> batch.append(chess.Game().move(chess.BasicMove('e2', 'e4')))
+    >>> len(batch), len(batch.filter_side('b'))
+    (2, 1)
+    >>> batch[1].fen()
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1'
+"""
+
+import array
+import string
+import struct
+
+import chess
+
+#Piece for each square code; code 0 is an empty square
+PIECE_CODES = '.PNBRQKpnbrqk'
+
+SIDE_CODES = 'wb'
+
+#Castling right for each bit, lowest first
+CASTLING_BITS = 'KQkq'
+
+NO_EN_PASSANT = 255
+
+#A whole position as a fixed-width record: board, side, castling, en passant,
+#half move clock, full move number
+RECORD = struct.Struct('<64sBBBHH')
+
+_ENCODE_BOARD = string.maketrans(PIECE_CODES, ''.join(
+    chr(code) for code in xrange(len(PIECE_CODES))))
+_DECODE_BOARD = string.maketrans(''.join(
+    chr(code) for code in xrange(len(PIECE_CODES))), PIECE_CODES)
+
+def _castling_bits(castling_fen):
+    bits = 0
+    for bit, right in enumerate(CASTLING_BITS):
+        if right in castling_fen:
+            bits |= 1 << bit
+    return bits
+
+def _castling_fen(bits):
+    return ''.join(right for bit, right in enumerate(CASTLING_BITS)
+                   if bits & (1 << bit)) or '-'
+
+def _en_passant_index(square):
+    if square is None:
+        return NO_EN_PASSANT
+    row, col = square.to_board_coordinates()
+    return row * 8 + col
+
+def _en_passant_square(index):
+    if index == NO_EN_PASSANT:
+        return None
+    return chess._SQUARES[index // 8][index % 8]
+
+def encode_game(game):
+    """
+    Returns the fields of a packed position for game: (board bytes, side,
+    castling bits, en passant index, half move clock, full move number)
+    """
+    board = ''.join(piece or '.' for row in game.board.squares
+                    for piece in row).translate(_ENCODE_BOARD)
+    return (board, SIDE_CODES.index(game.active),
+            _castling_bits(game.castling.fen()),
+            _en_passant_index(game.en_passant), game.halfmove, game.fullmove)
+
+def encode_fen(fen):
+    """
+    As encode_game, but straight from a FEN string without building a Game
+    """
+    return encode_fen_fields(*fen.split(' '))
+
+def encode_fen_fields(board, active, castling, en_passant, halfmove,
+                      fullmove):
+    """
+    As encode_fen, for a FEN already split into its six fields
+    """
+    expanded = chess._expand_board_rows(board)
+    if len(expanded) != 71 or expanded[8::9] != chess._ROW_SEPARATORS or \
+            expanded.translate(None, PIECE_CODES + '/'):
+        raise ValueError('"%s" does not describe 64 squares' % board)
+    if en_passant == '-':
+        en_passant = NO_EN_PASSANT
+    else:
+        en_passant = _en_passant_index(chess.BoardSquare(en_passant))
+    return (expanded.replace('/', '').translate(_ENCODE_BOARD),
+            SIDE_CODES.index(active), _castling_bits(castling), en_passant,
+            int(halfmove), int(fullmove))
+
+def check_fen(fen):
+    """
+    Returns fen as a str, raising ValueError unless it's a well-formed
+    position: 64 squares of known pieces, one king each, and valid side,
+    castling, en passant and move fields. chess.Game itself checks much less
+
+    >>> check_fen('8/8/8/8/8/8/8/4K3 w - - 0 1')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid FEN '8/8/8/8/8/8/8/4K3 w - - 0 1': needs exactly one k
+    """
+    try:
+        fields = str(fen).split(' ') if isinstance(fen, basestring) else ()
+    except UnicodeError:
+        fields = ()
+    if len(fields) != 6:
+        raise ValueError('invalid FEN %r: expected 6 fields' % (fen,))
+    active, castling, en_passant = fields[1:4]
+    try:
+        if active not in SIDE_CODES:
+            raise ValueError('bad side to move %r' % active)
+        if en_passant != '-' and \
+                en_passant[1:] != ('6' if active == 'w' else '3'):
+            raise ValueError('bad en passant square %r' % en_passant)
+        board = encode_fen_fields(*fields)[0]
+        if castling != '-' and (not castling or
+                                castling.strip(CASTLING_BITS) or
+                                len(set(castling)) != len(castling)):
+            raise ValueError('bad castling field %r' % castling)
+    except (ValueError, chess.InvalidSquareException) as error:
+        raise ValueError('invalid FEN %r: %s' % (fen, error))
+    for king in 'Kk':
+        if board.count(chr(PIECE_CODES.index(king))) != 1:
+            raise ValueError('invalid FEN %r: needs exactly one %s' %
+                             (fen, king))
+    return ' '.join(fields)
+
+def decode_fen(board, side, castling, en_passant, halfmove, fullmove):
+    """
+    Returns the FEN of the fields of a packed position, without building a
+    Game
+    """
+    pieces = str(board).translate(_DECODE_BOARD)
+    rows = '/'.join([pieces[i:i + 8] for i in xrange(0, 64, 8)])
+    #Runs never cross a separator, so replacing longest first is exact
+    for length in xrange(8, 0, -1):
+        rows = rows.replace('.' * length, str(length))
+    if en_passant == NO_EN_PASSANT:
+        en_passant = '-'
+    else:
+        en_passant = 'abcdefgh'[en_passant % 8] + str(8 - en_passant // 8)
+    return '%s %s %s %s %d %d' % (rows, SIDE_CODES[side],
+                                  _castling_fen(castling), en_passant,
+                                  halfmove, fullmove)
+
+def decode_game(board, side, castling, en_passant, halfmove, fullmove):
+    """
+    Materialises a Game from the fields of a packed position
+    """
+    pieces = str(board).translate(_DECODE_BOARD)
+    squares = [[None if piece == '.' else piece
+                for piece in pieces[row * 8:row * 8 + 8]]
+               for row in xrange(8)]
+    return chess.Game._from_state(
+        chess._Board(squares=squares), SIDE_CODES[side],
+        chess._CastlingState(_castling_fen(castling)),
+        _en_passant_square(en_passant), halfmove, fullmove)
+
+def pack_game(game):
+    """
+    Returns game as a single RECORD.size byte string
+    """
+    return RECORD.pack(*encode_game(game))
+
+def unpack_game(record, offset=0):
+    """
+    Materialises a Game from a RECORD in record (any buffer) at offset
+    """
+    return decode_game(*RECORD.unpack_from(record, offset))
+
+def material_signature(board):
+    """
+    Returns a material signature such as 'KRPkr' (white pieces then black,
+    each in KQRBNP order) for packed board bytes
+
+    >>> material_signature(encode_fen('4k3/8/8/8/8/8/4P3/R3K3 w - - 0 1')[0])
+    'KRPk'
+    """
+    board = str(board)
+    signature = []
+    for piece in 'KQRBNPkqrbnp':
+        signature.append(piece * board.count(chr(PIECE_CODES.index(piece))))
+    return ''.join(signature)
+
+class _Columns(object):
+    """
+    The underlying growable buffers, shared by a PositionBatch and its views
+    """
+    def __init__(self):
+        self.boards = bytearray()
+        self.sides = bytearray()
+        self.castling = bytearray()
+        self.en_passant = bytearray()
+        self.halfmoves = array.array('H')
+        self.fullmoves = array.array('H')
+
+    def __len__(self):
+        return len(self.sides)
+
+    def append(self, board, side, castling, en_passant, halfmove, fullmove):
+        self.boards.extend(board)
+        self.sides.append(side)
+        self.castling.append(castling)
+        self.en_passant.append(en_passant)
+        self.halfmoves.append(halfmove)
+        self.fullmoves.append(fullmove)
+
+    def fields(self, row):
+        return (str(self.boards[row * 64:row * 64 + 64]), self.sides[row],
+                self.castling[row], self.en_passant[row], self.halfmoves[row],
+                self.fullmoves[row])
+
+class PositionBatch(object):
+    """
+    A sequence of positions stored column-wise. Indexing returns a Game;
+    slicing and filtering return views sharing the same storage, so no
+    position data is copied. Only a batch created directly (not a view) can be
+    appended to
+    """
+    def __init__(self, games=()):
+        self._columns = _Columns()
+        #None for every row of _columns, else an xrange or array of row numbers
+        self._index = None
+        for game in games:
+            self.append(game)
+
+    @classmethod
+    def _view(cls, columns, index):
+        view = cls.__new__(cls)
+        view._columns = columns
+        view._index = index
+        return view
+
+    def _rows(self):
+        if self._index is None:
+            return xrange(len(self._columns))
+        return self._index
+
+    def __len__(self):
+        return len(self._rows())
+
+    def nbytes(self):
+        """
+        Returns the number of bytes of position data in the underlying storage
+        """
+        columns = self._columns
+        return (len(columns.boards) + len(columns.sides) +
+                len(columns.castling) + len(columns.en_passant) +
+                columns.halfmoves.itemsize * len(columns.halfmoves) +
+                columns.fullmoves.itemsize * len(columns.fullmoves))
+
+    def append(self, game):
+        self._append_fields(encode_game(game))
+
+    def append_fen(self, fen):
+        self._append_fields(encode_fen(fen))
+
+    def append_record(self, record, offset=0):
+        """
+        Appends a position packed as a RECORD
+        """
+        self._append_fields(RECORD.unpack_from(record, offset))
+
+    def _append_fields(self, fields):
+        if self._index is not None:
+            raise TypeError('cannot append to a view of a PositionBatch')
+        self._columns.append(*fields)
+
+    def __getitem__(self, item):
+        rows = self._rows()
+        if isinstance(item, slice):
+            return self._view(self._columns, _slice_rows(rows, item))
+        return decode_game(*self._columns.fields(rows[item]))
+
+    def __iter__(self):
+        columns = self._columns
+        for row in self._rows():
+            yield decode_game(*columns.fields(row))
+
+    def record(self, i):
+        """
+        Returns position i packed as a RECORD, without materialising a Game
+        """
+        return RECORD.pack(*self._columns.fields(self._rows()[i]))
+
+    def pack_into(self, buffer, offset=0):
+        """
+        Packs every position as a RECORD into buffer (any writable buffer,
+        such as a multiprocessing.RawArray) from offset on, without
+        materialising Games. Returns the number of positions
+        """
+        columns = self._columns
+        pack_into = RECORD.pack_into
+        count = 0
+        for row in self._rows():
+            pack_into(buffer, offset, *columns.fields(row))
+            offset += RECORD.size
+            count += 1
+        return count
+
+    def fens(self):
+        """
+        Yields the FEN of each position, without materialising Games
+        """
+        columns = self._columns
+        for row in self._rows():
+            yield decode_fen(*columns.fields(row))
+
+    def sides(self):
+        """
+        Returns the side to move ('w' or 'b') of every position
+        """
+        sides = self._columns.sides
+        return [SIDE_CODES[sides[row]] for row in self._rows()]
+
+    def material_signatures(self):
+        """
+        Returns the material_signature of every position
+        """
+        boards = self._columns.boards
+        return [material_signature(boards[row * 64:row * 64 + 64])
+                for row in self._rows()]
+
+    def select(self, mask):
+        """
+        Returns a view of the positions for which mask (an iterable of
+        booleans, one per position) is true
+        """
+        return self._view(self._columns, array.array(
+            'L', (row for row, keep in zip(self._rows(), mask) if keep)))
+
+    def filter_side(self, colour):
+        """
+        Returns a view of the positions with colour ('w' or 'b') to move
+        """
+        code = SIDE_CODES.index(colour)
+        sides = self._columns.sides
+        return self._view(self._columns, array.array(
+            'L', (row for row in self._rows() if sides[row] == code)))
+
+    def filter_material(self, signature):
+        """
+        Returns a view of the positions with the given material_signature
+        """
+        return self.select(position_signature == signature
+                           for position_signature in self.material_signatures())
+
+def _slice_rows(rows, item):
+    """
+    Applies slice item to rows (an xrange or array of row numbers), returning
+    an xrange where possible so that slicing never copies
+    """
+    start, stop, step = item.indices(len(rows))
+    if isinstance(rows, xrange):
+        if not len(rows):
+            return xrange(0)
+        base_step = rows[1] - rows[0] if len(rows) > 1 else 1
+        count = len(xrange(start, stop, step))
+        first = rows[0] + start * base_step
+        return xrange(first, first + count * step * base_step,
+                      step * base_step)
+    return rows[start:stop:step]
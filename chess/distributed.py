@@ -0,0 +1,535 @@
+# encoding: utf-8
+
+"""
+Distributed analysis: a coordinator splits a job into units of work and hands
+them to worker processes, on any number of hosts, over TCP:
+
+    python -m chess.distributed perft --port 7788 --depth 5
+    python -m chess.distributed worker --host coordinator.example --port 7788
+
+Like chess.server, messages are newline-delimited JSON objects with an "op"
+field. A worker says hello, then is sent one unit at a time:
+
+    coordinator -> worker    work {unit, kind, args}, shutdown
+    worker -> coordinator    hello {name}, heartbeat, result {unit, result},
+                             error {unit, error}
+
+Workers send heartbeats throughout, including while working. A worker that
+goes quiet for longer than the heartbeat timeout, or disconnects, is dropped
+and its unit goes back to the front of the queue for another worker.
+
+Jobs are split into units by root move (for perft and search) or into chunks
+of positions (for analysing a batch of FENs); each has its own kind, run by a
+function in TASKS, and results are merged back on the coordinator.
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import socket
+import SocketServer
+import sys
+import threading
+from timeit import default_timer
+
+import chess
+from chess import epd, search
+
+#Seconds between worker heartbeats, and of silence before a worker is
+#considered dead
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 5.0
+
+#FENs per unit when analysing a batch
+CHUNK_SIZE = 16
+
+class DistributedException(Exception):
+    """
+    Raised when a job fails: a unit raised on its worker, or the job timed out
+    """
+    pass
+
+def perft(game, depth):
+    """
+    Returns the number of leaf nodes of the legal move tree of game, depth
+    plies deep
+
+    >>> perft(chess.Game(), 2)
+    400
+    """
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return sum(1 for _ in game.generate_moves())
+    return sum(perft(search.make_move(game, move), depth - 1)
+               for move in game.generate_moves())
+
+def _perft_task(fen, depth):
+    """
+    Worker function: perft of one subtree
+    """
+    return perft(chess.Game(fen), depth)
+
+def _root_score(score):
+    """
+    Converts a score from after a root move to one from the root
+    """
+    if score > search.MATE_THRESHOLD:
+        return -score + 1
+    if score < -search.MATE_THRESHOLD:
+        return -score - 1
+    return -score
+
+def _search_task(fen, move, depth):
+    """
+    Worker function: searches the position after one root move, returning its
+    score from the root's point of view, the principal variation and nodes
+    """
+    game = chess.Game(fen)
+    move = game._coerce_move(move)
+    result = search.Searcher().search(
+        search.make_move(game, move),
+        search.SearchLimits(depth=max(depth - 1, 1)))
+    return {'score': _root_score(result.score),
+            'pv': [move.coordinates()] +
+                  [reply.coordinates() for reply in result.pv],
+            'nodes': result.nodes}
+
+def _analyse_task(fens, depth):
+    """
+    Worker function: searches each of a chunk of positions, returning
+    [best move or None, score] for each
+    """
+    results = []
+    for fen in fens:
+        result = search.Searcher().search(chess.Game(fen),
+                                          search.SearchLimits(depth=depth))
+        best_move = result.best_move
+        results.append([best_move.coordinates() if best_move else None,
+                        result.score])
+    return results
+
+#Functions run by workers, by unit kind
+TASKS = {
+    'perft': _perft_task,
+    'search': _search_task,
+    'analyse': _analyse_task,
+}
+
+class _Connection(object):
+    """
+    JSON lines over a socket, with sends safe to make from several threads
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message) + '\n'
+        with self._lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """
+        Returns the next message, or None at end of stream
+        """
+        line = self.rfile.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+class _WorkerLost(Exception):
+    pass
+
+class _Job(object):
+    def __init__(self, units):
+        self.units = units
+        self.pending = collections.deque(xrange(len(units)))
+        self.results = {}
+        self.error = None
+
+    @property
+    def done(self):
+        return self.error is not None or len(self.results) == len(self.units)
+
+class _Handler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.server.coordinator._serve(self.request)
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, coordinator):
+        SocketServer.TCPServer.__init__(self, address, _Handler)
+        self.coordinator = coordinator
+
+class Coordinator(object):
+    """
+    Accepts workers and farms jobs out to them. Listens on port (0 picks a
+    free one; see address) once started. Jobs run one at a time, each
+    blocking until every unit is done; workers may come and go throughout
+
+    >>> with Coordinator() as coordinator:
+    ...     worker = threading.Thread(target=Worker(coordinator.address).run)
+    ...     worker.start()
+    ...     coordinator.perft(chess.Game(), 3)[0]
+    8902
+    """
+    def __init__(self, host='127.0.0.1', port=0,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.stats = {'workers': 0, 'units': 0, 'reassigned': 0}
+        self._condition = threading.Condition()
+        self._job = None
+        self._closed = False
+        self._server = _Server((host, port), self)
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """
+        Tells connected workers to shut down, and stops listening
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_unit(self):
+        """
+        Waits for a unit to hand out, returning (job, unit index), or None
+        once closed
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                job = self._job
+                if job is not None and job.pending and not job.done:
+                    self.stats['units'] += 1
+                    return job, job.pending.popleft()
+                self._condition.wait(self.heartbeat_timeout)
+
+    def _await_result(self, connection, unit):
+        """
+        Reads messages from a worker until the result of unit arrives
+        """
+        while True:
+            try:
+                message = connection.receive()
+            except (socket.error, ValueError):
+                raise _WorkerLost()
+            if message is None:
+                raise _WorkerLost()
+            op = message.get('op')
+            if op == 'heartbeat':
+                continue
+            if message.get('unit') != unit:
+                continue
+            if op == 'result':
+                return message.get('result')
+            if op == 'error':
+                raise DistributedException(message.get('error'))
+
+    def _serve(self, sock):
+        """
+        Runs one worker's connection: hands it units until it's lost or the
+        coordinator closes
+        """
+        sock.settimeout(self.heartbeat_timeout)
+        connection = _Connection(sock)
+        try:
+            hello = connection.receive()
+        except (socket.error, ValueError):
+            hello = None
+        if hello is None or hello.get('op') != 'hello':
+            connection.close()
+            return
+        with self._condition:
+            self.stats['workers'] += 1
+
+        try:
+            while True:
+                assignment = self._next_unit()
+                if assignment is None:
+                    try:
+                        connection.send({'op': 'shutdown'})
+                    except socket.error:
+                        pass
+                    return
+                job, unit = assignment
+                kind, args = job.units[unit]
+                try:
+                    connection.send({'op': 'work', 'unit': unit, 'kind': kind,
+                                     'args': args})
+                    result = self._await_result(connection, unit)
+                except (_WorkerLost, socket.error):
+                    with self._condition:
+                        if unit not in job.results:
+                            job.pending.appendleft(unit)
+                            self.stats['reassigned'] += 1
+                        self._condition.notify_all()
+                    return
+                except DistributedException as error:
+                    with self._condition:
+                        job.error = error
+                        self._condition.notify_all()
+                    continue
+                with self._condition:
+                    job.results[unit] = result
+                    self._condition.notify_all()
+        finally:
+            with self._condition:
+                self.stats['workers'] -= 1
+            connection.close()
+
+    def run(self, units, timeout=None):
+        """
+        Runs a job of (kind, args) units, returning their results in order.
+        Raises DistributedException if a unit fails or the job takes longer
+        than timeout seconds
+        """
+        job = _Job(units)
+        deadline = default_timer() + timeout if timeout is not None else None
+        with self._condition:
+            if self._job is not None:
+                raise DistributedException('a job is already running')
+            self._job = job
+            self._condition.notify_all()
+            try:
+                while not job.done:
+                    if deadline is not None:
+                        remaining = deadline - default_timer()
+                        if remaining <= 0:
+                            raise DistributedException('job timed out')
+                        self._condition.wait(remaining)
+                    else:
+                        #Waiting without a timeout can't be interrupted
+                        self._condition.wait(self.heartbeat_timeout)
+            finally:
+                self._job = None
+        if job.error is not None:
+            raise job.error
+        return [job.results[unit] for unit in xrange(len(units))]
+
+    def perft(self, game, depth, timeout=None):
+        """
+        Returns (perft of game to depth, {root move coordinates: count}), one
+        unit per root move
+        """
+        moves = list(game.generate_moves())
+        if depth == 0 or not moves:
+            return (1 if depth == 0 else 0), {}
+        counts = self.run([('perft', {'fen': search.make_move(game,
+                                                               move).fen(),
+                                      'depth': depth - 1})
+                           for move in moves], timeout)
+        divide = dict((move.coordinates(), count)
+                      for move, count in zip(moves, counts))
+        return sum(counts), divide
+
+    def search(self, game, depth, timeout=None):
+        """
+        Searches game to depth, one unit per root move, returning a
+        chess.search.SearchResult. Each root move is searched with a full
+        window and its own transposition table, so this pays off only when
+        there are workers to spare
+        """
+        started = default_timer()
+        moves = list(game.generate_moves())
+        if not moves:
+            score = -search.MATE_SCORE if game.board.in_check(game.active) \
+                else 0
+            return search.SearchResult(None, score, 0, [], 0, 0.0)
+        fen = game.fen()
+        results = self.run([('search', {'fen': fen,
+                                        'move': move.coordinates(),
+                                        'depth': depth})
+                            for move in moves], timeout)
+        best = max(xrange(len(moves)),
+                   key=lambda i: (results[i]['score'], -i))
+        pv = []
+        replay = game
+        for coordinates in results[best]['pv']:
+            move = replay._coerce_move(coordinates)
+            pv.append(move)
+            replay = search.make_move(replay, move)
+        return search.SearchResult(moves[best], results[best]['score'], depth,
+                                   pv, sum(result['nodes']
+                                           for result in results),
+                                   default_timer() - started)
+
+    def analyse(self, fens, depth, chunk_size=CHUNK_SIZE, timeout=None):
+        """
+        Searches each FEN to depth, chunk_size positions per unit, returning
+        (best move coordinates or None, score) for each in order
+        """
+        fens = list(fens)
+        chunks = self.run([('analyse', {'fens': fens[i:i + chunk_size],
+                                        'depth': depth})
+                           for i in xrange(0, len(fens), chunk_size)],
+                          timeout)
+        return [tuple(result) for chunk in chunks for result in chunk]
+
+class Worker(object):
+    """
+    Connects to a coordinator at address and runs the units it is sent until
+    told to shut down or disconnected
+    """
+    def __init__(self, address, name=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.address = tuple(address)
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.heartbeat_interval = heartbeat_interval
+        self.units = 0
+
+    def _heartbeat(self, connection, stopped):
+        while not stopped.wait(self.heartbeat_interval):
+            try:
+                connection.send({'op': 'heartbeat'})
+            except socket.error:
+                return
+
+    def run(self):
+        """
+        Works until shut down, returning the number of units done
+        """
+        connection = _Connection(socket.create_connection(self.address))
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat,
+                                     args=(connection, stopped))
+        heartbeat.daemon = True
+        try:
+            connection.send({'op': 'hello', 'name': self.name})
+            heartbeat.start()
+            while True:
+                try:
+                    message = connection.receive()
+                except socket.error:
+                    break
+                if message is None or message.get('op') == 'shutdown':
+                    break
+                if message.get('op') != 'work':
+                    continue
+                unit = message['unit']
+                try:
+                    task = TASKS[message['kind']]
+                    reply = {'op': 'result', 'unit': unit,
+                             'result': task(**message['args'])}
+                except Exception as error:
+                    reply = {'op': 'error', 'unit': unit,
+                             'error': '%s: %s' % (error.__class__.__name__,
+                                                  error)}
+                try:
+                    connection.send(reply)
+                except socket.error:
+                    break
+                if reply['op'] == 'result':
+                    self.units += 1
+        finally:
+            stopped.set()
+            connection.close()
+        return self.units
+
+def _run_worker(address):
+    """
+    Worker function: runs a Worker in a child process
+    """
+    return Worker(address).run()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed analysis')
+    commands = parser.add_subparsers(dest='command')
+
+    worker = commands.add_parser('worker', help='work for a coordinator')
+    worker.add_argument('--host', default='127.0.0.1')
+    worker.add_argument('--port', type=int, required=True)
+    worker.add_argument('--name')
+
+    jobs = []
+    for name, help_text in (('perft', 'count leaf nodes to a depth'),
+                            ('search', 'search a position'),
+                            ('analyse', 'search each position in a file')):
+        job = commands.add_parser(name, help=help_text)
+        job.add_argument('--host', default='127.0.0.1',
+                         help='address to listen on')
+        job.add_argument('--port', type=int, default=0)
+        job.add_argument('--depth', type=int, required=True)
+        job.add_argument('--local', type=int, default=0,
+                         help='worker processes to start on this host')
+        if name == 'analyse':
+            job.add_argument('file', help='FEN or EPD file')
+        else:
+            job.add_argument('--fen',
+                             help='position (default: starting position)')
+        jobs.append(job)
+
+    args = parser.parse_args(argv)
+    if args.command == 'worker':
+        units = Worker((args.host, args.port), args.name).run()
+        print 'Worked %d units' % units
+        return 0
+
+    with Coordinator(args.host, args.port) as coordinator:
+        print >> sys.stderr, 'Listening on %s:%d' % coordinator.address
+        processes = [multiprocessing.Process(target=_run_worker,
+                                             args=(coordinator.address,))
+                     for _ in xrange(args.local)]
+        for process in processes:
+            process.daemon = True
+            process.start()
+
+        started = default_timer()
+        if args.command == 'perft':
+            total, divide = coordinator.perft(chess.Game(args.fen), args.depth)
+            for move in sorted(divide):
+                print '%s: %d' % (move, divide[move])
+            print 'Nodes: %d' % total
+        elif args.command == 'search':
+            result = coordinator.search(chess.Game(args.fen), args.depth)
+            print 'bestmove %s score %d nodes %d pv %s' % (
+                result.best_move.coordinates() if result.best_move else
+                '(none)', result.score, result.nodes,
+                ' '.join(move.coordinates() for move in result.pv))
+        else:
+            with open(args.file) as records:
+                fens = list(epd.EPDReader(records).fens())
+            for fen, (move, score) in zip(fens, coordinator.analyse(
+                    fens, args.depth)):
+                print '%s bm %s; ce %d;' % (' '.join(fen.split(' ')[:4]),
+                                            move or '(none)', score)
+        print >> sys.stderr, 'Done in %.1fs: %d units, %d reassigned' % (
+            default_timer() - started, coordinator.stats['units'],
+            coordinator.stats['reassigned'])
+    for process in processes:
+        process.join()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,385 @@
+# encoding: utf-8
+
+"""
+Streaming readers and writers for files holding one FEN or EPD record per line.
+
+An EPD record is the first four fields of a FEN followed by operations, each an
+opcode, its operands and a semicolon; a FEN line may carry operations too:
+
+    >>> import StringIO
+    >>> reader = EPDReader(StringIO.StringIO(
+    ...     '6k1/5ppp/8/8/8/8/8/R5K1 w - - bm Ra8#; id "mate.001";\\n'
+    ...     'not a position\\n'), errors='skip')
+    >>> record = next(iter(reader))
+    >>> record.bm, record.id
+    (['Ra8#'], 'mate.001')
+    >>> record.fen
+    '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+    >>> list(reader), reader.malformed
+    ([], 1)
+
+Files are read in large blocks and each line is split with a handful of regular
+expression and string operations, never a Python loop per character. Records
+can be turned into (lazily parsed) Games, or go straight into a PositionBatch
+without building a Game at all.
+"""
+
+import re
+
+import chess
+from chess import batch as _batch
+
+#Bytes read from the file at a time
+BLOCK_SIZE = 1 << 20
+
+#Opcodes whose operands are strings, and so always written quoted
+STRING_OPCODES = frozenset(['id'] + ['c%d' % i for i in xrange(10)])
+
+#The four position fields, optional clocks, then any operations
+_RECORD = re.compile(
+    r'([1-8pnbrqkPNBRQK/]+)\s+([wb])\s+(-|(?=[KQkq])K?Q?k?q?)\s+'
+    r'(-|[a-h][36])(?:\s+(\d+)\s+(\d+)(?=\s|$))?\s*(.*)$')
+
+_OPERATION = r'[A-Za-z]\w*(?:\s+(?:"[^"]*"|[^\s;"]+))*\s*;'
+_OPERATIONS = re.compile(r'(?:%s\s*)*$' % _OPERATION)
+_OPCODE = re.compile(r'([A-Za-z]\w*)([^;"]*(?:"[^"]*"[^;"]*)*);')
+_OPERAND = re.compile(r'"([^"]*)"|([^\s;"]+)')
+_HALFMOVE = re.compile(r'\bhmvc\s+(\d+)\s*;')
+_FULLMOVE = re.compile(r'\bfmvn\s+(\d+)\s*;')
+
+class MalformedLineException(ValueError):
+    """
+    Raised for a line that isn't a valid FEN or EPD record. The (one-based)
+    line number, the line and the reason are available as line_number, line
+    and reason respectively
+    """
+    def __init__(self, line_number, line, reason):
+        ValueError.__init__(self, 'line %d: %s: %r' % (line_number, reason,
+                                                      line))
+        self.line_number = line_number
+        self.line = line
+        self.reason = reason
+
+def parse_operations(text):
+    """
+    Parses the operations part of an EPD record into a dict of opcode to list
+    of operands, raising ValueError if it's malformed. A missing semicolon
+    after the last operation is tolerated
+
+    >>> sorted(parse_operations('bm Nf3 Qd1+; id "WAC; 1"').items())
+    [('bm', ['Nf3', 'Qd1+']), ('id', ['WAC; 1'])]
+    """
+    text = text.strip()
+    if not text:
+        return {}
+    if not text.endswith(';'):
+        text += ';'
+    if not _OPERATIONS.match(text):
+        raise ValueError('malformed operations')
+    operations = {}
+    for opcode, operands in _OPCODE.findall(text):
+        operations[opcode] = [quoted or bare for quoted, bare
+                              in _OPERAND.findall(operands)]
+    return operations
+
+def _split_record(line):
+    """
+    Returns the six FEN fields and the operations text of line, or raises
+    ValueError
+    """
+    match = _RECORD.match(line)
+    if match is None:
+        raise ValueError('not a FEN or EPD record')
+    board, active, castling, en_passant, halfmove, fullmove, operations = \
+        match.groups()
+    expanded = chess._expand_board_rows(board)
+    if len(expanded) != 71 or expanded[8::9] != chess._ROW_SEPARATORS:
+        raise ValueError('board does not describe 64 squares')
+    if halfmove is None:
+        halfmove, fullmove = '0', '1'
+        #EPD keeps the clocks as operations, if at all
+        if 'hmvc' in operations:
+            match = _HALFMOVE.search(operations)
+            if match:
+                halfmove = match.group(1)
+        if 'fmvn' in operations:
+            match = _FULLMOVE.search(operations)
+            if match:
+                fullmove = match.group(1)
+    return (board, active, castling, en_passant, halfmove, fullmove), \
+        operations
+
+class EPDRecord(object):
+    """
+    One position and its EPD operations (a dict of opcode to operand list).
+    fen is always a full six-field FEN; clocks missing from an EPD record are
+    taken from its hmvc and fmvn operations, or default to 0 and 1
+    """
+    def __init__(self, fen, operations=None):
+        self.fen = fen
+        self.operations = operations or {}
+
+    def __repr__(self):
+        return '%s.%s(%r, %r)' % (self.__class__.__module__,
+                                  self.__class__.__name__,
+                                  self.fen,
+                                  self.operations)
+
+    def __eq__(self, other):
+        return self.fen == other.fen and self.operations == other.operations
+
+    def __ne__(self, other):
+        return not self == other
+
+    def game(self, lazy=True):
+        """
+        Returns a Game for the position, by default with its board parsed
+        only on first use
+        """
+        return chess.Game(self.fen, lazy=lazy)
+
+    @property
+    def bm(self):
+        """
+        The best moves, as given (usually SAN), or an empty list
+        """
+        return self.operations.get('bm', [])
+
+    @property
+    def am(self):
+        """
+        The moves to avoid, as given (usually SAN), or an empty list
+        """
+        return self.operations.get('am', [])
+
+    @property
+    def id(self):
+        """
+        The record's identifier, or None
+        """
+        return ' '.join(self.operations['id']) \
+            if 'id' in self.operations else None
+
+    @property
+    def c0(self):
+        """
+        The record's primary comment, or None
+        """
+        return ' '.join(self.operations['c0']) \
+            if 'c0' in self.operations else None
+
+class EPDReader(object):
+    """
+    Reads FEN or EPD records, one per line, from a file object in blocks of
+    block_size bytes. Blank lines are ignored. errors decides what happens to
+    a malformed line: 'raise' raises MalformedLineException, 'skip' ignores
+    it, and a callable is passed the MalformedLineException and reading
+    carries on. lines and malformed count the lines seen so far
+    """
+    def __init__(self, fileobj, errors='raise', block_size=BLOCK_SIZE):
+        if errors not in ('raise', 'skip') and not callable(errors):
+            raise ValueError('errors must be "raise", "skip" or callable')
+        self.fileobj = fileobj
+        self.errors = errors
+        self.block_size = block_size
+        self.lines = 0
+        self.malformed = 0
+        self._pending = None
+
+    def _lines(self):
+        """
+        Yields (line number, line) for each non-blank line, continuing from
+        wherever the reader left off
+        """
+        if self._pending is None:
+            self._pending = self._read_lines()
+        return self._pending
+
+    def _read_lines(self):
+        read = self.fileobj.read
+        size = self.block_size
+        partial = ''
+        while True:
+            block = read(size)
+            if not block:
+                break
+            lines = (partial + block).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                self.lines += 1
+                line = line.strip()
+                if line:
+                    yield self.lines, line
+        if partial.strip():
+            self.lines += 1
+            yield self.lines, partial.strip()
+
+    def _malformed(self, line_number, line, error):
+        self.malformed += 1
+        error = MalformedLineException(line_number, line, str(error))
+        if self.errors == 'raise':
+            raise error
+        if self.errors != 'skip':
+            self.errors(error)
+
+    def __iter__(self):
+        """
+        Yields an EPDRecord for each valid line
+        """
+        for line_number, line in self._lines():
+            try:
+                fields, operations = _split_record(line)
+                operations = parse_operations(operations)
+            except ValueError as error:
+                self._malformed(line_number, line, error)
+                continue
+            yield EPDRecord(' '.join(fields), operations)
+
+    def fens(self):
+        """
+        Yields the full FEN of each valid line. Operations aren't parsed, so
+        only a malformed position makes a line malformed here
+        """
+        for line_number, line in self._lines():
+            try:
+                fields, _ = _split_record(line)
+            except ValueError as error:
+                self._malformed(line_number, line, error)
+                continue
+            yield ' '.join(fields)
+
+    def games(self, lazy=True):
+        """
+        Yields a Game for each valid line, by default with boards parsed only
+        on first use
+        """
+        for fen in self.fens():
+            yield chess.Game(fen, lazy=lazy)
+
+    def to_batch(self, batch=None):
+        """
+        Appends every valid position to batch (a new PositionBatch by
+        default) without building any Games, and returns it
+        """
+        if batch is None:
+            batch = _batch.PositionBatch()
+        append = batch._append_fields
+        for line_number, line in self._lines():
+            try:
+                fields, _ = _split_record(line)
+                fields = _batch.encode_fen_fields(*fields)
+            except ValueError as error:
+                self._malformed(line_number, line, error)
+                continue
+            append(fields)
+        return batch
+
+def _quote(opcode, operand):
+    if opcode in STRING_OPCODES or not operand or \
+            re.search(r'[\s;"]', operand):
+        if '"' in operand:
+            raise ValueError('operand %r contains a double quote' % operand)
+        return '"%s"' % operand
+    return operand
+
+def format_operations(operations):
+    """
+    Returns operations (a dict of opcode to operand list, or a sequence of
+    (opcode, operands) pairs) as EPD text. A single string operand may be
+    given on its own
+
+    >>> format_operations([('bm', ['Nf3', 'e4']), ('id', 'test 1')])
+    'bm Nf3 e4; id "test 1";'
+    """
+    if isinstance(operations, dict):
+        operations = sorted(operations.iteritems())
+    parts = []
+    for opcode, operands in operations:
+        if isinstance(operands, basestring):
+            operands = [operands]
+        parts.append(' '.join([opcode] + [_quote(opcode, operand)
+                                          for operand in operands]) + ';')
+    return ' '.join(parts)
+
+def format_epd(position, operations=None):
+    """
+    Returns position (a Game or FEN string) as an EPD line, without the line
+    break. The clocks aren't part of EPD; pass hmvc and fmvn operations to
+    keep them
+
+    >>> format_epd(chess.Game(), {'id': 'start'})
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - id "start";'
+    """
+    if not isinstance(position, basestring):
+        position = position.fen()
+    epd = position.split(' ', 4)[:4]
+    if operations:
+        epd.append(format_operations(operations))
+    return ' '.join(epd)
+
+class EPDWriter(object):
+    """
+    Writes FEN or EPD lines to a file object, buffering them into blocks of
+    around block_size bytes. Use as a context manager, or call flush() when
+    done
+    """
+    def __init__(self, fileobj, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def _write(self, line):
+        self._buffer.append(line)
+        self._buffered += len(line) + 1
+        if self._buffered >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.fileobj.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+            self._buffered = 0
+        if hasattr(self.fileobj, 'flush'):
+            self.fileobj.flush()
+
+    def write_fen(self, position):
+        """
+        Writes position (a Game or FEN string) as a FEN line
+        """
+        if not isinstance(position, basestring):
+            position = position.fen()
+        self._write(position)
+
+    def write_epd(self, position, operations=None):
+        """
+        Writes position (a Game or FEN string) and operations as an EPD line;
+        see format_epd
+        """
+        self._write(format_epd(position, operations))
+
+    def write_record(self, record):
+        """
+        Writes an EPDRecord as an EPD line, keeping its clocks as hmvc and
+        fmvn operations unless they are the defaults
+        """
+        operations = dict(record.operations)
+        halfmove, fullmove = record.fen.split(' ')[4:6]
+        if (halfmove, fullmove) != ('0', '1'):
+            operations.setdefault('hmvc', [halfmove])
+            operations.setdefault('fmvn', [fullmove])
+        self.write_epd(record.fen, operations)
+
+    def write_batch(self, batch):
+        """
+        Writes every position of a PositionBatch as a FEN line, without
+        building any Games
+        """
+        for fen in batch.fens():
+            self._write(fen)
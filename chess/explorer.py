@@ -0,0 +1,353 @@
+# encoding: utf-8
+
+"""
+Opening explorer: an on-disk index from position to the moves played there,
+with the white win, draw and black win counts of each, built from a PGN
+corpus:
+
+    python -m chess.explorer build openings.idx games.pgn --workers 4
+    python -m chess.explorer query openings.idx --moves e2e4 c7c5
+
+The corpus is split into shards of games that worker processes replay into
+sorted run files. The runs are then merged with an external sort, so a corpus
+larger than memory can be indexed. The index file is memory-mapped for
+queries, which look positions up by Zobrist key.
+
+The file holds a header, a table of where the records for each 16-bit key
+prefix start, then RECORDs sorted by key and move.
+"""
+
+import argparse
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+import chess
+from chess import pgn, zobrist
+
+MAGIC = 'CHSXPLR1'
+
+#Magic, number of records, maximum ply indexed
+HEADER = struct.Struct('<8sQI')
+
+#Position key, move code, white wins, draws, black wins
+RECORD = struct.Struct('<QHIII')
+
+#Record offsets for each top PREFIX_BITS bits of the key, plus the end
+PREFIX_BITS = 16
+_PREFIX_SHIFT = 64 - PREFIX_BITS
+_PREFIXES = 1 << PREFIX_BITS
+_PREFIX_TABLE = struct.Struct('<%dQ' % (_PREFIXES + 1))
+
+#Plies from the start of each game that are indexed by default
+MAX_PLY = 40
+
+#Games handed to each worker at a time
+GAMES_PER_SHARD = 1000
+
+#Records read from a run file at a time while merging
+_MERGE_BUFFER = 4096
+
+_PROMOTIONS = ' QRBN'
+
+_RESULTS = {'1-0': 0, '1/2-1/2': 1, '0-1': 2}
+
+def encode_move(move):
+    """
+    Packs a BasicMove into 16 bits: from square, to square and promotion
+
+    >>> decode_move(encode_move(chess.BasicMove('e7', 'e8', 'q')), 'b')
+    chess.BasicMove(chess.BoardSquare('e', 7), chess.BoardSquare('e', 8), 'q')
+    """
+    start_row, start_col = move.start.to_board_coordinates()
+    end_row, end_col = move.end.to_board_coordinates()
+    promotion = _PROMOTIONS.index(move.promotion.upper()) \
+        if move.promotion else 0
+    return (start_row * 8 + start_col) | (end_row * 8 + end_col) << 6 | \
+        promotion << 12
+
+def decode_move(code, colour):
+    """
+    Unpacks a move packed by encode_move, for colour to move
+    """
+    start, end, promotion = code & 63, (code >> 6) & 63, code >> 12
+    promotion = _PROMOTIONS[promotion] if promotion else None
+    if promotion is not None and colour == 'b':
+        promotion = promotion.lower()
+    return chess.BasicMove(chess._SQUARES[start // 8][start % 8],
+                           chess._SQUARES[end // 8][end % 8], promotion)
+
+class Continuation(object):
+    """
+    A move played from a position, with the number of games and how they
+    ended
+    """
+    def __init__(self, move, white, draws, black):
+        self.move = move
+        self.white = white
+        self.draws = draws
+        self.black = black
+
+    @property
+    def games(self):
+        return self.white + self.draws + self.black
+
+    def __repr__(self):
+        return '%s.%s(%r, %d, %d, %d)' % (self.__class__.__module__,
+                                          self.__class__.__name__,
+                                          self.move.coordinates(),
+                                          self.white,
+                                          self.draws,
+                                          self.black)
+
+def _index_shard(task):
+    """
+    Worker function: replays the games in a shard of PGN texts, writing their
+    positions to a sorted run file. Returns (path, games indexed, games
+    skipped)
+    """
+    texts, run_path, max_ply = task
+    counts = {}
+    indexed = skipped = 0
+    for text in texts:
+        game = pgn.parse_game(text)
+        outcome = _RESULTS.get(game.result)
+        if outcome is None:
+            skipped += 1
+            continue
+        indexed += 1
+        for position, move in itertools.islice(game.iter_positions(),
+                                               max_ply):
+            key = (zobrist.zobrist_hash(position), encode_move(move))
+            totals = counts.get(key)
+            if totals is None:
+                totals = counts[key] = [0, 0, 0]
+            totals[outcome] += 1
+
+    with open(run_path, 'wb') as run:
+        run.write(''.join(RECORD.pack(key, move, *totals) for (key, move),
+                          totals in sorted(counts.iteritems())))
+    return run_path, indexed, skipped
+
+def _read_run(path):
+    """
+    Yields the records of a run file, in order
+    """
+    with open(path, 'rb') as run:
+        while True:
+            block = run.read(RECORD.size * _MERGE_BUFFER)
+            if not block:
+                return
+            for offset in xrange(0, len(block), RECORD.size):
+                yield RECORD.unpack_from(block, offset)
+
+def _merge_runs(paths, output, max_ply):
+    """
+    Merges sorted run files into the index file output, combining records for
+    the same position and move. Returns the number of records written
+    """
+    prefixes = [0] * (_PREFIXES + 1)
+    count = 0
+    with open(output, 'wb') as index:
+        index.write(HEADER.pack(MAGIC, 0, max_ply))
+        index.write(_PREFIX_TABLE.pack(*prefixes))
+
+        buffered = []
+        current = None
+        for key, move, white, draws, black in heapq.merge(
+                *[_read_run(path) for path in paths]):
+            if current is not None and current[:2] == [key, move]:
+                current[2] += white
+                current[3] += draws
+                current[4] += black
+                continue
+            if current is not None:
+                buffered.append(RECORD.pack(*current))
+                if len(buffered) >= _MERGE_BUFFER:
+                    index.write(''.join(buffered))
+                    buffered = []
+            current = [key, move, white, draws, black]
+            #Records for later prefixes start after this one
+            prefixes[(key >> _PREFIX_SHIFT) + 1] = count + 1
+            count += 1
+        if current is not None:
+            buffered.append(RECORD.pack(*current))
+        index.write(''.join(buffered))
+
+        #Prefixes without records start where the previous one ended
+        for prefix in xrange(1, _PREFIXES + 1):
+            prefixes[prefix] = max(prefixes[prefix], prefixes[prefix - 1])
+        index.seek(0)
+        index.write(HEADER.pack(MAGIC, count, max_ply))
+        index.write(_PREFIX_TABLE.pack(*prefixes))
+    return count
+
+def _shards(pgn_paths, games_per_shard):
+    for path in pgn_paths:
+        with open(path) as pgn_file:
+            texts = pgn.iter_game_texts(pgn_file)
+            while True:
+                shard = list(itertools.islice(texts, games_per_shard))
+                if not shard:
+                    break
+                yield shard
+
+def build_index(pgn_paths, output, workers=0, max_ply=MAX_PLY,
+                games_per_shard=GAMES_PER_SHARD, tmpdir=None):
+    """
+    Builds an index file at output from the games in the PGN files at
+    pgn_paths, indexing the first max_ply plies of each. Shards of
+    games_per_shard games are replayed by a pool of workers processes (or in
+    the calling process if workers is 0) into run files under tmpdir, which
+    are then merged. Games without a result are skipped. Returns a dict of
+    figures: games, skipped, shards and records
+    """
+    rundir = tempfile.mkdtemp(prefix='explorer', dir=tmpdir)
+    tasks = ((shard, os.path.join(rundir, 'run%06d' % number), max_ply)
+             for number, shard in enumerate(_shards(pgn_paths,
+                                                    games_per_shard)))
+    if workers:
+        pool = multiprocessing.Pool(workers)
+        outcomes = pool.imap_unordered(_index_shard, tasks)
+    else:
+        pool = None
+        outcomes = itertools.imap(_index_shard, tasks)
+
+    try:
+        paths = []
+        figures = {'games': 0, 'skipped': 0}
+        for path, indexed, skipped in outcomes:
+            paths.append(path)
+            figures['games'] += indexed
+            figures['skipped'] += skipped
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pool = None
+        figures['shards'] = len(paths)
+        figures['records'] = _merge_runs(paths, output, max_ply)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        shutil.rmtree(rundir, ignore_errors=True)
+    return figures
+
+class OpeningIndex(object):
+    """
+    A memory-mapped index file, answering which moves were played from a
+    position and how those games ended
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError('%s is empty' % path)
+        magic, self.records, self.max_ply = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not an opening index' % path)
+        self._prefixes = _PREFIX_TABLE.unpack_from(self._map, HEADER.size)
+        self._base = HEADER.size + _PREFIX_TABLE.size
+
+    def __len__(self):
+        return self.records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _key_at(self, i):
+        return struct.unpack_from('<Q', self._map, self._base +
+                                  i * RECORD.size)[0]
+
+    def lookup_key(self, key, colour='w'):
+        """
+        Returns the Continuations for the position with the given Zobrist
+        key and colour to move, most played first (ties in move order)
+        """
+        prefix = key >> _PREFIX_SHIFT
+        low, high = self._prefixes[prefix], self._prefixes[prefix + 1]
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        continuations = []
+        offset = self._base + low * RECORD.size
+        end = self._base + self._prefixes[prefix + 1] * RECORD.size
+        while offset < end:
+            found, move, white, draws, black = RECORD.unpack_from(self._map,
+                                                                  offset)
+            if found != key:
+                break
+            continuations.append(Continuation(decode_move(move, colour),
+                                              white, draws, black))
+            offset += RECORD.size
+        continuations.sort(key=lambda continuation: (
+            -continuation.games, continuation.move.coordinates()))
+        return continuations
+
+    def lookup(self, game):
+        """
+        Returns the Continuations from game's position, most played first
+        """
+        return self.lookup_key(zobrist.zobrist_hash(game), game.active)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Opening explorer')
+    commands = parser.add_subparsers(dest='command')
+
+    build = commands.add_parser('build', help='index a PGN corpus')
+    build.add_argument('index')
+    build.add_argument('pgn', nargs='+')
+    build.add_argument('--workers', type=int,
+                       default=multiprocessing.cpu_count(),
+                       help='indexing processes (0 to index inline)')
+    build.add_argument('--max-ply', type=int, default=MAX_PLY)
+    build.add_argument('--games-per-shard', type=int, default=GAMES_PER_SHARD)
+    build.add_argument('--tmpdir', help='directory for run files')
+
+    query = commands.add_parser('query', help='show moves from a position')
+    query.add_argument('index')
+    query.add_argument('--fen', help='position (default: starting position)')
+    query.add_argument('--moves', nargs='*', default=[],
+                       help='coordinate moves played from the position')
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        figures = build_index(args.pgn, args.index, args.workers,
+                              args.max_ply, args.games_per_shard, args.tmpdir)
+        print 'Indexed %(games)d games (%(skipped)d skipped) from %(shards)d ' \
+            'shards into %(records)d records' % figures
+        return 0
+
+    game = chess.Game(args.fen).replay(args.moves)
+    with OpeningIndex(args.index) as index:
+        for continuation in index.lookup(game):
+            print '%-6s %8d games  %5.1f%% white  %5.1f%% draw  %5.1f%% black' \
+                % (continuation.move.coordinates(), continuation.games,
+                   100.0 * continuation.white / continuation.games,
+                   100.0 * continuation.draws / continuation.games,
+                   100.0 * continuation.black / continuation.games)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,536 @@
+# encoding: utf-8
+
+"""
+Differential testing of move generation. Random games and positions are run
+through the reference rules (valid_ends, built on chess.pieces) and through
+each faster backend, and everything they report is compared:
+
+    python -m chess.fuzz --games 100 --positions 500 --perft-depth 3
+
+    >>> report = fuzz(games=1, positions=2, plies=4, seed=3)
+    >>> report.failures
+    []
+    >>> sorted(report.ratios())
+    ['attack map', 'fast']
+
+At each position the backends must agree on the legal moves, check_status,
+is_checkmate and is_stalemate, and on the position (and check status) after
+each legal move. Each backend keeps its own Game along a random game, so
+state carried from move to move, such as an attack map, is tested too. The
+move trees of the SEEDS positions are also compared node by node, as in
+perft.
+
+A failing position is shrunk: pieces, castling rights and the en passant
+square are taken away for as long as it stays valid and still fails, giving
+a minimal FEN. The report also gives each backend's throughput as a multiple
+of the reference's, over the same work.
+"""
+
+import argparse
+import random
+import sys
+from timeit import default_timer
+
+import chess
+
+#Starting points for random games and perft: the perft suite positions, which
+#between them cover castling, en passant, promotions and discovered checks
+SEEDS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+]
+
+#Pieces added to random positions, weighted towards pawns
+_RANDOM_PIECES = 'PPPPNNBBRRQppppnnbbrrq'
+
+_CASTLING_SQUARES = {'K': ((7, 4, 'K'), (7, 7, 'R')),
+                     'Q': ((7, 4, 'K'), (7, 0, 'R')),
+                     'k': ((0, 4, 'k'), (0, 7, 'r')),
+                     'q': ((0, 4, 'k'), (0, 0, 'r'))}
+
+class Backend(object):
+    """
+    One way of answering move generation questions about a Game. Moves are
+    coordinate strings. This is the fast path used by the search: legal
+    moves from generate_moves, check from in_check
+    """
+    name = 'fast'
+
+    def game(self, fen):
+        return chess.Game(fen)
+
+    def legal_moves(self, game):
+        return set(move.coordinates() for move in game.generate_moves())
+
+    def check_status(self, game):
+        return set(colour for colour in ('w', 'b')
+                   if game.board.in_check(colour))
+
+    def is_checkmate(self, game):
+        return game.is_checkmate()
+
+    def is_stalemate(self, game):
+        return game.is_stalemate()
+
+    def move(self, game, move):
+        return game.move(game._coerce_move(move))
+
+class ReferenceBackend(Backend):
+    """
+    The original rules: legal moves from valid_ends, check from the piece
+    classes' threat squares, and moves applied without validation
+    """
+    name = 'reference'
+
+    def legal_moves(self, game):
+        moves = set()
+        for row, col, piece in game._own_pieces():
+            start = chess._SQUARES[row][col]
+            for end in game.valid_ends(start):
+                coordinates = '%s%s' % (start, end)
+                if piece in 'Pp' and end.rank_ in (1, 8):
+                    moves.update(coordinates + promotion
+                                 for promotion in 'qnrb')
+                else:
+                    moves.add(coordinates)
+        return moves
+
+    def check_status(self, game):
+        return game.board.check_status()
+
+    def is_checkmate(self, game):
+        return game.active in self.check_status(game) and \
+            not self.legal_moves(game)
+
+    def is_stalemate(self, game):
+        return game.active not in self.check_status(game) and \
+            not self.legal_moves(game)
+
+    def move(self, game, move):
+        new_game = game._copy()
+        new_game._apply_move(game._coerce_move(move))
+        return new_game
+
+class AttackMapBackend(Backend):
+    """
+    The fast path on boards with an attack map (see chess.attacks), which is
+    carried from move to move
+    """
+    name = 'attack map'
+
+    def game(self, fen):
+        game = chess.Game(fen)
+        game.board.enable_attack_map()
+        return game
+
+    def check_status(self, game):
+        return game.board.check_status()
+
+REFERENCE = ReferenceBackend()
+
+BACKENDS = dict((backend.name, backend)
+                for backend in (Backend(), AttackMapBackend()))
+
+class Failure(object):
+    """
+    A disagreement between backends: playing moves from fen reaches position,
+    where the discrepancies (strings) were found. minimal is the shrunk
+    position, or None if position doesn't fail on its own, i.e. the failure
+    depends on state carried along the game
+    """
+    def __init__(self, fen, moves, position, discrepancies):
+        self.fen = fen
+        self.moves = moves
+        self.position = position
+        self.discrepancies = discrepancies
+        self.minimal = None
+
+    def __repr__(self):
+        return '%s.%s(%r, %r)' % (self.__class__.__module__,
+                                  self.__class__.__name__,
+                                  self.minimal or self.position,
+                                  self.discrepancies)
+
+class FuzzReport(object):
+    """
+    Outcome of a fuzz run: the number of positions compared, the failures
+    found, the leaf count of each perft tree compared, and the seconds each
+    backend spent answering
+    """
+    def __init__(self, backends):
+        self.positions = 0
+        self.failures = []
+        self.perft = {}
+        self.seconds = dict((backend.name, 0.0)
+                            for backend in [REFERENCE] + list(backends))
+
+    def throughput(self, name):
+        """
+        Returns the positions per second compared by the named backend
+        """
+        seconds = self.seconds[name]
+        return self.positions / seconds if seconds else 0.0
+
+    def ratios(self):
+        """
+        Returns {name: throughput as a multiple of the reference's} for each
+        backend under test
+        """
+        reference = self.seconds[REFERENCE.name]
+        return dict((name, reference / seconds if seconds else 0.0)
+                    for name, seconds in self.seconds.iteritems()
+                    if name != REFERENCE.name)
+
+def _observe(backend, game):
+    """
+    Returns what backend reports about game, and the positions after each of
+    its legal moves, as a dict
+    """
+    try:
+        moves = backend.legal_moves(game)
+        observed = {'legal moves': moves,
+                    'check_status': backend.check_status(game),
+                    'is_checkmate': backend.is_checkmate(game),
+                    'is_stalemate': backend.is_stalemate(game)}
+    except Exception as error:
+        return {'error': repr(error)}
+    for move in moves:
+        try:
+            child = backend.move(game, move)
+            observed['after ' + move] = (child.fen(),
+                                         backend.check_status(child))
+        except Exception as error:
+            observed['after ' + move] = repr(error)
+    return observed
+
+def _describe(name, key, expected, found):
+    if isinstance(expected, set) and isinstance(found, set):
+        return '%s legal moves: missing %s, extra %s' % (
+            name, ' '.join(sorted(expected - found)) or '-',
+            ' '.join(sorted(found - expected)) or '-')
+    return '%s %s: %r, expected %r' % (name, key, found, expected)
+
+def _compare(games, report):
+    """
+    Compares what each backend reports about its Game against the
+    reference, where games is [(backend, game)] with the reference first and
+    all the games in the same position. Returns (discrepancies, the reference
+    legal moves)
+    """
+    observations = []
+    for backend, game in games:
+        started = default_timer()
+        observations.append(_observe(backend, game))
+        report.seconds[backend.name] += default_timer() - started
+    report.positions += 1
+
+    expected = observations[0]
+    discrepancies = []
+    if 'error' in expected:
+        discrepancies.append('reference raised %s' % expected['error'])
+    for (backend, _), observed in zip(games[1:], observations[1:]):
+        for key in sorted(set(expected) | set(observed)):
+            #Moves only one side has are reported with the legal moves
+            if key.startswith('after ') and \
+                    (key not in expected or key not in observed):
+                continue
+            if expected.get(key) != observed.get(key):
+                discrepancies.append(_describe(backend.name, key,
+                                               expected.get(key),
+                                               observed.get(key)))
+    return discrepancies, expected.get('legal moves', set())
+
+def check_position(fen, backends, report=None):
+    """
+    Compares the backends with the reference at the position fen, returning
+    a list of discrepancies
+    """
+    if report is None:
+        report = FuzzReport(backends)
+    games = [(backend, backend.game(fen))
+             for backend in [REFERENCE] + list(backends)]
+    return _compare(games, report)[0]
+
+def _is_valid(fen):
+    """
+    Returns True if fen is a position that could arise in a game, as far as
+    the fuzzer needs: one king each, no pawns on the end ranks, the side not
+    to move not in check, and castling rights and en passant square that
+    match the pieces
+    """
+    game = chess.Game(fen)
+    squares = game.board.squares
+    pieces = [piece for row in squares for piece in row]
+    if pieces.count('K') != 1 or pieces.count('k') != 1:
+        return False
+    if set('Pp') & set(squares[0] + squares[7]):
+        return False
+    if chess._other_colour(game.active) in game.board.check_status():
+        return False
+    castling = game.castling.fen()
+    for right in castling.replace('-', ''):
+        for row, col, piece in _CASTLING_SQUARES[right]:
+            if squares[row][col] != piece:
+                return False
+    if game.en_passant is not None:
+        row, col = game.en_passant.to_board_coordinates()
+        if game.active == 'w':
+            pawn, forward = 'p', 1
+        else:
+            pawn, forward = 'P', -1
+        if row != (2 if game.active == 'w' else 5) or \
+                squares[row][col] is not None or \
+                squares[row - forward][col] is not None or \
+                squares[row + forward][col] != pawn:
+            return False
+    return True
+
+def _fen(squares, fields):
+    return ' '.join([chess._Board(squares=squares).fen()] + fields)
+
+def _simplifications(fen):
+    """
+    Yields simpler versions of fen: with clocks reset, without the en passant
+    square, without each castling right, or without each piece but the kings
+    """
+    fields = fen.split(' ')
+    board, active, castling, en_passant, halfmove, fullmove = fields
+    if (halfmove, fullmove) != ('0', '1'):
+        yield ' '.join(fields[:4] + ['0', '1'])
+    if en_passant != '-':
+        yield ' '.join([board, active, castling, '-', halfmove, fullmove])
+    for right in castling.replace('-', ''):
+        yield ' '.join([board, active, castling.replace(right, '') or '-',
+                        en_passant, halfmove, fullmove])
+    squares = chess._Board(fen=board).squares
+    for row in xrange(8):
+        for col in xrange(8):
+            if squares[row][col] not in (None, 'K', 'k'):
+                simpler = [pieces[:] for pieces in squares]
+                simpler[row][col] = None
+                yield _fen(simpler, fields[1:])
+
+def shrink(fen, backends):
+    """
+    Returns a minimal version of the failing position fen: one that still
+    fails, from which no piece, castling right or en passant square can be
+    taken away without it becoming invalid or passing
+    """
+    #Simplifications that didn't fail before are unlikely to now, so each
+    #pass carries on from where the last success left off, rather than
+    #starting again, and passes are repeated until one changes nothing
+    changed = True
+    while changed:
+        changed = False
+        index = 0
+        candidates = list(_simplifications(fen))
+        while index < len(candidates):
+            candidate = candidates[index]
+            if _is_valid(candidate) and check_position(candidate, backends):
+                fen = candidate
+                candidates = list(_simplifications(fen))
+                changed = True
+            else:
+                index += 1
+    return fen
+
+def random_position(rng):
+    """
+    Returns the FEN of a random valid position, made with the random.Random
+    rng. Kings are often on their home squares with castling rights, and
+    pawns often about to promote or to be taken en passant
+    """
+    while True:
+        squares = [[None] * 8 for _ in xrange(8)]
+        empty = [(row, col) for row in xrange(8) for col in xrange(8)]
+        rng.shuffle(empty)
+
+        def place(row, col, piece):
+            if squares[row][col] is None:
+                squares[row][col] = piece
+                empty.remove((row, col))
+
+        if rng.random() < 0.5:
+            place(7, 4, 'K')
+            place(0, 4, 'k')
+            for row, col, rook in ((7, 0, 'R'), (7, 7, 'R'), (0, 0, 'r'),
+                                   (0, 7, 'r')):
+                if rng.random() < 0.7:
+                    place(row, col, rook)
+        else:
+            place(*(empty[0] + ('K',)))
+            place(*(empty[0] + ('k',)))
+        if rng.random() < 0.3:
+            place(1, rng.randrange(8), 'P')
+        if rng.random() < 0.3:
+            place(6, rng.randrange(8), 'p')
+        for piece in rng.sample(_RANDOM_PIECES, rng.randint(0, 10)):
+            row, col = empty[-1]
+            if piece in 'Pp' and row in (0, 7):
+                continue
+            place(row, col, piece)
+
+        active = rng.choice('wb')
+        castling = ''.join(right for right in 'KQkq'
+                           if rng.random() < 0.7 and
+                           all(squares[row][col] == piece for row, col, piece
+                               in _CASTLING_SQUARES[right])) or '-'
+        en_passant = '-'
+        if rng.random() < 0.5:
+            #A pawn of the side not to move that could have just advanced
+            #two squares, with one of the side to move's beside it
+            pawn_row, pawn, taker = (3, 'p', 'P') if active == 'w' else \
+                (4, 'P', 'p')
+            forward = 1 if active == 'w' else -1
+            col = rng.randrange(8)
+            place(pawn_row, col, pawn)
+            if squares[pawn_row][col] == pawn and \
+                    squares[pawn_row - forward][col] is None and \
+                    squares[pawn_row - 2 * forward][col] is None:
+                beside = col + rng.choice((-1, 1))
+                if 0 <= beside < 8:
+                    place(pawn_row, beside, taker)
+                en_passant = chess._SQUARES[pawn_row - forward][col]
+        fen = _fen(squares, [active, castling, str(en_passant), '0', '1'])
+        if _is_valid(fen):
+            return fen
+
+def _fail(report, backends, fen, moves, position, discrepancies):
+    failure = Failure(fen, moves, position, discrepancies)
+    if check_position(position, backends):
+        failure.minimal = shrink(position, backends)
+    report.failures.append(failure)
+
+def _play(fen, backends, plies, rng, report):
+    """
+    Plays a random game of up to plies moves from fen through every backend,
+    comparing them at each position. Returns True if they agreed throughout
+    """
+    games = [(backend, backend.game(fen))
+             for backend in [REFERENCE] + list(backends)]
+    moves = []
+    for _ in xrange(plies + 1):
+        discrepancies, legal = _compare(games, report)
+        if discrepancies:
+            _fail(report, backends, fen, moves, games[0][1].fen(),
+                  discrepancies)
+            return False
+        if not legal:
+            break
+        move = rng.choice(sorted(legal))
+        games = [(backend, backend.move(game, move))
+                 for backend, game in games]
+        moves.append(move)
+    return True
+
+def _perft(fen, games, depth, moves, backends, report):
+    """
+    Compares the backends at every position of the move tree under games,
+    depth plies deep. Returns the number of leaves, or None if they disagreed
+    """
+    discrepancies, legal = _compare(games, report)
+    if discrepancies:
+        _fail(report, backends, fen, moves, games[0][1].fen(), discrepancies)
+        return None
+    if depth == 1:
+        return len(legal)
+    nodes = 0
+    for move in sorted(legal):
+        children = [(backend, backend.move(game, move))
+                    for backend, game in games]
+        leaves = _perft(fen, children, depth - 1, moves + [move], backends,
+                        report)
+        if leaves is None:
+            return None
+        nodes += leaves
+    return nodes
+
+def fuzz(games=20, positions=100, plies=60, perft_depth=0, seed=None,
+         backends=None, max_failures=10):
+    """
+    Compares backends (by default every one in BACKENDS) with the reference
+    over games random games from the SEEDS positions of up to plies moves,
+    positions random positions, and the perft trees of the SEEDS positions
+    perft_depth plies deep. Stops after max_failures failures. Returns a
+    FuzzReport
+    """
+    if backends is None:
+        backends = [BACKENDS[name] for name in sorted(BACKENDS)]
+    rng = random.Random(seed)
+    report = FuzzReport(backends)
+
+    def done():
+        return len(report.failures) >= max_failures
+
+    if perft_depth:
+        for fen in SEEDS:
+            if done():
+                return report
+            games_ = [(backend, backend.game(fen))
+                      for backend in [REFERENCE] + list(backends)]
+            report.perft[fen] = _perft(fen, games_, perft_depth, [],
+                                       backends, report)
+    for number in xrange(games):
+        if done():
+            return report
+        _play(SEEDS[number % len(SEEDS)], backends, plies, rng, report)
+    for _ in xrange(positions):
+        if done():
+            return report
+        fen = random_position(rng)
+        discrepancies = check_position(fen, backends, report)
+        if discrepancies:
+            _fail(report, backends, fen, [], fen, discrepancies)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare move generation backends with the reference')
+    parser.add_argument('--games', type=int, default=20,
+                        help='random games to play (default 20)')
+    parser.add_argument('--positions', type=int, default=100,
+                        help='random positions to check (default 100)')
+    parser.add_argument('--plies', type=int, default=60,
+                        help='most moves per random game (default 60)')
+    parser.add_argument('--perft-depth', type=int, default=2,
+                        help='depth of the SEEDS move trees compared '
+                        '(default 2)')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--backend', action='append',
+                        choices=sorted(BACKENDS),
+                        help='backend to compare (default all)')
+    parser.add_argument('--max-failures', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    backends = None
+    if args.backend:
+        backends = [BACKENDS[name] for name in args.backend]
+    report = fuzz(args.games, args.positions, args.plies, args.perft_depth,
+                  args.seed, backends, args.max_failures)
+
+    for fen, nodes in sorted(report.perft.iteritems()):
+        print 'perft %-8s %s' % (nodes if nodes is not None else 'FAILED',
+                                 fen)
+    for failure in report.failures:
+        print 'FAILURE at %s' % failure.position
+        if failure.minimal is not None:
+            print '  minimal: %s' % failure.minimal
+        else:
+            print '  from %s after %s' % (failure.fen,
+                                          ' '.join(failure.moves) or '-')
+        for discrepancy in failure.discrepancies:
+            print '  %s' % discrepancy
+    print 'Compared %d positions, %d failures' % (report.positions,
+                                                  len(report.failures))
+    ratios = report.ratios()
+    for name in sorted(report.seconds):
+        print '%-12s %8.0f positions/s%s' % (
+            name, report.throughput(name),
+            '  %.2fx reference' % ratios[name] if name in ratios else '')
+    return 1 if report.failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,454 @@
+# encoding: utf-8
+
+"""
+Self-play matches between two engine configurations, for checking changes to
+move generation or search for strength regressions:
+
+    python -m chess.match --games 200 --movetime 0.1 --workers 4 \\
+        --b-factory mybranch.search:Searcher --sprt 0 10 --pgn match.pgn
+
+Games are played concurrently in a pool of worker processes, each opening
+twice with colours reversed. Results are turned into an Elo difference (of
+engine B relative to engine A) and a sequential probability ratio test (SPRT)
+as they come in, and the match stops as soon as the test reaches a decision.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import math
+import multiprocessing
+import sys
+import time
+from timeit import default_timer
+
+import chess
+from chess import epd, pgn, san, search
+
+#Openings, as coordinate moves from the starting position, used when no
+#openings file is given
+OPENINGS = [
+    'e2e4 e7e5 g1f3 b8c6 f1b5',
+    'e2e4 c7c5 g1f3 d7d6',
+    'e2e4 e7e6 d2d4 d7d5',
+    'e2e4 c7c6 d2d4 d7d5',
+    'd2d4 d7d5 c2c4 e7e6',
+    'd2d4 g8f6 c2c4 g7g6',
+    'c2c4 e7e5 b1c3 g8f6',
+    'g1f3 d7d5 g2g3 g8f6',
+]
+
+#Plies after which a game is adjudicated a draw
+MAX_PLIES = 400
+
+class Engine(object):
+    """
+    An engine configuration: factory is the import path ('module:callable')
+    of something returning a Searcher-like object, and options are keyword
+    arguments passed to it. Only names are held, so engines can be sent to
+    worker processes
+    """
+    def __init__(self, name, factory='chess.search:Searcher', options=None):
+        self.name = name
+        self.factory = factory
+        self.options = options or {}
+
+    def create(self):
+        module, _, attribute = self.factory.partition(':')
+        return getattr(importlib.import_module(module), attribute)(
+            **self.options)
+
+class TimeControl(object):
+    """
+    Fixed per-move limits: a depth in plies, a node count and a time in
+    seconds. Any combination may be given
+    """
+    def __init__(self, depth=None, nodes=None, movetime=None):
+        if depth is None and nodes is None and movetime is None:
+            raise ValueError('a depth, node or time limit is required')
+        self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+
+    def limits(self):
+        return search.SearchLimits(depth=self.depth, nodes=self.nodes,
+                                   movetime=self.movetime)
+
+    def __str__(self):
+        parts = []
+        if self.depth is not None:
+            parts.append('depth=%d' % self.depth)
+        if self.nodes is not None:
+            parts.append('nodes=%d' % self.nodes)
+        if self.movetime is not None:
+            parts.append('movetime=%g' % self.movetime)
+        return ' '.join(parts)
+
+class GameRecord(object):
+    """
+    A finished game: who played it, from which opening FEN, its moves (SAN),
+    result ('1-0', '0-1' or '1/2-1/2') and how it ended, plus the nodes
+    searched and seconds spent by each side
+    """
+    def __init__(self, index, white, black, fen):
+        self.index = index
+        self.white = white
+        self.black = black
+        self.fen = fen
+        self.moves = []
+        self.result = None
+        self.termination = None
+        self.nodes = {white: 0, black: 0}
+        self.seconds = {white: 0.0, black: 0.0}
+
+    def score(self, name):
+        """
+        Returns the score of the named engine: 1, 0.5 or 0
+        """
+        if self.result == '1/2-1/2':
+            return 0.5
+        winner = self.white if self.result == '1-0' else self.black
+        return 1.0 if winner == name else 0.0
+
+    def pgn(self, event='Self-play match', round_=None):
+        """
+        Returns the game in PGN
+        """
+        game = chess.Game(self.fen)
+        headers = {
+            'Event': event,
+            'Site': 'localhost',
+            'Date': time.strftime('%Y.%m.%d'),
+            'Round': round_ or self.index + 1,
+            'White': self.white,
+            'Black': self.black,
+            'Termination': self.termination,
+            'PlyCount': len(self.moves),
+        }
+        if self.fen != chess.Game().fen():
+            headers['SetUp'] = '1'
+            headers['FEN'] = self.fen
+        return pgn.format_game(headers, self.moves, self.result,
+                               game.fullmove, game.active == 'b')
+
+def insufficient_material(game):
+    """
+    Returns True if neither side can possibly mate: bare kings, or a single
+    knight or bishop against a bare king
+
+    >>> insufficient_material(chess.Game('8/8/4k3/8/8/2N5/8/4K3 w - - 0 1'))
+    True
+    """
+    pieces = [piece for row in game.board.squares for piece in row
+              if piece is not None and piece.upper() != 'K']
+    return not pieces or (len(pieces) == 1 and pieces[0].upper() in 'NB')
+
+def play_game(task):
+    """
+    Worker function: plays one game, returning a GameRecord. Games end on
+    checkmate, stalemate, threefold repetition, the fifty move rule,
+    insufficient material or after max_plies (a draw)
+    """
+    index, fen, white, black, control, max_plies = task
+    game = chess.Game(fen)
+    record = GameRecord(index, white.name, black.name, game.fen())
+    searchers = {'w': white.create(), 'b': black.create()}
+    names = {'w': white.name, 'b': black.name}
+    seen = {search.position_key(game): 1}
+
+    while True:
+        legal = game.legal_moves()
+        if not legal:
+            if game.board.in_check(game.active):
+                record.result = '0-1' if game.active == 'w' else '1-0'
+                record.termination = 'checkmate'
+            else:
+                record.result = '1/2-1/2'
+                record.termination = 'stalemate'
+            break
+        if max(seen.itervalues()) >= 3:
+            record.result, record.termination = '1/2-1/2', 'repetition'
+            break
+        if game.halfmove >= 100:
+            record.result, record.termination = '1/2-1/2', 'fifty moves'
+            break
+        if insufficient_material(game):
+            record.result = '1/2-1/2'
+            record.termination = 'insufficient material'
+            break
+        if len(record.moves) >= max_plies:
+            record.result, record.termination = '1/2-1/2', 'move limit'
+            break
+
+        name = names[game.active]
+        result = searchers[game.active].search(game, control.limits())
+        record.nodes[name] += result.nodes
+        record.seconds[name] += result.seconds
+        move = result.best_move
+        record.moves.append(san.to_san(game, move, legal))
+        game = game.move(move)
+        key = search.position_key(game)
+        seen[key] = seen.get(key, 0) + 1
+
+    return record
+
+def _expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400.0))
+
+def _elo(score):
+    return -400 * math.log10(1 / score - 1)
+
+class MatchStats(object):
+    """
+    Running totals of a match from the point of view of one engine, with Elo
+    and SPRT figures computed incrementally. SPRT tests H0: elo = elo0 against
+    H1: elo = elo1, with error rates alpha and beta, using the normal
+    approximation to the game score distribution
+
+    >>> stats = MatchStats(0, 10)
+    >>> for score in [1, 0.5, 1, 0, 1, 0.5]:
+    ...     stats.add(score)
+    >>> stats.wins, stats.draws, stats.losses, round(stats.elo(), 1)
+    (3, 2, 1, 120.4)
+    """
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def add(self, score):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def score(self):
+        """
+        Returns the mean score per game, or None before any games
+        """
+        if not self.games:
+            return None
+        return (self.wins + 0.5 * self.draws) / float(self.games)
+
+    def _variance(self):
+        score = self.score()
+        return (self.wins * (1 - score) ** 2 +
+                self.draws * (0.5 - score) ** 2 +
+                self.losses * score ** 2) / self.games
+
+    def elo(self):
+        """
+        Returns the Elo difference implied by the score, or None while it is
+        undefined (no games, or all won or all lost)
+        """
+        score = self.score()
+        if score is None or score in (0, 1):
+            return None
+        return _elo(score)
+
+    def elo_error(self):
+        """
+        Returns the half-width of the 95% confidence interval of elo(), or
+        None while it is undefined
+        """
+        score = self.score()
+        if score is None or score in (0, 1):
+            return None
+        margin = 1.96 * math.sqrt(self._variance() / self.games)
+        low, high = max(score - margin, 1e-9), min(score + margin, 1 - 1e-9)
+        return (_elo(high) - _elo(low)) / 2
+
+    def llr(self):
+        """
+        Returns the log-likelihood ratio of H1 against H0 so far
+        """
+        if not self.games:
+            return 0.0
+        variance = self._variance()
+        if not variance:
+            #Every game had the same result, so nothing to go on yet
+            return 0.0
+        score = self.score()
+        score0 = _expected_score(self.elo0)
+        score1 = _expected_score(self.elo1)
+        return self.games * (score1 - score0) * \
+            (2 * score - score0 - score1) / (2 * variance)
+
+    def decision(self):
+        """
+        Returns 'H1' once the test accepts H1 (elo1 or better), 'H0' once it
+        accepts H0 (elo0 or worse), or None while undecided
+        """
+        llr = self.llr()
+        if llr >= self.upper_bound:
+            return 'H1'
+        if llr <= self.lower_bound:
+            return 'H0'
+        return None
+
+    def to_dict(self):
+        return {
+            'games': self.games,
+            'wins': self.wins,
+            'draws': self.draws,
+            'losses': self.losses,
+            'elo': self.elo(),
+            'elo_error': self.elo_error(),
+            'llr': self.llr(),
+            'bounds': [self.lower_bound, self.upper_bound],
+            'decision': self.decision(),
+        }
+
+def opening_fens(openings=None):
+    """
+    Returns the FENs to start games from: those given, else the positions
+    after each of OPENINGS
+    """
+    if openings:
+        return list(openings)
+    return [chess.Game().replay(line.split()).fen() for line in OPENINGS]
+
+def run_match(engine_a, engine_b, control, games, openings=None, workers=0,
+              sprt=True, stats=None, pgn_file=None, progress=None,
+              max_plies=MAX_PLIES):
+    """
+    Plays up to games games between two Engines, alternating colours on each
+    opening FEN, using a pool of workers processes (or the calling process if
+    workers is 0). Results are tallied for engine_b against engine_a in stats
+    (a MatchStats, by default testing 0 against 5 Elo); if sprt is True the
+    match stops once the test reaches a decision. Each finished GameRecord is
+    written to pgn_file, if given, and passed to progress. Returns (stats,
+    list of GameRecords in the order they finished)
+    """
+    if engine_a.name == engine_b.name:
+        raise ValueError('engines need different names')
+    if stats is None:
+        stats = MatchStats()
+    fens = opening_fens(openings)
+
+    def tasks():
+        for index in xrange(games):
+            fen = fens[(index // 2) % len(fens)]
+            if index % 2:
+                white, black = engine_b, engine_a
+            else:
+                white, black = engine_a, engine_b
+            yield (index, fen, white, black, control, max_plies)
+
+    if workers:
+        pool = multiprocessing.Pool(workers)
+        outcomes = pool.imap_unordered(play_game, tasks())
+    else:
+        pool = None
+        outcomes = itertools.imap(play_game, tasks())
+
+    records = []
+    try:
+        for record in outcomes:
+            records.append(record)
+            stats.add(record.score(engine_b.name))
+            if pgn_file is not None:
+                pgn_file.write(record.pgn() + '\n')
+                pgn_file.flush()
+            if progress is not None:
+                progress(record, stats)
+            if sprt and stats.decision() is not None:
+                break
+    finally:
+        if pool is not None:
+            #Abandons any games still in progress after an early stop
+            pool.terminate()
+            pool.join()
+    return stats, records
+
+def _parse_options(values):
+    options = {}
+    for value in values or []:
+        name, _, option = value.partition('=')
+        try:
+            options[name] = json.loads(option)
+        except ValueError:
+            options[name] = option
+    return options
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Self-play match')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='game processes (0 to play inline)')
+    parser.add_argument('--depth', type=int, help='search depth per move')
+    parser.add_argument('--nodes', type=int, help='nodes per move')
+    parser.add_argument('--movetime', type=float, help='seconds per move')
+    for side in ('a', 'b'):
+        parser.add_argument('--%s-name' % side, default=side.upper())
+        parser.add_argument('--%s-factory' % side,
+                            default='chess.search:Searcher',
+                            help='module:callable creating the searcher')
+        parser.add_argument('--%s-option' % side, action='append',
+                            metavar='NAME=VALUE',
+                            help='keyword argument for the factory')
+    parser.add_argument('--openings', help='EPD or FEN file of openings')
+    parser.add_argument('--pgn', help='append games to this PGN file')
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'),
+                        help='stop early once SPRT decides between these')
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES)
+    args = parser.parse_args(argv)
+
+    try:
+        control = TimeControl(args.depth, args.nodes, args.movetime)
+    except ValueError as error:
+        parser.error(str(error))
+    engine_a = Engine(args.a_name, args.a_factory,
+                      _parse_options(args.a_option))
+    engine_b = Engine(args.b_name, args.b_factory,
+                      _parse_options(args.b_option))
+    elo0, elo1 = args.sprt or (0.0, 5.0)
+    stats = MatchStats(elo0, elo1, args.alpha, args.beta)
+
+    openings = None
+    if args.openings:
+        with open(args.openings) as openings_file:
+            openings = list(epd.EPDReader(openings_file, errors='skip').fens())
+
+    def progress(record, stats):
+        elo = stats.elo()
+        print '%4d %-24s %-7s %-22s %s Elo %s LLR %.2f [%.2f, %.2f]' % (
+            stats.games, '%s-%s' % (record.white, record.black), record.result,
+            record.termination, engine_b.name,
+            '%+.1f +/- %.1f' % (elo, stats.elo_error()) if elo is not None
+            else '-', stats.llr(), stats.lower_bound, stats.upper_bound)
+        sys.stdout.flush()
+
+    print '%s vs %s, %s, %d games' % (engine_a.name, engine_b.name, control,
+                                      args.games)
+    started = default_timer()
+    pgn_file = open(args.pgn, 'a') if args.pgn else None
+    try:
+        stats, records = run_match(engine_a, engine_b, control, args.games,
+                                   openings, args.workers, bool(args.sprt),
+                                   stats, pgn_file, progress, args.max_plies)
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+
+    print json.dumps(dict(stats.to_dict(),
+                          seconds=default_timer() - started),
+                     indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# encoding: utf-8
+
+"""
+Mate-in-N solver using proof-number search
+
+    >>> result = MateSolver().solve(
+    ...     chess.Game('r5k1/5ppp/8/8/8/8/4R3/4R1K1 w - - 0 1'), 2)
+    >>> result.status, result.mate_in
+    ('mate', 2)
+    >>> [move.coordinates() for move in result.line]
+    ['e2e8', 'a8e8', 'e1e8']
+
+The side to move is the attacker. Rather than searching every line to a fixed
+depth, proof-number search grows the tree where a proof (or disproof) looks
+cheapest: positions where the defender has few replies, and above all checks,
+are looked at first. Proven and disproven positions are remembered in a
+transposition table, and solve() tries mate in 1, 2, ... in turn, so the
+mate found is the shortest.
+"""
+
+from timeit import default_timer
+
+import chess
+from chess.search import position_key
+
+INFINITE = 1 << 30
+
+#Initial proof numbers of quiet attacking moves are scaled by this, so that
+#checks are tried first
+QUIET_PENALTY = 4
+
+#Expansions between checks of the time limit
+_CLOCK_INTERVAL = 64
+
+class MateResult(object):
+    """
+    Outcome of a solve: status is 'mate' (line holds the forced mate, with the
+    defender's longest resistance), 'no mate' (proven that there's no mate
+    within the number of moves asked), or 'unknown' (a limit was hit first)
+    """
+    def __init__(self, status, line, nodes, seconds):
+        self.status = status
+        self.line = line
+        self.nodes = nodes
+        self.seconds = seconds
+
+    @property
+    def mate_in(self):
+        """
+        The number of attacking moves in the mate, or None
+        """
+        if self.status != 'mate':
+            return None
+        return (len(self.line) + 1) // 2
+
+    def __repr__(self):
+        return '%s.%s(%r, %r)' % (self.__class__.__module__,
+                                  self.__class__.__name__,
+                                  self.status,
+                                  [move.coordinates() for move in self.line])
+
+class _LimitReached(Exception):
+    pass
+
+class _Node(object):
+    """
+    A position in the proof tree. depth is the number of plies left; or_node
+    is True when the attacker is to move
+    """
+    __slots__ = ('game', 'move', 'parent', 'depth', 'or_node', 'key', 'moves',
+                 'children', 'proof', 'disproof')
+
+    def __init__(self, game, move, parent, depth, or_node):
+        self.game = game
+        self.move = move
+        self.parent = parent
+        self.depth = depth
+        self.or_node = or_node
+        self.key = position_key(game)
+        self.moves = None
+        self.children = None
+        self.proof = 1
+        self.disproof = 1
+
+class MateSolver(object):
+    """
+    Proof-number mate solver. The transposition table is kept between solves
+    with the same colour attacking. max_nodes bounds the number of positions
+    looked at by each solve
+    """
+    def __init__(self, max_nodes=200000):
+        self.max_nodes = max_nodes
+        #key -> (plies to mate, move): positions proven to be mates, with the
+        #attacker's mating move or the defender's longest resistance
+        self.proven = {}
+        #key -> most plies in which a mate has been disproven
+        self.disproven = {}
+        self.nodes = 0
+        self._attacker = None
+        self._deadline = None
+
+    def clear(self):
+        self.proven.clear()
+        self.disproven.clear()
+
+    def solve(self, game, moves, movetime=None):
+        """
+        Looks for a forced mate by the side to move in at most moves moves,
+        within movetime seconds if given. Returns a MateResult
+        """
+        started = default_timer()
+        if game.active != self._attacker:
+            self.clear()
+            self._attacker = game.active
+        self.nodes = 0
+        self._deadline = started + movetime if movetime is not None else None
+        try:
+            for n in xrange(1, moves + 1):
+                root = self._make_node(game, None, None, 2 * n - 1, True)
+                self._search(root)
+                if root.proof == 0:
+                    return MateResult('mate', self._line(game), self.nodes,
+                                      default_timer() - started)
+        except _LimitReached:
+            return MateResult('unknown', [], self.nodes,
+                              default_timer() - started)
+        return MateResult('no mate', [], self.nodes, default_timer() - started)
+
+    def _line(self, game):
+        """
+        Follows the transposition table from game to mate
+        """
+        line = []
+        while True:
+            plies, move = self.proven[position_key(game)]
+            if plies == 0:
+                return line
+            line.append(move)
+            game = game.move(move)
+
+    def _make_node(self, game, move, parent, depth, or_node):
+        self.nodes += 1
+        node = _Node(game, move, parent, depth, or_node)
+
+        proven = self.proven.get(node.key)
+        if proven is not None and proven[0] <= depth:
+            node.proof, node.disproof = 0, INFINITE
+            return node
+        if self.disproven.get(node.key, -1) >= depth:
+            node.proof, node.disproof = INFINITE, 0
+            return node
+
+        in_check = game.board.in_check(game.active)
+        if depth == 0:
+            #Only a mate will do, and that needs a check
+            if in_check and not or_node and not game._can_move():
+                self._prove(node, 0, None)
+            else:
+                self._disprove(node)
+            return node
+
+        node.moves = game.legal_moves()
+        if not node.moves:
+            if in_check and not or_node:
+                self._prove(node, 0, None)
+            else:
+                self._disprove(node)
+            return node
+
+        if or_node:
+            node.proof, node.disproof = 1, len(node.moves)
+        else:
+            node.proof, node.disproof = len(node.moves), 1
+            if not in_check:
+                node.proof *= QUIET_PENALTY
+        return node
+
+    def _prove(self, node, plies, move):
+        node.proof, node.disproof = 0, INFINITE
+        node.children = None
+        node.moves = None
+        previous = self.proven.get(node.key)
+        if previous is None or plies < previous[0]:
+            self.proven[node.key] = (plies, move)
+
+    def _disprove(self, node):
+        node.proof, node.disproof = INFINITE, 0
+        node.children = None
+        node.moves = None
+        if node.depth > self.disproven.get(node.key, -1):
+            self.disproven[node.key] = node.depth
+
+    def _search(self, root):
+        expansions = 0
+        while root.proof and root.disproof:
+            if self.nodes >= self.max_nodes:
+                raise _LimitReached()
+            expansions += 1
+            if self._deadline is not None and \
+                    expansions % _CLOCK_INTERVAL == 0 and \
+                    default_timer() >= self._deadline:
+                raise _LimitReached()
+
+            node = root
+            while node.children is not None:
+                if node.or_node:
+                    node = min(node.children, key=lambda child: child.proof)
+                else:
+                    node = min(node.children,
+                               key=lambda child: child.disproof)
+            self._expand(node)
+            while node is not None:
+                self._update(node)
+                node = node.parent
+
+    def _expand(self, node):
+        game = node.game
+        node.children = [self._make_node(game.move(move), move, node,
+                                         node.depth - 1, not node.or_node)
+                         for move in node.moves]
+        #Only leaves need their positions
+        node.moves = None
+        node.game = None
+
+    def _update(self, node):
+        children = node.children
+        if children is None:
+            return
+        if node.or_node:
+            proof = min(child.proof for child in children)
+            if proof == 0:
+                plies, _, move = min(
+                    (self.proven[child.key][0], i, child.move)
+                    for i, child in enumerate(children) if child.proof == 0)
+                self._prove(node, plies + 1, move)
+                return
+            disproof = sum(child.disproof for child in children)
+            if disproof == 0:
+                self._disprove(node)
+                return
+        else:
+            disproof = min(child.disproof for child in children)
+            if disproof == 0:
+                self._disprove(node)
+                return
+            proof = sum(child.proof for child in children)
+            if proof == 0:
+                plies, _, move = max(
+                    (self.proven[child.key][0], -i, child.move)
+                    for i, child in enumerate(children))
+                self._prove(node, plies + 1, move)
+                return
+        node.proof = min(proof, INFINITE)
+        node.disproof = min(disproof, INFINITE)
@@ -0,0 +1,197 @@
+# encoding: utf-8
+
+"""
+Pawn structure evaluation, cached by pawn hash
+
+    >>> table = PawnTable()
+    >>> board = chess.Game('4k3/8/8/8/8/8/PP5P/4K3 w - - 0 1').board
+    >>> structure = table.probe(zobrist.pawn_hash(board), board)
+    >>> structure.passed, structure.isolated, structure.doubled
+    ({'b': 0, 'w': 3}, {'b': 0, 'w': 1}, {'b': 0, 'w': 0})
+    >>> table.probe(zobrist.pawn_hash(board), board) is structure
+    True
+    >>> table.hit_rate
+    0.5
+
+Pawns move rarely compared with the other pieces, so most positions met in a
+search share their pawn structure with many others. Analysing the structure
+once per pawn hash (see chess.zobrist.update_keys) rather than once per
+position removes most of its cost.
+"""
+
+import chess
+from chess import zobrist
+
+#Bonus for a passed pawn by the number of ranks it has advanced
+PASSED_BONUS = (0, 5, 10, 20, 35, 60, 100, 0)
+DOUBLED_PENALTY = 10
+ISOLATED_PENALTY = 15
+BACKWARD_PENALTY = 8
+
+#King shelter, for a king on its first two ranks: a bonus for each own pawn
+#one or two ranks in front of it on its own and neighbouring files, and a
+#penalty for each of those files with neither
+SHELTER_BONUS = (0, 10, 5)
+SHELTER_MISSING = 15
+
+#Default bound on the number of pawn structures cached
+PAWN_TABLE_ENTRIES = 1 << 14
+
+class PawnStructure(object):
+    """
+    The pawn structure terms of a position. The counts are dicts by colour;
+    score is in centipawns, positive favouring white, and doesn't include king
+    shelter (see shelter)
+    """
+    def __init__(self, passed, doubled, isolated, backward, score):
+        self.passed = passed
+        self.doubled = doubled
+        self.isolated = isolated
+        self.backward = backward
+        self.score = score
+        self._shelter = {}
+
+    def shelter(self, board, colour, row, col):
+        """
+        Returns the shelter score, positive favouring white, of colour's king
+        at row, col. Only the pawns matter, so it's worked out once per king
+        square
+        """
+        key = (colour, row, col)
+        score = self._shelter.get(key)
+        if score is None:
+            score = self._shelter[key] = king_shelter(board, colour, row, col)
+        return score
+
+def _pawn_files(board):
+    """
+    Returns {colour: [[row, ...] for each file]} of the pawns on board
+    """
+    files = {'w': [[] for _ in xrange(8)], 'b': [[] for _ in xrange(8)]}
+    for row, pieces in enumerate(board.squares):
+        for col, piece in enumerate(pieces):
+            if piece == 'P':
+                files['w'][col].append(row)
+            elif piece == 'p':
+                files['b'][col].append(row)
+    return files
+
+def analyse(board):
+    """
+    Returns the PawnStructure of board
+    """
+    files = _pawn_files(board)
+    counts = dict((term, {'w': 0, 'b': 0})
+                  for term in ('passed', 'doubled', 'isolated', 'backward'))
+    score = 0
+    for colour, sign, forward in (('w', 1, -1), ('b', -1, 1)):
+        own = files[colour]
+        enemy = files['b' if colour == 'w' else 'w']
+        for col in xrange(8):
+            rows = own[col]
+            if not rows:
+                continue
+            counts['doubled'][colour] += len(rows) - 1
+            neighbours = [c for c in (col - 1, col + 1) if 0 <= c < 8]
+            isolated = not any(own[c] for c in neighbours)
+            for row in rows:
+                #Rows are ahead of row when (row - ahead) * forward < 0
+                if not any((row - ahead) * forward < 0
+                           for c in neighbours + [col] for ahead in enemy[c]):
+                    counts['passed'][colour] += 1
+                    advanced = 6 - row if colour == 'w' else row - 1
+                    score += sign * PASSED_BONUS[advanced]
+                if isolated:
+                    counts['isolated'][colour] += 1
+                    continue
+                #Backward: no own pawn level with or behind it on either
+                #side, and its stop square is covered by an enemy pawn
+                supported = any((other - row) * forward <= 0
+                                for c in neighbours for other in own[c])
+                guarded = any(row + 2 * forward in enemy[c]
+                              for c in neighbours)
+                if not supported and guarded:
+                    counts['backward'][colour] += 1
+        score -= sign * (DOUBLED_PENALTY * counts['doubled'][colour] +
+                         ISOLATED_PENALTY * counts['isolated'][colour] +
+                         BACKWARD_PENALTY * counts['backward'][colour])
+    return PawnStructure(counts['passed'], counts['doubled'],
+                         counts['isolated'], counts['backward'], score)
+
+def king_shelter(board, colour, row, col):
+    """
+    Returns the shelter score, positive favouring white, of colour's king at
+    row, col
+
+    >>> board = chess.Game().board
+    >>> king_shelter(board, 'w', 7, 4), king_shelter(board, 'b', 0, 4)
+    (30, -30)
+    """
+    if colour == 'w':
+        pawn, forward, sign, home = 'P', -1, 1, row >= 6
+    else:
+        pawn, forward, sign, home = 'p', 1, -1, row <= 1
+    if not home:
+        return 0
+    score = 0
+    for c in xrange(max(col - 1, 0), min(col + 2, 8)):
+        for distance in (1, 2):
+            r = row + distance * forward
+            if 0 <= r < 8 and board.squares[r][c] == pawn:
+                score += SHELTER_BONUS[distance]
+                break
+        else:
+            score -= SHELTER_MISSING
+    return sign * score
+
+class PawnTable(object):
+    """
+    Bounded cache of PawnStructures by pawn hash, counting its hits. It's
+    emptied when full, like the search's transposition table
+    """
+    def __init__(self, max_entries=PAWN_TABLE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        return float(self.hits) / self.probes if self.probes else 0.0
+
+    def reset_counters(self):
+        self.probes = 0
+        self.hits = 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def probe(self, key, board):
+        """
+        Returns the PawnStructure of board, whose pawn hash is key
+        """
+        self.probes += 1
+        structure = self.entries.get(key)
+        if structure is not None:
+            self.hits += 1
+            return structure
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        structure = self.entries[key] = analyse(board)
+        return structure
+
+    def evaluate(self, board, key):
+        """
+        Returns the pawn structure plus king shelter score of board, whose
+        pawn hash is key, in centipawns positive favouring white
+        """
+        structure = self.probe(key, board)
+        score = structure.score
+        for colour in ('w', 'b'):
+            coords = board._king_coords(colour)
+            if coords is not None:
+                score += structure.shelter(board, colour, *coords)
+        return score
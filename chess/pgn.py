@@ -0,0 +1,191 @@
+# encoding: utf-8
+
+"""
+Portable Game Notation (PGN) input and output
+
+    >>> print format_game({'White': 'a', 'Black': 'b'}, ['e4', 'e5', 'Qh5'],
+    ...                   '*'),
+    [Event "?"]
+    [Site "?"]
+    [Date "????.??.??"]
+    [Round "?"]
+    [White "a"]
+    [Black "b"]
+    [Result "*"]
+    <BLANKLINE>
+    1. e4 e5 2. Qh5 *
+"""
+
+import re
+
+import chess
+from chess import san
+
+#Tags every game has, in the order they must come first
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black',
+                    'Result')
+
+_ROSTER_DEFAULTS = {'Date': '????.??.??'}
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+#Movetext lines are wrapped to this width
+LINE_WIDTH = 79
+
+def _tag(name, value):
+    value = ('%s' % value).replace('\\', '\\\\').replace('"', '\\"')
+    return '[%s "%s"]' % (name, value)
+
+def _wrap(tokens):
+    lines = []
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    if line:
+        lines.append(line)
+    return '\n'.join(lines)
+
+def format_game(headers, moves, result, first_move_number=1,
+                black_first=False):
+    """
+    Returns a game in PGN, ending with a newline. headers is a dict of tag
+    values (the seven tag roster is always written first, in order, with '?'
+    for any missing); moves are SAN strings; result is one of RESULTS. Games
+    from a position with black to move should pass black_first
+    """
+    if result not in RESULTS:
+        raise ValueError('invalid result %r' % result)
+    headers = dict(headers)
+    headers['Result'] = result
+
+    lines = []
+    for name in SEVEN_TAG_ROSTER:
+        lines.append(_tag(name, headers.pop(name, None) or
+                          _ROSTER_DEFAULTS.get(name, '?')))
+    for name in sorted(headers):
+        lines.append(_tag(name, headers[name]))
+
+    tokens = []
+    number = first_move_number
+    white = not black_first
+    for i, move in enumerate(moves):
+        if white:
+            tokens.append('%d.' % number)
+        elif i == 0:
+            tokens.append('%d...' % number)
+        tokens.append(move)
+        if not white:
+            number += 1
+        white = not white
+    tokens.append(result)
+
+    return '\n'.join(lines) + '\n\n' + _wrap(tokens) + '\n'
+
+def write_game(fileobj, headers, moves, result, first_move_number=1,
+               black_first=False):
+    """
+    Writes format_game to fileobj, followed by the blank line separating games
+    """
+    fileobj.write(format_game(headers, moves, result, first_move_number,
+                              black_first) + '\n')
+
+_TAG = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$', re.MULTILINE)
+_COMMENTS = re.compile(r'\{[^}]*\}|;[^\n]*|^%[^\n]*', re.MULTILINE)
+_VARIATION = re.compile(r'\([^()]*\)')
+_NAG = re.compile(r'\$\d+')
+_MOVE_NUMBER = re.compile(r'^\d+\.+')
+_UNESCAPE = re.compile(r'\\(.)')
+
+class PGNGame(object):
+    """
+    A game read from PGN: its tags (a dict), moves (SAN strings, variations
+    and comments dropped) and result
+    """
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    def __repr__(self):
+        return '%s.%s(%r, %r, %r)' % (self.__class__.__module__,
+                                      self.__class__.__name__,
+                                      self.headers,
+                                      self.moves,
+                                      self.result)
+
+    def start(self):
+        """
+        Returns the Game the moves are played from
+        """
+        return chess.Game(self.headers.get('FEN'))
+
+    def iter_positions(self):
+        """
+        Yields (Game, BasicMove) for each move in turn, stopping early at the
+        first move that isn't legal
+        """
+        game = self.start()
+        for text in self.moves:
+            try:
+                move = san.parse_san(game, text)
+            except san.InvalidSANException:
+                return
+            yield game, move
+            game = game.move(move)
+
+def iter_game_texts(fileobj):
+    """
+    Splits a PGN file into the text of each game, without parsing the games
+    """
+    lines = []
+    in_movetext = False
+    for line in fileobj:
+        if line.startswith('[') and in_movetext:
+            yield ''.join(lines)
+            lines = []
+            in_movetext = False
+        elif line.strip() and not line.startswith('['):
+            in_movetext = True
+        lines.append(line)
+    if any(line.strip() for line in lines):
+        yield ''.join(lines)
+
+def parse_game(text):
+    """
+    Parses the text of one game into a PGNGame
+
+    >>> game = parse_game('[White "a"]\\n\\n1. e4 {best} (1. d4) e5 2. Nf3 $1 *')
+    >>> game.headers, game.moves, game.result
+    ({'White': 'a'}, ['e4', 'e5', 'Nf3'], '*')
+    """
+    headers = dict((name, _UNESCAPE.sub(r'\1', value))
+                   for name, value in _TAG.findall(text))
+    movetext = _COMMENTS.sub(' ', _TAG.sub('', text))
+    while '(' in movetext:
+        stripped = _VARIATION.sub(' ', movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    movetext = _NAG.sub(' ', movetext)
+
+    moves = []
+    result = headers.get('Result', '*')
+    for token in movetext.split():
+        if token in RESULTS:
+            result = token
+            continue
+        token = _MOVE_NUMBER.sub('', token)
+        if token:
+            moves.append(token)
+    return PGNGame(headers, moves, result)
+
+def read_games(fileobj):
+    """
+    Yields a PGNGame for each game in a PGN file
+    """
+    for text in iter_game_texts(fileobj):
+        yield parse_game(text)
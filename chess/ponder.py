@@ -0,0 +1,123 @@
+# encoding: utf-8
+
+"""
+A persistent analysis session that thinks on the opponent's time
+
+    >>> limits = lambda: search.SearchLimits(depth=2)
+    >>> with PonderSession() as session:
+    ...     result = session.think(limits())
+    ...     session.play(result.best_move)
+    ...     result = session.opponent_moved(session.expected, limits())
+    >>> session.hits, session.misses, result.depth
+    (1, 0, 2)
+
+After each of our moves, the position after the reply we expect (the second
+move of our principal variation) is searched on a background thread until the
+opponent moves. One Searcher is kept for the whole game, so its
+transposition table, history and evaluation caches all carry over: when the
+expected reply is played, the search of the new position finds most of its
+tree already in the table and reaches the depth pondered almost at once; when
+another reply is played, whatever of the tree transposes is still reused.
+"""
+
+import threading
+
+import chess
+from chess import search
+
+class PonderSession(object):
+    """
+    The engine's side of a game. think() searches our move, play() makes it
+    and starts pondering, and opponent_moved() stops pondering, applies the
+    opponent's move and searches our reply. hits and misses count how often
+    the opponent played the expected move. ponder_result is the last
+    iteration completed while pondering, or None
+    """
+    def __init__(self, game=None, searcher=None):
+        self.game = game or chess.Game()
+        self.searcher = searcher or search.Searcher()
+        self.expected = None
+        self.hits = 0
+        self.misses = 0
+        self.ponder_result = None
+        self._last = None
+        self._limits = None
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def think(self, limits=None, info=None):
+        """
+        Stops any pondering, then searches the current position within limits
+        and returns the SearchResult. info is passed on to Searcher.search
+        """
+        self.stop()
+        self._last = self.searcher.search(self.game, limits, info)
+        return self._last
+
+    def play(self, move, expected=None):
+        """
+        Plays our move (a BasicMove or coordinate string), then ponders on
+        the position after expected, by default the reply predicted by the
+        last think. With no prediction, or an illegal one, the opponent's own
+        position is searched instead, which still fills the table with their
+        likely replies
+        """
+        self.stop()
+        move = self.game._coerce_move(move)
+        self.game = self.game.move(move)
+
+        last = self._last
+        if expected is None and last is not None and len(last.pv) > 1 and \
+                last.pv[0].coordinates() == move.coordinates():
+            expected = last.pv[1]
+        if expected is not None:
+            expected = self.game._coerce_move(expected)
+            if not self.game.is_legal(expected):
+                expected = None
+        self.expected = expected
+
+        game = self.game if expected is None else self.game.move(expected)
+        self._ponder(game)
+
+    def opponent_moved(self, move, limits=None, info=None):
+        """
+        Stops pondering, applies the opponent's move (a BasicMove or
+        coordinate string), and returns think(limits, info) for our reply
+        """
+        move = self.game._coerce_move(move)
+        if self.expected is not None and \
+                move.coordinates() == self.expected.coordinates():
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.stop()
+        self.game = self.game.move(move)
+        return self.think(limits, info)
+
+    def stop(self):
+        """
+        Stops pondering, if it's running, and waits for it to finish
+        """
+        if self._thread is not None:
+            self._limits.stop()
+            self._thread.join()
+            self._thread = None
+            self._limits = None
+
+    def _ponder(self, game):
+        self.ponder_result = None
+        self._limits = search.SearchLimits(infinite=True)
+        self._thread = threading.Thread(target=self._run_ponder,
+                                        args=(game, self._limits))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_ponder(self, game, limits):
+        def info(result):
+            self.ponder_result = result
+        self.searcher.search(game, limits, info)
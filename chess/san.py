@@ -0,0 +1,140 @@
+# encoding: utf-8
+
+"""
+Standard Algebraic Notation (SAN), as used by PGN and EPD
+
+    >>> game = chess.Game()
+    >>> move = parse_san(game, 'Nf3')
+    >>> move.coordinates(), to_san(game, move)
+    ('g1f3', 'Nf3')
+"""
+
+import re
+
+import chess
+
+#Piece letter (none for pawns), origin file and rank, capture, destination and
+#promotion. Annotations such as +, # and ?! are stripped first
+_SAN = re.compile(
+    r'([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$')
+_ANNOTATIONS = re.compile(r'[+#!?]+$')
+_COORDINATES = re.compile(r'[a-h][1-8][a-h][1-8][nbrqNBRQ]?$')
+
+class InvalidSANException(ValueError):
+    """
+    Raised when SAN text doesn't describe exactly one legal move in the
+    position
+    """
+    pass
+
+def _piece_at(game, square):
+    row, col = square.to_board_coordinates()
+    return game.board.squares[row][col]
+
+def _is_castle(game, move):
+    return _piece_at(game, move.start).upper() == 'K' and \
+        abs(ord(move.start.file_) - ord(move.end.file_)) == 2
+
+def parse_san(game, san):
+    """
+    Returns the legal BasicMove in game described by san. Castling may be
+    written with letter O or digit 0, and long algebraic coordinates such as
+    e7e8q are accepted too. Raises InvalidSANException otherwise
+
+    >>> parse_san(chess.Game(), 'e4').coordinates()
+    'e2e4'
+    """
+    text = _ANNOTATIONS.sub('', san.strip())
+    legal = game.legal_moves()
+
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        end_file = 'g' if len(text) == 3 else 'c'
+        matches = [move for move in legal if _is_castle(game, move) and
+                   move.end.file_ == end_file]
+    elif _COORDINATES.match(text):
+        wanted = chess.BasicMove.from_coordinates(text.lower())
+        matches = [move for move in legal if move == wanted and
+                   (move.promotion or '').upper() ==
+                   (wanted.promotion or '').upper()]
+    else:
+        match = _SAN.match(text)
+        if match is None:
+            raise InvalidSANException('"%s" is not SAN' % san)
+        kind, file_, rank_, _, end, promotion = match.groups()
+        kind = kind or 'P'
+        end = chess.BoardSquare(end)
+        matches = []
+        for move in legal:
+            if move.end != end or \
+                    _piece_at(game, move.start).upper() != kind or \
+                    (file_ is not None and move.start.file_ != file_) or \
+                    (rank_ is not None and move.start.rank_ != int(rank_)) or \
+                    (move.promotion or '').upper() != (promotion or ''):
+                continue
+            if kind == 'K' and _is_castle(game, move):
+                continue
+            matches.append(move)
+
+    if len(matches) != 1:
+        raise InvalidSANException('"%s" matches %d legal moves' %
+                                  (san, len(matches)))
+    return matches[0]
+
+def to_san(game, move, legal=None):
+    """
+    Returns the SAN for move, a legal move in game, including any check or
+    mate suffix. legal, if given, is the list of legal moves in game, saving
+    generating it again
+
+    >>> to_san(chess.Game('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'),
+    ...        chess.BasicMove('a1', 'a8'))
+    'Ra8#'
+    """
+    piece = _piece_at(game, move.start)
+    kind = piece.upper()
+
+    if kind == 'K' and _is_castle(game, move):
+        san = 'O-O' if move.end.file_ == 'g' else 'O-O-O'
+    else:
+        capture = _piece_at(game, move.end) is not None or \
+            (kind == 'P' and move.end == game.en_passant)
+        if kind == 'P':
+            san = move.start.file_ if capture else ''
+        else:
+            san = kind
+            if legal is None:
+                legal = game.legal_moves()
+            rivals = [other.start for other in legal
+                      if other.end == move.end and other.start != move.start
+                      and _piece_at(game, other.start) == piece]
+            if rivals:
+                if all(start.file_ != move.start.file_ for start in rivals):
+                    san += move.start.file_
+                elif all(start.rank_ != move.start.rank_ for start in rivals):
+                    san += str(move.start.rank_)
+                else:
+                    san += str(move.start)
+        if capture:
+            san += 'x'
+        san += str(move.end)
+        if move.promotion is not None:
+            san += '=' + move.promotion.upper()
+
+    after = game.move(move)
+    if after.board.in_check(after.active):
+        san += '#' if after.is_checkmate() else '+'
+    return san
+
+def line_to_san(game, moves):
+    """
+    Returns the SAN of each of a sequence of moves played from game
+
+    >>> line_to_san(chess.Game(), [chess.BasicMove.from_coordinates(move)
+    ...                            for move in ('e2e4', 'e7e5', 'g1f3')])
+    ['e4', 'e5', 'Nf3']
+    """
+    sans = []
+    for move in moves:
+        sans.append(to_san(game, move))
+        game = game.move(move)
+    return sans
@@ -0,0 +1,490 @@
+# encoding: utf-8
+
+"""
+Schedules analysis jobs, of differing urgency, onto a pool of worker processes
+
+    >>> with Scheduler(workers=1) as scheduler:
+    ...     job = scheduler.submit(chess.Game('k7/8/1K6/8/8/8/8/7R w - - 0 1'),
+    ...                            INTERACTIVE, depth=3)
+    ...     job.wait().best_move.coordinates(), job.state
+    ('h1h8', 'done')
+
+Each job is a search of one position with a priority (INTERACTIVE, NORMAL,
+BULK, or any other integer; lower is more urgent), a budget of depth, nodes
+and/or time, and optionally a deadline. Queued jobs are run most urgent
+first, then earliest deadline first, then in order of submission.
+
+When a job arrives and every worker is busy with less urgent work, the least
+urgent of those jobs is preempted: its search is stopped, and it goes back on
+the queue with its budget shrunk by the nodes and time it has already used.
+Each worker keeps one Searcher throughout, so a preempted job that returns to
+the same worker finds much of its earlier tree in the transposition table.
+Cancelling a job stops its search at the next node, and the best move found
+so far is kept as its result.
+
+A job's deadline is a time limit on the whole job, queueing included. A job
+still queued at its deadline expires without being run; a job running when
+its deadline approaches returns its best move so far. metrics() gives queue,
+service and total times and counts of outcomes per priority class.
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import threading
+from timeit import default_timer
+
+import chess
+from chess import search
+from chess.server import LatencyRecorder
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+#Names of the priority classes in metrics; other priorities are named by
+#number
+CLASS_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BULK: 'bulk'}
+
+#Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+FAILED = 'failed'
+
+#Seconds of a job's deadline set aside for sending its result back
+DEADLINE_MARGIN = 0.01
+
+#Why a running job's search was stopped
+_PREEMPTED = 'preempted'
+
+class SchedulerException(Exception):
+    """
+    Raised when a job can't be submitted
+    """
+    pass
+
+class Job(object):
+    """
+    A search of one position, as submitted, and its outcome. state is one of
+    QUEUED, RUNNING, DONE, CANCELLED, EXPIRED or FAILED. result is the
+    SearchResult once there is one (for a cancelled job, the best found
+    before it stopped), and error the message of a failure. preemptions
+    counts the times the job was stopped to make way for more urgent work,
+    and nodes_searched the nodes of all its searches together
+    """
+    def __init__(self, id_, scheduler, fen, priority, depth, nodes, movetime,
+                 deadline):
+        self.id = id_
+        self.fen = fen
+        self.priority = priority
+        self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+        self.submitted = default_timer()
+        self.deadline = None if deadline is None else \
+            self.submitted + deadline
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.preemptions = 0
+        self.nodes_searched = 0
+        #Seconds from submission to first starting, and spent running
+        self.queue_seconds = None
+        self.service_seconds = 0.0
+        self.finished = None
+        self._scheduler = scheduler
+        self._sequence = id_
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return '%s.%s(%r, %r, %r)' % (self.__class__.__module__,
+                                      self.__class__.__name__,
+                                      self.id,
+                                      self.priority,
+                                      self.state)
+
+    def done(self):
+        """
+        Returns True once the job has finished, in whatever state
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits up to timeout seconds (forever if None) for the job to finish
+        and returns its result, which is None if it has none yet
+        """
+        self._done.wait(timeout)
+        return self.result
+
+    def cancel(self):
+        """
+        Cancels the job; see Scheduler.cancel
+        """
+        return self._scheduler.cancel(self)
+
+    def _key(self):
+        return (self.priority,
+                self.deadline if self.deadline is not None else float('inf'),
+                self._sequence)
+
+class _StopFlag(object):
+    """
+    Stands in for a SearchLimits' stop event in a worker, set when the parent
+    writes the id of the job being searched into the shared value
+    """
+    def __init__(self, value, job_id):
+        self._value = value
+        self._job_id = job_id
+
+    def is_set(self):
+        return self._value.value == self._job_id
+
+    def set(self):
+        self._value.value = self._job_id
+
+def _work(connection, stop):
+    """
+    Worker function: searches the jobs sent over connection, until sent None,
+    replying with ('result', SearchResult) or ('error', message). stop is
+    the shared value the parent sets to a job's id to stop it
+    """
+    searcher = search.Searcher()
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        job_id, fen, depth, nodes, movetime = task
+        limits = search.SearchLimits(depth, nodes, movetime)
+        limits.stop_event = _StopFlag(stop, job_id)
+        try:
+            reply = ('result', searcher.search(chess.Game(fen), limits))
+        except Exception as e:
+            reply = ('error', '%s: %s' % (e.__class__.__name__, e))
+        connection.send(reply)
+    connection.close()
+
+class _Slot(object):
+    """
+    A worker process and the job it's running
+    """
+    def __init__(self):
+        self.stop = multiprocessing.RawValue('l', 0)
+        self.job = None
+        self.started = None
+        self.stop_reason = None
+        self.thread = None
+        self.start()
+
+    def start(self):
+        """
+        Starts a worker process for the slot, in place of any before it
+        """
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work,
+                                               args=(child, self.stop))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def restart(self):
+        """
+        Replaces a worker process that has died
+        """
+        self.connection.close()
+        self.process.join()
+        self.start()
+
+class Scheduler(object):
+    """
+    Runs submitted Jobs on workers worker processes, each with a thread in
+    this process feeding it jobs. A worker process that dies fails the job
+    it was running and is replaced; restarts counts how often
+    """
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers < 1:
+            raise ValueError('at least one worker is needed')
+        self._lock = threading.Condition()
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._queue_times = LatencyRecorder()
+        self._service_times = LatencyRecorder()
+        self._latencies = LatencyRecorder()
+        self._outcomes = {}
+        self.restarts = 0
+        self._slots = [_Slot() for _ in xrange(workers)]
+        for slot in self._slots:
+            slot.thread = threading.Thread(target=self._serve, args=(slot,))
+            slot.thread.daemon = True
+            slot.thread.start()
+        self._reaper = threading.Thread(target=self._expire)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, game, priority=NORMAL, depth=None, nodes=None,
+               movetime=None, deadline=None):
+        """
+        Queues a search of game within the given budget (depth in plies,
+        nodes, movetime in seconds) and deadline (seconds from now), at
+        least one of which is required. Returns the Job
+        """
+        if depth is None and nodes is None and movetime is None and \
+                deadline is None:
+            raise ValueError('a depth, node, time or deadline budget is '
+                             'required')
+        with self._lock:
+            if self._closed:
+                raise SchedulerException('scheduler is closed')
+            job = Job(next(self._ids), self, game.fen(), priority, depth,
+                      nodes, movetime, deadline)
+            self._push(job)
+            self._preempt_for(job)
+            self._lock.notify_all()
+        return job
+
+    def cancel(self, job):
+        """
+        Cancels job: a queued job is dropped, and a running one is stopped
+        promptly, keeping its best move so far. Returns False if the job had
+        already finished
+        """
+        with self._lock:
+            if job.state == QUEUED:
+                self._finish(job, CANCELLED)
+                return True
+            if job.state == RUNNING:
+                for slot in self._slots:
+                    if slot.job is job:
+                        self._stop(slot, CANCELLED)
+                return True
+            return False
+
+    def close(self):
+        """
+        Cancels every job not yet finished and stops the workers
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for _, job in self._queue:
+                if job.state == QUEUED:
+                    self._finish(job, CANCELLED)
+            self._queue = []
+            for slot in self._slots:
+                if slot.job is not None:
+                    self._stop(slot, CANCELLED)
+            self._lock.notify_all()
+        for slot in self._slots:
+            slot.thread.join()
+            try:
+                slot.connection.send(None)
+            except (IOError, OSError):
+                pass
+            slot.process.join()
+            slot.connection.close()
+        self._reaper.join()
+
+    def metrics(self):
+        """
+        Returns {class name: {queue, service, latency, done, cancelled,
+        expired, failed, preempted}} for each priority class seen. queue,
+        service and latency (submission to finish) are summaries in
+        milliseconds as LatencyRecorder.snapshot gives them, or None
+        without samples; the rest are counts of jobs
+        """
+        with self._lock:
+            outcomes = dict((name, dict(counts))
+                            for name, counts in self._outcomes.iteritems())
+        queue = self._queue_times.snapshot()
+        service = self._service_times.snapshot()
+        latency = self._latencies.snapshot()
+        figures = {}
+        for name, counts in outcomes.iteritems():
+            figures[name] = dict(counts, queue=queue.get(name),
+                                 service=service.get(name),
+                                 latency=latency.get(name))
+        return figures
+
+    def _class(self, job):
+        return CLASS_NAMES.get(job.priority, str(job.priority))
+
+    def _count(self, job, outcome):
+        counts = self._outcomes.setdefault(self._class(job), dict.fromkeys(
+            (DONE, CANCELLED, EXPIRED, FAILED, _PREEMPTED), 0))
+        counts[outcome] += 1
+
+    def _push(self, job):
+        job.state = QUEUED
+        heapq.heappush(self._queue, (job._key(), job))
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state = state
+        if result is not None:
+            job.result = result
+        job.error = error
+        job.finished = default_timer()
+        name = self._class(job)
+        self._count(job, state)
+        if job.queue_seconds is not None:
+            self._service_times.record(name, job.service_seconds)
+        self._latencies.record(name, job.finished - job.submitted)
+        job._done.set()
+
+    def _stop(self, slot, reason):
+        slot.stop_reason = reason
+        slot.stop.value = slot.job.id
+
+    def _preempt_for(self, job):
+        """
+        Stops the least urgent running job, if every worker is busy and it's
+        less urgent than job
+        """
+        if any(slot.job is None for slot in self._slots):
+            return
+        running = [slot for slot in self._slots if slot.stop_reason is None]
+        if not running:
+            return
+        victim = max(running,
+                     key=lambda slot: (slot.job.priority, slot.started))
+        if victim.job.priority > job.priority:
+            self._stop(victim, _PREEMPTED)
+
+    def _next_job(self):
+        """
+        Waits for a job to run and returns it, or None once closed. Call
+        with the lock held
+        """
+        while not self._closed:
+            while self._queue:
+                _, job = heapq.heappop(self._queue)
+                if job.state != QUEUED:
+                    continue
+                if job.deadline is not None and \
+                        default_timer() >= job.deadline - DEADLINE_MARGIN:
+                    self._finish(job, EXPIRED)
+                    continue
+                return job
+            self._lock.wait()
+        return None
+
+    def _task(self, job, now):
+        """
+        Returns what's sent to a worker for job: its budget, less what it's
+        used already, and with the time cut short by its deadline
+        """
+        movetime = job.movetime
+        if movetime is not None:
+            movetime = max(0.0, movetime - job.service_seconds)
+        if job.deadline is not None:
+            remaining = max(0.0, job.deadline - DEADLINE_MARGIN - now)
+            movetime = remaining if movetime is None else \
+                min(movetime, remaining)
+        nodes = job.nodes
+        if nodes is not None:
+            nodes = max(1, nodes - job.nodes_searched)
+        return (job.id, job.fen, job.depth, nodes, movetime)
+
+    def _serve(self, slot):
+        """
+        Feeds jobs to slot's worker and records what comes back, until the
+        scheduler is closed, starting a new worker if the old one dies
+        """
+        while True:
+            with self._lock:
+                job = self._next_job()
+                if job is None:
+                    return
+                now = default_timer()
+                if job.queue_seconds is None:
+                    job.queue_seconds = now - job.submitted
+                    self._queue_times.record(self._class(job),
+                                             job.queue_seconds)
+                job.state = RUNNING
+                slot.job = job
+                slot.started = now
+                slot.stop_reason = None
+                slot.stop.value = 0
+                task = self._task(job, now)
+            #A worker that died while idle is replaced before it's given work
+            if not slot.process.is_alive():
+                slot.restart()
+                with self._lock:
+                    self.restarts += 1
+            died = False
+            try:
+                slot.connection.send(task)
+                kind, value = slot.connection.recv()
+            except (EOFError, IOError, OSError):
+                died = True
+                kind, value = 'error', 'worker process died'
+            #The replacement is started before the job is finished, so that
+            #the slot is ready for work by the time anyone learns it failed
+            restarted = died and not self._closed
+            if restarted:
+                slot.restart()
+            with self._lock:
+                if restarted:
+                    self.restarts += 1
+                slot.job = None
+                job.service_seconds += default_timer() - slot.started
+                if kind == 'result':
+                    job.nodes_searched += value.nodes
+                if kind == 'error':
+                    self._finish(job, FAILED, error=value)
+                elif slot.stop_reason == _PREEMPTED and not self._closed:
+                    self._requeue(job, value)
+                elif slot.stop_reason is not None:
+                    self._finish(job, slot.stop_reason, value)
+                else:
+                    self._finish(job, DONE, value)
+                self._lock.notify_all()
+
+    def _requeue(self, job, result):
+        """
+        Puts a preempted job back on the queue, unless it's used up its
+        budget, in which case it's done
+        """
+        self._count(job, _PREEMPTED)
+        job.preemptions += 1
+        if result.best_move is not None and \
+                (job.result is None or result.depth >= job.result.depth):
+            job.result = result
+        exhausted = (job.movetime is not None and
+                     job.service_seconds >= job.movetime) or \
+            (job.nodes is not None and job.nodes_searched >= job.nodes) or \
+            (job.depth is not None and result.depth >= job.depth)
+        if exhausted:
+            self._finish(job, DONE)
+        else:
+            self._push(job)
+
+    def _expire(self):
+        """
+        Expires queued jobs as their deadlines pass, so that they finish
+        on time even while every worker is busy
+        """
+        with self._lock:
+            while not self._closed:
+                now = default_timer()
+                deadlines = []
+                for _, job in self._queue:
+                    if job.state != QUEUED or job.deadline is None:
+                        continue
+                    if now >= job.deadline - DEADLINE_MARGIN:
+                        self._finish(job, EXPIRED)
+                    else:
+                        deadlines.append(job.deadline - DEADLINE_MARGIN)
+                self._lock.wait(min(deadlines) - now if deadlines else None)
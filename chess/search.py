@@ -0,0 +1,708 @@
+# encoding: utf-8
+
+"""
+Iterative deepening alpha-beta search on top of Game
+"""
+
+from timeit import default_timer
+
+import chess
+from chess import pawns, tables, zobrist
+
+MATE_SCORE = 100000
+#Scores further from zero than this are mates
+MATE_THRESHOLD = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+MAX_DEPTH = 64
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+#Transposition table entry flags
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+#Null move pruning: minimum depth, and the depth reduction (plus one more
+#from NULL_MOVE_DEEP_DEPTH on)
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_DEEP_DEPTH = 7
+
+#Late move reductions: moves searched in full before reducing, minimum depth,
+#and the number of moves after which the reduction is two plies
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+LMR_DEEP_MOVES = 8
+
+#Futility pruning and razoring margins, by depth
+FUTILITY_MARGINS = {1: 200, 2: 500}
+RAZOR_MARGINS = {1: 300, 2: 600}
+
+#Default bound on the number of static evaluations cached
+EVAL_CACHE_ENTRIES = 1 << 18
+
+#Search statistics, counted afresh for each search
+STATS = ('null_move_tries', 'null_move_cutoffs', 'lmr_reductions',
+         'lmr_researches', 'futility_prunes', 'razor_prunes')
+
+def _build_piece_square_tables():
+    """
+    Returns {piece: [[value, ...], ...]} giving, in _Board coordinates, the
+    material plus positional value of each piece on each square; positive for
+    white pieces, negative for black
+    """
+    def centrality(row, col):
+        """
+        Returns 3 for the four central squares, down to 0 for the edge
+        """
+        return 3 - int(max(abs(row - 3.5), abs(col - 3.5)))
+
+    tables = {}
+    for kind, value in PIECE_VALUES.iteritems():
+        for piece, sign in ((kind, 1), (kind.lower(), -1)):
+            table = []
+            for row in xrange(8):
+                table_row = []
+                for col in xrange(8):
+                    if kind == 'P':
+                        advanced = 6 - row if sign == 1 else row - 1
+                        bonus = 5 * advanced
+                    elif kind == 'N':
+                        bonus = 10 * centrality(row, col)
+                    elif kind == 'B':
+                        bonus = 5 * centrality(row, col)
+                    elif kind == 'Q':
+                        bonus = 2 * centrality(row, col)
+                    else:
+                        bonus = 0
+                    table_row.append(sign * (value + bonus))
+                table.append(table_row)
+            tables[piece] = table
+    return tables
+
+_PIECE_SQUARE_TABLES = tables.cached('search', _build_piece_square_tables,
+                                     key=PIECE_VALUES)
+
+def evaluate(game):
+    """
+    Returns a static evaluation of game in centipawns (material plus simple
+    positional terms), from the point of view of the side to move
+
+    >>> evaluate(chess.Game())
+    0
+    """
+    score = 0
+    tables = _PIECE_SQUARE_TABLES
+    for row, pieces_in_row in enumerate(game.board.squares):
+        for col, piece in enumerate(pieces_in_row):
+            if piece is not None:
+                score += tables[piece][row][col]
+    return score if game.active == 'w' else -score
+
+def position_key(game):
+    """
+    Returns a hashable key identifying the position (but not the move clocks)
+    of game
+    """
+    return game.fen().rsplit(' ', 2)[0]
+
+def make_move(game, move):
+    """
+    Returns a new Game with move, which must already be known to be legal,
+    applied
+    """
+    child = game._copy()
+    child._apply_move(move)
+    return child
+
+def make_null_move(game):
+    """
+    Returns a new Game with the side to move passing. Only for use inside the
+    search: passing isn't a legal move
+    """
+    child = game._copy()
+    if child.active == 'b':
+        child.fullmove += 1
+    child.active = chess._other_colour(child.active)
+    child.en_passant = None
+    child.halfmove += 1
+    return child
+
+def has_pieces(game, colour):
+    """
+    Returns True if colour has anything besides king and pawns, i.e. isn't
+    at risk of zugzwang
+    """
+    pieces = 'NBRQ' if colour == 'w' else 'nbrq'
+    for row in game.board.squares:
+        for piece in row:
+            if piece is not None and piece in pieces:
+                return True
+    return False
+
+def _is_quiet(game, move):
+    """
+    Returns True if move neither captures nor promotes
+    """
+    if move.promotion is not None:
+        return False
+    row, col = move.end.to_board_coordinates()
+    if game.board.squares[row][col] is not None:
+        return False
+    return move.end != game.en_passant
+
+class EvalCache(object):
+    """
+    Bounded cache of static evaluations by placement key (see
+    chess.zobrist.board_hash), counting its hits. Scores are from white's
+    point of view, so a position is looked up alike whichever side is to move
+    """
+    def __init__(self, max_entries=EVAL_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        return float(self.hits) / self.probes if self.probes else 0.0
+
+    def reset_counters(self):
+        self.probes = 0
+        self.hits = 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def get(self, key):
+        self.probes += 1
+        score = self.entries.get(key)
+        if score is not None:
+            self.hits += 1
+        return score
+
+    def store(self, key, score):
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        self.entries[key] = score
+
+class SearchLimits(object):
+    """
+    Bounds on a search: a maximum depth in plies, a node count and a time in
+    seconds. Any combination may be given. An infinite search ignores movetime
+    until it is cleared (see ponderhit) and otherwise only ends when stopped or
+    at MAX_DEPTH
+    """
+    def __init__(self, depth=None, nodes=None, movetime=None, infinite=False):
+        self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+        self.infinite = infinite
+        self.deadline = None
+        #threading is only needed once there's a search to stop, so isn't
+        #imported with the module
+        import threading
+        self.stop_event = threading.Event()
+
+    def start(self):
+        """
+        Starts the clock, if this search has a time limit
+        """
+        if self.movetime is not None and not self.infinite:
+            self.deadline = default_timer() + self.movetime
+
+    def ponderhit(self):
+        """
+        Turns an infinite (pondering) search into a normal one, starting the
+        clock now
+        """
+        self.infinite = False
+        self.start()
+
+    def stop(self):
+        """
+        Asks the search using these limits to stop as soon as possible
+        """
+        self.stop_event.set()
+
+class SearchResult(object):
+    """
+    Outcome of a search to a given depth. score is in centipawns from the point
+    of view of the side to move; pv is a list of BasicMoves starting with
+    best_move. stats counts how often each selective technique fired (see
+    STATS)
+    """
+    def __init__(self, best_move, score, depth, pv, nodes, seconds,
+                 stats=None):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.pv = pv
+        self.nodes = nodes
+        self.seconds = seconds
+        self.stats = stats or dict.fromkeys(STATS, 0)
+
+    @property
+    def nps(self):
+        if self.seconds <= 0:
+            return 0
+        return int(self.nodes / self.seconds)
+
+    def mate_in(self):
+        """
+        Returns the number of moves to mate (negative if the side to move is
+        being mated), or None if the score isn't a mate
+        """
+        if self.score > MATE_THRESHOLD:
+            return (MATE_SCORE - self.score + 1) // 2
+        if self.score < -MATE_THRESHOLD:
+            return -((MATE_SCORE + self.score) // 2)
+        return None
+
+    def __repr__(self):
+        return '%s.%s(%s, %r, %r, [%s], %r, %r)' % (
+            self.__class__.__module__, self.__class__.__name__,
+            self.best_move and self.best_move.coordinates(), self.score,
+            self.depth, ' '.join(move.coordinates() for move in self.pv),
+            self.nodes, self.seconds)
+
+class _SearchAborted(Exception):
+    """
+    Raised inside the search when a limit is hit or a stop is requested
+    """
+    pass
+
+class Searcher(object):
+    """
+    Alpha-beta searcher. Holds the transposition table between searches, so
+    reuse one instance across the moves of a game, along with the caches of
+    pawn structures and evaluations (whose hit rates are counted afresh for
+    each search). Each selective technique (null move pruning, late move
+    reductions, futility pruning and razoring) can be switched off for
+    comparison; stats counts how often each fired in the last search
+
+    >>> result = Searcher().search(chess.Game('k7/8/1K6/8/8/8/8/7R w - - 0 1'),
+    ...                            SearchLimits(depth=2))
+    >>> result.best_move.coordinates(), result.mate_in()
+    ('h1h8', 1)
+    """
+    def __init__(self, max_tt_entries=1 << 20, null_move=True, lmr=True,
+                 futility=True, razoring=True):
+        self.max_tt_entries = max_tt_entries
+        self.null_move = null_move
+        self.lmr = lmr
+        self.futility = futility
+        self.razoring = razoring
+        self.tt = {}
+        #(piece, end square) -> score of quiet moves that caused cutoffs
+        self.history = {}
+        self.pawn_table = pawns.PawnTable()
+        self.eval_cache = EvalCache()
+        self.nodes = 0
+        self.stats = dict.fromkeys(STATS, 0)
+        self.limits = SearchLimits()
+        self._root_move = None
+
+    def clear(self):
+        """
+        Forgets everything learned in previous searches
+        """
+        self.tt.clear()
+        self.history.clear()
+
+    def stop(self):
+        """
+        Stops the current search, if any
+        """
+        self.limits.stop()
+
+    def search(self, game, limits=None, info=None):
+        """
+        Searches game by iterative deepening within limits, returning a
+        SearchResult for the deepest completed iteration. info, if given, is
+        called with the SearchResult of every completed iteration
+        """
+        started = default_timer()
+        limits = self._start(limits)
+
+        root_moves = list(game.generate_moves())
+        if not root_moves:
+            score = -MATE_SCORE if game.board.in_check(game.active) else 0
+            return SearchResult(None, score, 0, [], 0, 0.0)
+
+        keys = (zobrist.board_hash(game.board), zobrist.pawn_hash(game.board))
+        result = SearchResult(root_moves[0], 0, 0, [root_moves[0]], 0, 0.0)
+        for depth in xrange(1, (limits.depth or MAX_DEPTH) + 1):
+            try:
+                score = self._negamax(game, depth, -INFINITY, INFINITY, 0,
+                                      keys)
+            except _SearchAborted:
+                break
+            pv = [self._root_move] + self._principal_variation(
+                make_move(game, self._root_move), depth - 1)
+            result = SearchResult(pv[0], score, depth, pv, self.nodes,
+                                  default_timer() - started, dict(self.stats))
+            if info is not None:
+                info(result)
+            if abs(score) > MATE_THRESHOLD and \
+                    MATE_SCORE - abs(score) <= depth and not limits.infinite:
+                break
+
+        result.nodes = self.nodes
+        result.seconds = default_timer() - started
+        result.stats = dict(self.stats)
+        return result
+
+    def search_multipv(self, game, lines, limits=None, info=None, moves=None):
+        """
+        As search, but finds the best lines moves with exact scores, not just
+        the best one, considering only the root moves in moves if given.
+        Returns a list of SearchResults, one per line and best first, from the
+        deepest completed iteration (or, if there are no legal moves, the one
+        result search would give). info, if given, is called with the list
+        after every completed iteration
+
+        >>> results = Searcher().search_multipv(
+        ...     chess.Game('k7/8/1K6/8/8/8/8/7R w - - 0 1'), 2,
+        ...     SearchLimits(depth=3))
+        >>> [(result.best_move.coordinates(), result.mate_in())
+        ...  for result in results]
+        [('h1h8', 1), ('b6c7', 2)]
+
+        Each iteration searches every root move once. The first lines moves
+        get a full window; after that a move need only be shown no better
+        than the lines-th best so far, with a null window, and is searched
+        again in full only if it is better, so most are refuted cheaply.
+        The transposition table is shared by all the lines, and the root moves
+        are searched in order of their scores in the previous iteration
+        """
+        started = default_timer()
+        limits = self._start(limits)
+
+        root_moves = list(game.generate_moves())
+        if moves is not None:
+            #Compared as coordinates, as BasicMove equality ignores promotion
+            wanted = set(move.coordinates() for move in moves)
+            root_moves = [move for move in root_moves
+                          if move.coordinates() in wanted]
+        if not root_moves:
+            score = -MATE_SCORE if game.board.in_check(game.active) else 0
+            return [SearchResult(None, score, 0, [], 0, 0.0)]
+        lines = min(lines, len(root_moves))
+
+        keys = (zobrist.board_hash(game.board), zobrist.pawn_hash(game.board))
+        results = []
+        for depth in xrange(1, (limits.depth or MAX_DEPTH) + 1):
+            #(score, move, pv) of the best lines so far, best first
+            best = []
+            scores = {}
+            try:
+                self.nodes += 1
+                for move in root_moves:
+                    if len(best) < lines:
+                        alpha = -INFINITY
+                    else:
+                        alpha = best[-1][0]
+                    child = make_move(game, move)
+                    child_keys = zobrist.update_keys(game.board, move, *keys)
+                    if alpha > -INFINITY:
+                        #Only needs to be shown no better than alpha, which a
+                        #null window does most cheaply
+                        score = -self._negamax(child, depth - 1, -alpha - 1,
+                                               -alpha, 1, child_keys)
+                        if score > alpha:
+                            score = -self._negamax(child, depth - 1,
+                                                   -INFINITY, -alpha, 1,
+                                                   child_keys)
+                    else:
+                        score = -self._negamax(child, depth - 1, -INFINITY,
+                                               INFINITY, 1, child_keys)
+                    scores[move.coordinates()] = score
+                    if score > alpha:
+                        pv = [move] + self._principal_variation(child,
+                                                                depth - 1)
+                        best.append((score, move, pv))
+                        best.sort(key=lambda line: -line[0])
+                        del best[lines:]
+            except _SearchAborted:
+                break
+            #Scores of moves outside the best lines are only upper bounds,
+            #but still order the next iteration well
+            root_moves.sort(key=lambda move: -scores[move.coordinates()])
+            seconds = default_timer() - started
+            results = [SearchResult(move, score, depth, pv, self.nodes,
+                                    seconds, dict(self.stats))
+                       for score, move, pv in best]
+            if info is not None:
+                info(results)
+            if not limits.infinite and all(
+                    abs(score) > MATE_THRESHOLD and
+                    MATE_SCORE - abs(score) <= depth
+                    for score, _, _ in best):
+                break
+
+        if not results:
+            #Not even the first iteration finished
+            move = root_moves[0]
+            results = [SearchResult(move, 0, 0, [move], 0, 0.0)]
+        for result in results:
+            result.nodes = self.nodes
+            result.seconds = default_timer() - started
+            result.stats = dict(self.stats)
+        return results
+
+    def _start(self, limits):
+        """
+        Resets the counters for a new search within limits (unbounded if
+        None), starts its clock and returns the limits
+        """
+        if limits is None:
+            limits = SearchLimits()
+        self.limits = limits
+        self.nodes = 0
+        self.stats = dict.fromkeys(STATS, 0)
+        self.pawn_table.reset_counters()
+        self.eval_cache.reset_counters()
+        #Older searches count for less in move ordering
+        history = self.history
+        for key in history.keys():
+            history[key] >>= 1
+            if not history[key]:
+                del history[key]
+        limits.start()
+        return limits
+
+    def _check_limits(self):
+        limits = self.limits
+        if limits.stop_event.is_set():
+            raise _SearchAborted()
+        if limits.nodes is not None and self.nodes >= limits.nodes:
+            raise _SearchAborted()
+        if limits.deadline is not None and not limits.infinite and \
+                default_timer() >= limits.deadline:
+            raise _SearchAborted()
+
+    def _store(self, key, depth, score, flag, move, ply):
+        if len(self.tt) >= self.max_tt_entries:
+            self.tt.clear()
+        #Mate scores are stored relative to this node, not the root
+        if score > MATE_THRESHOLD:
+            score += ply
+        elif score < -MATE_THRESHOLD:
+            score -= ply
+        self.tt[key] = (depth, score, flag, move)
+
+    def _probe(self, key, ply):
+        entry = self.tt.get(key)
+        if entry is None:
+            return None
+        depth, score, flag, move = entry
+        if score > MATE_THRESHOLD:
+            score -= ply
+        elif score < -MATE_THRESHOLD:
+            score += ply
+        return depth, score, flag, move
+
+    def _evaluate(self, game, keys):
+        """
+        Returns evaluate(game) plus pawn structure and king shelter, going
+        via the caches. keys are game's placement and pawn keys
+        """
+        board_key, pawn_key = keys
+        score = self.eval_cache.get(board_key)
+        if score is None:
+            score = evaluate(game)
+            if game.active == 'b':
+                score = -score
+            score += self.pawn_table.evaluate(game.board, pawn_key)
+            self.eval_cache.store(board_key, score)
+        return score if game.active == 'w' else -score
+
+    def _negamax(self, game, depth, alpha, beta, ply, keys, allow_null=True):
+        self._check_limits()
+        self.nodes += 1
+
+        if ply and game.halfmove >= 100:
+            return 0
+
+        key = position_key(game)
+        hash_move = None
+        entry = self._probe(key, ply)
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, hash_move = entry
+            if ply and entry_depth >= depth:
+                if entry_flag == EXACT:
+                    return entry_score
+                if entry_flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if entry_flag == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        in_check = game.board.in_check(game.active)
+        if depth <= 0:
+            #Positions in check at the horizon are searched a ply further, so
+            #that mates are seen
+            if not in_check:
+                return self._quiesce(game, alpha, beta, ply, keys)
+            depth = 1
+
+        #Selective techniques only apply away from the root and out of check,
+        #and only against bounds that aren't mate scores
+        selective = ply and not in_check
+        static_eval = self._evaluate(game, keys) if selective else None
+        hopeless = selective and abs(alpha) < MATE_THRESHOLD
+        winning = selective and abs(beta) < MATE_THRESHOLD and \
+            static_eval >= beta
+
+        if hopeless and self.razoring and depth in RAZOR_MARGINS and \
+                beta - alpha == 1 and hash_move is None and \
+                static_eval + RAZOR_MARGINS[depth] <= alpha:
+            #Hopeless even with a margin: unless quiescence finds something,
+            #don't bother searching. Quiescence can't see mates, so this is
+            #kept out of the principal variation
+            score = self._quiesce(game, alpha, alpha + 1, ply, keys)
+            if score <= alpha:
+                self.stats['razor_prunes'] += 1
+                return score
+
+        if winning and self.null_move and allow_null and \
+                depth >= NULL_MOVE_MIN_DEPTH and has_pieces(game, game.active):
+            #If passing still fails high, a real move surely would. Not tried
+            #in pawn endings, where zugzwang makes passing an advantage
+            self.stats['null_move_tries'] += 1
+            reduction = NULL_MOVE_REDUCTION + (depth >= NULL_MOVE_DEEP_DEPTH)
+            score = -self._negamax(make_null_move(game),
+                                   depth - 1 - reduction, -beta, -beta + 1,
+                                   ply + 1, keys, False)
+            if score >= beta:
+                self.stats['null_move_cutoffs'] += 1
+                return beta
+
+        futile = hopeless and self.futility and depth in FUTILITY_MARGINS and \
+            static_eval + FUTILITY_MARGINS[depth] <= alpha
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        pruned = False
+        moves = self._ordered_moves(game, hash_move)
+        for number, move in enumerate(moves):
+            child = make_move(game, move)
+            child_keys = zobrist.update_keys(game.board, move, *keys)
+            quiet = number and _is_quiet(game, move) and \
+                not child.board.in_check(child.active)
+
+            if futile and quiet:
+                #Too far below alpha for a quiet move to make up
+                self.stats['futility_prunes'] += 1
+                pruned = True
+                continue
+
+            if self.lmr and quiet and not in_check and ply and \
+                    number >= LMR_FULL_MOVES and depth >= LMR_MIN_DEPTH:
+                self.stats['lmr_reductions'] += 1
+                reduction = 2 if number >= LMR_DEEP_MOVES else 1
+                score = -self._negamax(child, depth - 1 - reduction,
+                                       -alpha - 1, -alpha, ply + 1, child_keys)
+                if score > alpha:
+                    #Better than expected, so look again properly
+                    self.stats['lmr_researches'] += 1
+                    score = -self._negamax(child, depth - 1, -beta, -alpha,
+                                           ply + 1, child_keys)
+            else:
+                score = -self._negamax(child, depth - 1, -beta, -alpha,
+                                       ply + 1, child_keys)
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if _is_quiet(game, move):
+                    history_key = (game.board.piece_at_board_square(
+                        move.start), move.end)
+                    self.history[history_key] = \
+                        self.history.get(history_key, 0) + depth * depth
+                break
+
+        if best_move is None:
+            if pruned:
+                return alpha
+            if in_check:
+                return -MATE_SCORE + ply
+            return 0
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self._store(key, depth, best_score, flag, best_move, ply)
+        if not ply:
+            self._root_move = best_move
+        return best_score
+
+    def _ordered_moves(self, game, hash_move):
+        """
+        Yields game's legal moves as generate_moves does, but with the quiet
+        moves in order of their history scores: how often, and how deep,
+        moving the same piece to the same square has caused a cutoff
+        """
+        for move in game.generate_moves(hash_move=hash_move, quiets=False):
+            yield move
+        history = self.history
+        squares = game.board.squares
+        quiets = []
+        for number, move in enumerate(game.pseudo_legal_quiets()):
+            if hash_move is not None and move == hash_move:
+                continue
+            row, col = move.start.to_board_coordinates()
+            piece = squares[row][col]
+            quiets.append((-history.get((piece, move.end), 0), number, move,
+                           piece))
+        quiets.sort()
+        for _, _, move, piece in quiets:
+            if game._is_legal_move(move, piece):
+                yield move
+
+    def _quiesce(self, game, alpha, beta, ply, keys):
+        self._check_limits()
+        self.nodes += 1
+
+        stand_pat = self._evaluate(game, keys)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        for move in game.generate_moves(quiets=False):
+            child_keys = zobrist.update_keys(game.board, move, *keys)
+            score = -self._quiesce(make_move(game, move), -beta, -alpha,
+                                   ply + 1, child_keys)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _principal_variation(self, game, depth):
+        """
+        Follows best moves through the transposition table from game
+        """
+        pv = []
+        seen = set()
+        while len(pv) < depth:
+            key = position_key(game)
+            if key in seen or key not in self.tt:
+                break
+            seen.add(key)
+            move = self.tt[key][3]
+            if move is None or not game.is_legal(move):
+                break
+            pv.append(move)
+            game = make_move(game, move)
+        return pv
@@ -0,0 +1,283 @@
+# encoding: utf-8
+
+"""
+Multi-game session server, speaking newline-delimited JSON over TCP:
+
+    python -m chess.server --port 7777 --workers 4
+
+Each request is one JSON object with an "op" field; each response is one JSON
+object with "ok" set, plus either results or an "error". Supported ops:
+
+    new      [fen]            -> id, fen
+    get      id               -> fen, status
+    moves    id [square]      -> moves (coordinate strings)
+    move     id move          -> fen, status
+    delete   id               -> (nothing)
+    metrics                   -> games, per-op latency figures
+
+Games are held only as FEN strings between requests, so idle games cost around
+a hundred bytes each. Validation and move generation run in a pool of worker
+processes, so a slow request never holds up the others.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import SocketServer
+import threading
+from timeit import default_timer
+
+import chess
+from chess import batch
+
+#Number of recent latencies kept per op for percentiles
+LATENCY_WINDOW = 10000
+
+class SessionException(Exception):
+    """
+    Raised for requests that can't be satisfied, e.g. unknown games
+    """
+    pass
+
+def _check_fen(fen):
+    """
+    Returns fen as a str, raising SessionException unless batch.check_fen
+    accepts it
+    """
+    try:
+        return batch.check_fen(fen)
+    except ValueError as error:
+        raise SessionException(str(error))
+
+def _status(game):
+    if game.board.in_check(game.active):
+        if game.is_checkmate():
+            return 'checkmate'
+        return 'check'
+    if game.is_stalemate():
+        return 'stalemate'
+    return 'active'
+
+def _apply_move(fen, move):
+    """
+    Worker function: returns (new FEN, status) after move, or raises
+    """
+    game = chess.Game(fen)
+    try:
+        game = game.replay([move])
+    except chess.InvalidReplayException:
+        raise SessionException('illegal move %s' % move)
+    return game.fen(), _status(game)
+
+def _legal_moves(fen, square=None):
+    """
+    Worker function: returns legal moves as coordinate strings, optionally only
+    those from square
+    """
+    game = chess.Game(fen)
+    return [move.coordinates() for move in game.generate_moves()
+            if square is None or str(move.start) == square]
+
+def _describe(fen):
+    """
+    Worker function: returns the status of the position
+    """
+    return _status(chess.Game(fen))
+
+class _Inline(object):
+    """
+    Stands in for a process pool, running work in the calling thread
+    """
+    def apply(self, func, args=()):
+        return func(*args)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+class LatencyRecorder(object):
+    """
+    Keeps counts and a window of recent latencies per op
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counts = collections.defaultdict(int)
+        self._samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=self._window))
+
+    def record(self, op, seconds):
+        with self._lock:
+            self._counts[op] += 1
+            self._samples[op].append(seconds)
+
+    def snapshot(self):
+        """
+        Returns {op: {count, mean, p50, p99, max}}, latencies in milliseconds
+        """
+        with self._lock:
+            samples = dict((op, sorted(values))
+                           for op, values in self._samples.iteritems())
+            counts = dict(self._counts)
+        figures = {}
+        for op, values in samples.iteritems():
+            if not values:
+                continue
+            def percentile(fraction):
+                index = min(len(values) - 1, int(fraction * len(values)))
+                return values[index] * 1000
+            figures[op] = {
+                'count': counts[op],
+                'mean': sum(values) * 1000 / len(values),
+                'p50': percentile(0.5),
+                'p99': percentile(0.99),
+                'max': values[-1] * 1000,
+            }
+        return figures
+
+class SessionManager(object):
+    """
+    Holds live games by id and executes requests against them. workers is the
+    size of the process pool used for validation; 0 runs everything in the
+    calling thread
+    """
+    def __init__(self, workers=0):
+        self._games = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pool = multiprocessing.Pool(workers) if workers else _Inline()
+        self.latency = LatencyRecorder()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __len__(self):
+        return len(self._games)
+
+    def _fen(self, game_id):
+        try:
+            return self._games[game_id]
+        except KeyError:
+            raise SessionException('no game %r' % game_id)
+
+    def new_game(self, fen=None):
+        if fen is not None:
+            fen = _check_fen(fen)
+        game = chess.Game(fen)
+        fen = game.fen()
+        with self._lock:
+            game_id = next(self._ids)
+            self._games[game_id] = fen
+        return game_id, fen
+
+    def get(self, game_id):
+        fen = self._fen(game_id)
+        return fen, self._pool.apply(_describe, (fen,))
+
+    def legal_moves(self, game_id, square=None):
+        return self._pool.apply(_legal_moves, (self._fen(game_id), square))
+
+    def move(self, game_id, move):
+        fen = self._fen(game_id)
+        new_fen, status = self._pool.apply(_apply_move, (fen, move))
+        with self._lock:
+            #Another request may have moved in the meantime
+            if self._games.get(game_id) != fen:
+                raise SessionException('game %r changed, retry' % game_id)
+            self._games[game_id] = new_fen
+        return new_fen, status
+
+    def delete(self, game_id):
+        with self._lock:
+            if self._games.pop(game_id, None) is None:
+                raise SessionException('no game %r' % game_id)
+
+    def handle(self, request):
+        """
+        Executes one request dict, returning the response dict
+        """
+        started = default_timer()
+        op = request.get('op')
+        try:
+            if op == 'new':
+                game_id, fen = self.new_game(request.get('fen'))
+                response = {'id': game_id, 'fen': fen}
+            elif op == 'get':
+                fen, status = self.get(request.get('id'))
+                response = {'fen': fen, 'status': status}
+            elif op == 'moves':
+                response = {'moves': self.legal_moves(request.get('id'),
+                                                      request.get('square'))}
+            elif op == 'move':
+                fen, status = self.move(request.get('id'), request.get('move'))
+                response = {'fen': fen, 'status': status}
+            elif op == 'delete':
+                self.delete(request.get('id'))
+                response = {}
+            elif op == 'metrics':
+                response = {'games': len(self),
+                            'latency': self.latency.snapshot()}
+            else:
+                raise SessionException('unknown op %r' % op)
+            response['ok'] = True
+        except (SessionException, ValueError, TypeError,
+                chess.InvalidSquareException) as error:
+            response = {'ok': False, 'error': str(error)}
+        self.latency.record(op if isinstance(op, basestring) else '?',
+                            default_timer() - started)
+        return response
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('request must be an object')
+            except ValueError as error:
+                response = {'ok': False, 'error': str(error)}
+            else:
+                response = self.server.manager.handle(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+class SessionServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    TCP server handling each connection on its own thread, all sharing one
+    SessionManager
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, manager):
+        SocketServer.TCPServer.__init__(self, address, _Handler)
+        self.manager = manager
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Chess game session server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='validation processes (0 to validate inline)')
+    args = parser.parse_args(argv)
+
+    manager = SessionManager(args.workers)
+    server = SessionServer((args.host, args.port), manager)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# encoding: utf-8
+
+"""
+Hands positions to pooled worker processes through shared memory
+
+    >>> import struct
+    >>> games = [chess.Game(), chess.Game('4k3/8/8/8/8/8/8/4K3 w - - 0 1')]
+    >>> count = struct.Struct('<H')
+    >>> with SharedPool(legal_move_count, count, workers=0) as pool:
+    ...     pool.map(games)
+    [(20,), (5,)]
+
+Sending Games to a multiprocessing.Pool pickles their boards, castling state
+and squares for every position, there and back. A SharedPool instead packs
+positions as batch.RECORDs into an input buffer in shared memory, and each
+worker unpacks the positions it's given straight from there and packs its
+results, with a fixed-width struct, into a shared output buffer. The buffers
+are handed to the workers once, when the pool starts; after that the only
+thing pickled per task is a range of offsets, however many positions it
+covers.
+
+The function and result format are fixed for the life of the pool, since the
+workers are set up with them. Positions beyond the buffers' capacity are
+simply sent through in several rounds.
+"""
+
+import multiprocessing
+
+import chess
+from chess import batch
+
+#Set in each worker by _initialise
+_worker = {}
+
+def legal_move_count(game):
+    """
+    Returns a one-tuple of the number of legal moves in game, as an example
+    SharedPool function
+    """
+    return (sum(1 for _ in game.generate_moves()),)
+
+def _initialise(function, result, positions, results, decode):
+    _worker['state'] = (function, result, positions, results, decode)
+
+def _run(span):
+    """
+    Worker function: applies the pool's function to the positions from
+    span[0] up to span[1] of the input buffer, packing what it returns into
+    the same slots of the output buffer. Returns the number of positions
+    """
+    return _run_span(_worker['state'], span)
+
+def _run_span(state, span):
+    function, result, positions, results, decode = state
+    start, stop = span
+    for index in xrange(start, stop):
+        offset = index * batch.RECORD.size
+        if decode:
+            values = function(batch.unpack_game(positions, offset))
+        else:
+            values = function(*batch.RECORD.unpack_from(positions, offset))
+        result.pack_into(results, index * result.size, *values)
+    return stop - start
+
+class SharedPool(object):
+    """
+    A pool of workers processes (the calling process if workers is 0) that
+    applies function to positions held in shared memory. function takes a
+    Game and returns a tuple of values for result, a struct.Struct. If
+    decode is False, it's called with the fields of the packed position
+    instead (those batch.encode_game returns), which saves materialising a
+    Game when the function can work from those alone. Up to capacity
+    positions are in flight at once, in tasks of chunksize positions (by
+    default enough for about four tasks per worker)
+    """
+    def __init__(self, function, result, workers=None, capacity=4096,
+                 chunksize=None, decode=True):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.function = function
+        self.result = result
+        self.workers = workers
+        self.capacity = capacity
+        self.chunksize = chunksize or max(
+            1, capacity // (4 * max(1, workers)))
+        self._positions = multiprocessing.RawArray(
+            'c', capacity * batch.RECORD.size)
+        self._results = multiprocessing.RawArray('c', capacity * result.size)
+        self._state = (function, result, self._positions, self._results,
+                       decode)
+        if workers:
+            self._pool = multiprocessing.Pool(workers, _initialise,
+                                              self._state)
+        else:
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def close(self):
+        """
+        Waits for the workers to finish and stops them
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """
+        Stops the workers straight away
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def map(self, positions):
+        """
+        Returns the result tuple for each of positions, a PositionBatch or
+        iterable of Games, in order
+        """
+        if isinstance(positions, batch.PositionBatch):
+            count = len(positions)
+            rounds = (positions[start:start + self.capacity]
+                      for start in xrange(0, count, self.capacity))
+        else:
+            rounds = self._rounds(positions)
+        results = []
+        for round_ in rounds:
+            results.extend(self._map_round(round_))
+        return results
+
+    def _rounds(self, games):
+        """
+        Yields games in PositionBatches of up to capacity positions
+        """
+        round_ = batch.PositionBatch()
+        for game in games:
+            round_.append(game)
+            if len(round_) == self.capacity:
+                yield round_
+                round_ = batch.PositionBatch()
+        if len(round_):
+            yield round_
+
+    def _map_round(self, positions):
+        count = positions.pack_into(self._positions)
+        spans = [(start, min(start + self.chunksize, count))
+                 for start in xrange(0, count, self.chunksize)]
+        if self._pool is not None:
+            self._pool.map(_run, spans)
+        else:
+            for span in spans:
+                _run_span(self._state, span)
+        result = self.result
+        return [result.unpack_from(self._results, index * result.size)
+                for index in xrange(count)]
@@ -0,0 +1,175 @@
+# encoding: utf-8
+
+"""
+Opt-in instrumentation of the library's hot paths.
+
+Nothing is measured until enable() is called, at which point each probed
+function is replaced by a wrapper that counts calls and accumulates the time
+spent inside it. disable() puts the original functions back, so there is no
+overhead at all when instrumentation is off.
+
+    >>> from chess import stats, Game
+    >>> stats.enable()
+    >>> stats.reset()
+    >>> game = Game().move(chess.BasicMove('e2', 'e4'))
+    >>> stats.snapshot()['counters']['moves']
+    1
+    >>> stats.disable()
+"""
+
+import json
+import inspect
+import threading
+from timeit import default_timer
+
+import chess
+
+class _Probe(object):
+    """
+    Call count and cumulative time for one instrumented function
+    """
+    def __init__(self, name, category, owner, attribute):
+        self.name = name
+        self.category = category
+        self.owner = owner
+        self.attribute = attribute
+        self.original = None
+        self.calls = 0
+        self.seconds = 0.0
+
+    def _wrap(self, func):
+        """
+        Returns a counting and timing wrapper around func. Generator functions
+        are timed across their whole iteration, not just their creation
+        """
+        probe = self
+
+        if inspect.isgeneratorfunction(func):
+            def wrapper(*args, **kwargs):
+                probe.calls += 1
+                iterator = func(*args, **kwargs)
+                while True:
+                    started = default_timer()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        probe.seconds += default_timer() - started
+                        return
+                    probe.seconds += default_timer() - started
+                    yield item
+        else:
+            def wrapper(*args, **kwargs):
+                probe.calls += 1
+                started = default_timer()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    probe.seconds += default_timer() - started
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    def install(self):
+        if inspect.isclass(self.owner):
+            self.original = self.owner.__dict__[self.attribute]
+        else:
+            self.original = getattr(self.owner, self.attribute)
+        if isinstance(self.original, classmethod):
+            wrapper = classmethod(self._wrap(self.original.__func__))
+        else:
+            wrapper = self._wrap(self.original)
+        setattr(self.owner, self.attribute, wrapper)
+
+    def uninstall(self):
+        setattr(self.owner, self.attribute, self.original)
+        self.original = None
+
+    def reset(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+_PROBES = [
+    _Probe('Game.__init__', 'positions', chess.Game, '__init__'),
+    _Probe('Game._from_state', 'positions', chess.Game, '_from_state'),
+    _Probe('Game.move', 'moves', chess.Game, 'move'),
+    _Probe('_parse_board_fen', 'fen_parses', chess, '_parse_board_fen'),
+    _Probe('_Board._copy', 'board_copies', chess._Board, '_copy'),
+    _Probe('Game.valid_ends', 'move_generation', chess.Game, 'valid_ends'),
+    _Probe('Game.generate_moves', 'move_generation', chess.Game,
+           'generate_moves'),
+    _Probe('Game._is_legal_move', 'legality_checks', chess.Game,
+           '_is_legal_move'),
+    _Probe('_Board.check_status', 'attack_queries', chess._Board,
+           'check_status'),
+    _Probe('_Board._threat_squares', 'attack_queries', chess._Board,
+           '_threat_squares'),
+    _Probe('_Board._is_attacked_coords', 'attack_queries', chess._Board,
+           '_is_attacked_coords'),
+]
+
+_lock = threading.Lock()
+_enabled = False
+
+def enable():
+    """
+    Starts instrumenting the hot paths. Counts continue from where they were
+    left; call reset() for a fresh start
+    """
+    global _enabled
+    with _lock:
+        if _enabled:
+            return
+        for probe in _PROBES:
+            probe.install()
+        _enabled = True
+
+def disable():
+    """
+    Stops instrumenting, restoring the original uninstrumented functions.
+    Counts are kept until reset()
+    """
+    global _enabled
+    with _lock:
+        if not _enabled:
+            return
+        for probe in _PROBES:
+            probe.uninstall()
+        _enabled = False
+
+def is_enabled():
+    """
+    Returns True if instrumentation is currently enabled
+    """
+    return _enabled
+
+def reset():
+    """
+    Zeroes all counters and timers
+    """
+    for probe in _PROBES:
+        probe.reset()
+
+def snapshot():
+    """
+    Returns a dict with the current figures: 'probes' maps each instrumented
+    function to its 'calls' and cumulative 'seconds', and 'counters' sums calls
+    per category (positions, fen_parses, board_copies, move_generation,
+    attack_queries, ...). Timings are cumulative, so nested calls are counted
+    in both caller and callee
+    """
+    probes = {}
+    counters = {}
+    for probe in _PROBES:
+        probes[probe.name] = {'calls': probe.calls, 'seconds': probe.seconds}
+        counters[probe.category] = counters.get(probe.category, 0) + \
+            probe.calls
+    return {'enabled': _enabled, 'probes': probes, 'counters': counters}
+
+def to_json(**kwargs):
+    """
+    Returns snapshot() serialised as JSON. Keyword arguments are passed on to
+    json.dumps
+    """
+    kwargs.setdefault('sort_keys', True)
+    return json.dumps(snapshot(), **kwargs)
@@ -0,0 +1,244 @@
+# encoding: utf-8
+
+"""
+Runs an EPD test suite, such as WAC or STS, against the search:
+
+    python -m chess.suite wac.epd --movetime 1 --workers 4
+
+Each position with a bm (best move) or am (avoid move) operation is searched
+within a fixed depth, node or time budget, and counts as solved if the move
+found is one of the best moves and none of the moves to avoid. Positions are
+spread across a pool of worker processes. The report gives the number solved,
+percentiles of the time taken to settle on the solution, and the nodes per
+second achieved by each worker.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import sys
+from timeit import default_timer
+
+import chess
+from chess import epd, san, search
+
+class PositionResult(object):
+    """
+    Outcome of searching one suite position. expected and avoid are the bm and
+    am moves as given; move is the move found, in SAN. time_to_solve is the
+    time at which the search settled on a correct move for good, or None if
+    unsolved. error is set instead if the position couldn't be searched
+    """
+    def __init__(self, index, id_, fen, expected, avoid):
+        self.index = index
+        self.id = id_
+        self.fen = fen
+        self.expected = expected
+        self.avoid = avoid
+        self.move = None
+        self.solved = False
+        self.time_to_solve = None
+        self.depth = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        self.worker = None
+        self.error = None
+
+    def __repr__(self):
+        return '%s.%s(%r, %r, solved=%r)' % (self.__class__.__module__,
+                                             self.__class__.__name__,
+                                             self.index,
+                                             self.id,
+                                             self.solved)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+def _solve(task):
+    """
+    Worker function: searches one position, returning a PositionResult
+    """
+    index, record, depth, nodes, movetime = task
+    result = PositionResult(index, record.id, record.fen, record.bm, record.am)
+    result.worker = multiprocessing.current_process().name
+
+    try:
+        game = chess.Game(record.fen)
+        best = set(san.parse_san(game, move).coordinates()
+                   for move in record.bm)
+        avoid = set(san.parse_san(game, move).coordinates()
+                    for move in record.am)
+    except san.InvalidSANException as error:
+        result.error = str(error)
+        return result
+    except Exception as error:
+        #A malformed FEN can fail in the parser or in move generation, in
+        #any number of ways; either way only this position is lost
+        result.error = 'invalid position: %s: %s' % (
+            error.__class__.__name__, error)
+        return result
+
+    def correct(move):
+        coordinates = move.coordinates()
+        return (not best or coordinates in best) and coordinates not in avoid
+
+    #(seconds, correct) for each completed iteration
+    iterations = []
+    def info(iteration):
+        iterations.append((iteration.seconds, correct(iteration.best_move)))
+
+    limits = search.SearchLimits(depth=depth, nodes=nodes, movetime=movetime)
+    found = search.Searcher().search(game, limits, info)
+    result.depth = found.depth
+    result.nodes = found.nodes
+    result.seconds = found.seconds
+    if found.best_move is None:
+        result.error = 'no legal moves'
+        return result
+
+    result.move = san.to_san(game, found.best_move)
+    result.solved = correct(found.best_move)
+    if result.solved:
+        result.time_to_solve = found.seconds
+        for seconds, was_correct in reversed(iterations):
+            if not was_correct:
+                break
+            result.time_to_solve = seconds
+    return result
+
+def run_suite(records, depth=None, nodes=None, movetime=None, workers=0,
+              progress=None):
+    """
+    Searches every EPDRecord with a bm or am operation within the given
+    budget (depth in plies, nodes, movetime in seconds), using a pool of
+    workers processes, or the calling process if workers is 0. progress, if
+    given, is called with each PositionResult as it completes. Returns the
+    PositionResults in suite order
+    """
+    if depth is None and nodes is None and movetime is None:
+        raise ValueError('a depth, node or time budget is required')
+    tasks = [(index, record, depth, nodes, movetime)
+             for index, record in enumerate(records)
+             if record.bm or record.am]
+
+    if workers:
+        pool = multiprocessing.Pool(workers)
+        outcomes = pool.imap_unordered(_solve, tasks)
+    else:
+        pool = None
+        outcomes = itertools.imap(_solve, tasks)
+
+    results = []
+    try:
+        for result in outcomes:
+            if progress is not None:
+                progress(result)
+            results.append(result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    results.sort(key=lambda result: result.index)
+    return results
+
+def _percentile(values, fraction):
+    """
+    Returns the value at fraction through values, which must be sorted
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarise(results):
+    """
+    Returns the JSON-able summary of a list of PositionResults: counts,
+    time-to-solve percentiles in milliseconds, and for each worker the
+    positions searched and nodes per second
+    """
+    solved = [result for result in results if result.solved]
+    times = sorted(result.time_to_solve * 1000 for result in solved)
+
+    workers = {}
+    for result in results:
+        figures = workers.setdefault(result.worker, {
+            'positions': 0, 'nodes': 0, 'seconds': 0.0})
+        figures['positions'] += 1
+        figures['nodes'] += result.nodes
+        figures['seconds'] += result.seconds
+    for figures in workers.itervalues():
+        figures['nps'] = int(figures['nodes'] / figures['seconds']) \
+            if figures['seconds'] > 0 else 0
+
+    summary = {
+        'positions': len(results),
+        'solved': len(solved),
+        'errors': len([result for result in results if result.error]),
+        'unsolved': [result.id or result.index for result in results
+                     if not result.solved],
+        'nodes': sum(result.nodes for result in results),
+        'workers': workers,
+    }
+    if times:
+        summary['time_to_solve'] = {
+            'p50': _percentile(times, 0.5),
+            'p90': _percentile(times, 0.9),
+            'p99': _percentile(times, 0.99),
+            'max': times[-1],
+        }
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run an EPD test suite')
+    parser.add_argument('epd', help='EPD file with bm and/or am operations')
+    parser.add_argument('--depth', type=int, help='search depth in plies')
+    parser.add_argument('--nodes', type=int, help='nodes per position')
+    parser.add_argument('--movetime', type=float,
+                        help='seconds per position')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='search processes (0 to search inline)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the summary as JSON')
+    args = parser.parse_args(argv)
+    if args.depth is None and args.nodes is None and args.movetime is None:
+        parser.error('one of --depth, --nodes or --movetime is required')
+
+    with open(args.epd) as epd_file:
+        records = list(epd.EPDReader(epd_file, errors='skip'))
+
+    def progress(result):
+        if args.json:
+            return
+        if result.error:
+            outcome = 'error: %s' % result.error
+        elif result.solved:
+            outcome = 'solved in %.0fms' % (result.time_to_solve * 1000)
+        else:
+            outcome = 'FAILED, expected %s' % ' '.join(
+                result.expected or ['not ' + move for move in result.avoid])
+        print '%-12s %-8s %s' % (result.id or result.index, result.move or '-',
+                                 outcome)
+        sys.stdout.flush()
+
+    started = default_timer()
+    results = run_suite(records, args.depth, args.nodes, args.movetime,
+                        args.workers, progress)
+    summary = summarise(results)
+    summary['seconds'] = default_timer() - started
+
+    if args.json:
+        print json.dumps(summary, indent=2, sort_keys=True)
+        return 0
+
+    print 'Solved %d of %d in %.1fs (%d errors)' % (
+        summary['solved'], summary['positions'], summary['seconds'],
+        summary['errors'])
+    if 'time_to_solve' in summary:
+        print 'Time to solve: p50 %(p50).0fms p90 %(p90).0fms ' \
+            'p99 %(p99).0fms max %(max).0fms' % summary['time_to_solve']
+    for worker, figures in sorted(summary['workers'].iteritems()):
+        print '%-16s %4d positions %10d nps' % (worker, figures['positions'],
+                                                figures['nps'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# encoding: utf-8
+
+"""
+Precomputed lookup tables, built once and cached on disk
+
+    >>> import shutil, tempfile
+    >>> def build():
+    ...     return {'squares': tuple(xrange(64))}
+    >>> directory = tempfile.mkdtemp()
+    >>> cached('example', build, directory=directory)['squares'][63]
+    63
+    >>> cached('example', build, directory=directory) == build()
+    True
+    >>> len(os.listdir(directory))
+    1
+    >>> shutil.rmtree(directory)
+
+Tables such as attack rays and Zobrist keys are pure functions of the code
+that builds them, so rather than rebuild them on every import, cached() runs
+the builder once and stores its result in a cache file, which later imports
+memory-map and unmarshal. A file holds a header (magic, FORMAT_VERSION and a
+checksum of the payload) then the marshalled tables. The file name includes a
+checksum of the builder's code and the Python version, so changing either
+makes a fresh file. Builders should therefore be self-contained: helpers they
+call belong inside them, where they are part of the checksum, and any
+module constants they read are passed to cached() as its key.
+
+Files go in the directory named by the CHESS_CACHE_DIR environment variable,
+or else chess under XDG_CACHE_HOME (~/.cache by default). Setting
+CHESS_CACHE_DIR to an empty string turns caching off; so does a directory
+that can't be written, in which case the tables are simply built each time.
+"""
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = 'CHSTABLE'
+FORMAT_VERSION = 1
+
+#Magic, format version, payload length, payload CRC-32
+HEADER = struct.Struct('<8sIII')
+
+def cache_dir():
+    """
+    Returns the directory cache files are kept in, or None if caching is off
+    """
+    path = os.environ.get('CHESS_CACHE_DIR')
+    if path is not None:
+        return path or None
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'chess')
+
+def _code_checksum(builder, key=None):
+    """
+    Returns a checksum of builder's code and key, and so of the tables it
+    builds. Line numbers and file names are left out, so unrelated edits to
+    the module don't invalidate the cache
+    """
+    def parts(code):
+        yield code.co_code
+        yield repr(code.co_names)
+        for constant in code.co_consts:
+            if hasattr(constant, 'co_code'):
+                for part in parts(constant):
+                    yield part
+            else:
+                yield repr(constant)
+    checksum = zlib.crc32(repr(key))
+    for part in parts(builder.__code__):
+        checksum = zlib.crc32(part, checksum)
+    return checksum & 0xffffffff
+
+def cache_path(name, builder, key=None, directory=None):
+    """
+    Returns the path of the cache file for the tables builder makes, in
+    directory if given, or None if caching is off
+    """
+    if directory is None:
+        directory = cache_dir()
+    if directory is None:
+        return None
+    return os.path.join(directory, '%s-v%d-py%d%d-%08x.bin' % (
+        name, FORMAT_VERSION, sys.version_info[0], sys.version_info[1],
+        _code_checksum(builder, key)))
+
+def _load(path):
+    """
+    Returns the tables in the cache file at path, or None if it's missing or
+    not a valid cache file
+    """
+    try:
+        cache_file = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            mapped = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return None
+        try:
+            if len(mapped) < HEADER.size:
+                return None
+            magic, version, length, checksum = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or version != FORMAT_VERSION or \
+                    len(mapped) != HEADER.size + length:
+                return None
+            payload = buffer(mapped, HEADER.size)
+            if zlib.crc32(payload) & 0xffffffff != checksum:
+                return None
+            try:
+                return marshal.loads(payload)
+            except (EOFError, ValueError, TypeError):
+                return None
+        finally:
+            mapped.close()
+    finally:
+        cache_file.close()
+
+def _store(path, tables):
+    """
+    Writes tables to a cache file at path, if possible. The file is written
+    under another name then renamed, so readers never see part of one
+    """
+    #tempfile pulls in random, so is only imported when there's a file to
+    #write
+    import tempfile
+    directory = os.path.dirname(path)
+    payload = marshal.dumps(tables)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                                 suffix='.tmp')
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(descriptor, 'wb') as cache_file:
+            cache_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(payload),
+                                         zlib.crc32(payload) & 0xffffffff))
+            cache_file.write(payload)
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        #A partly written file is of no use to anyone
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return
+
+    #Files from older versions of the builder are no longer any use
+    prefix = os.path.basename(path).split('-v')[0] + '-v'
+    for stale in os.listdir(directory):
+        if stale.startswith(prefix) and stale != os.path.basename(path):
+            try:
+                os.remove(os.path.join(directory, stale))
+            except OSError:
+                pass
+
+def cached(name, builder, key=None, directory=None):
+    """
+    Returns the tables made by calling builder (which takes no arguments and
+    returns a marshallable value), from the cache if there is a valid cache
+    file and otherwise building and caching them. key is anything else,
+    with a stable repr, that the tables depend on. The cache is kept in
+    directory if given, otherwise in cache_dir()
+    """
+    path = cache_path(name, builder, key, directory)
+    if path is not None:
+        tables = _load(path)
+        if tables is not None:
+            return tables
+    tables = builder()
+    if path is not None:
+        _store(path, tables)
+    return tables
@@ -0,0 +1,249 @@
+# encoding: utf-8
+
+"""
+Universal Chess Interface (UCI) front end, for use with chess GUIs and match
+runners:
+
+    python -m chess.uci
+
+Searches run on a worker thread, so commands such as isready, stop and
+ponderhit are answered immediately even in the middle of a long search. The
+MultiPV option, and go's searchmoves, are served by Searcher.search_multipv.
+"""
+
+import sys
+import threading
+
+import chess
+from chess import batch, search
+
+ENGINE_NAME = 'chess'
+ENGINE_AUTHOR = 'Kristian Glass'
+
+#Moves assumed left until the next time control when no movestogo is given
+_DEFAULT_MOVES_TO_GO = 30
+
+#Most lines the MultiPV option allows
+MAX_MULTIPV = 64
+
+def format_score(result):
+    """
+    Returns the UCI score field for a SearchResult
+
+    >>> format_score(search.SearchResult(None, 35, 1, [], 0, 0.0))
+    'cp 35'
+    >>> format_score(search.SearchResult(None, search.MATE_SCORE - 3, 1, [], 0,
+    ...                                  0.0))
+    'mate 2'
+    """
+    mate_in = result.mate_in()
+    if mate_in is not None:
+        return 'mate %d' % mate_in
+    return 'cp %d' % result.score
+
+def _allotted_time(game, options):
+    """
+    Returns the number of seconds to search for, given the options of a go
+    command, or None for no time limit
+    """
+    if 'movetime' in options:
+        return options['movetime'] / 1000.0
+    remaining = options.get('wtime' if game.active == 'w' else 'btime')
+    if remaining is None:
+        return None
+    increment = options.get('winc' if game.active == 'w' else 'binc', 0)
+    moves_to_go = options.get('movestogo') or _DEFAULT_MOVES_TO_GO
+    allotted = remaining / float(moves_to_go) + increment * 0.8
+    return min(allotted, remaining * 0.5) / 1000.0
+
+class UCIEngine(object):
+    """
+    UCI protocol state machine. Feed it command lines with handle(); responses
+    are written to output
+    """
+    def __init__(self, output=None):
+        self.output = output or sys.stdout
+        self.game = chess.Game()
+        self.searcher = search.Searcher()
+        self.multipv = 1
+        self._output_lock = threading.Lock()
+        self._thread = None
+        self._limits = None
+        #Cleared while pondering or searching infinitely; bestmove is held back
+        #until it is set by stop or ponderhit
+        self._release = threading.Event()
+
+    def send(self, line):
+        with self._output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def handle(self, line):
+        """
+        Handles one command line. Returns False once the engine should quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        if command == 'uci':
+            self.send('id name %s' % ENGINE_NAME)
+            self.send('id author %s' % ENGINE_AUTHOR)
+            self.send('option name MultiPV type spin default 1 min 1 max %d' %
+                      MAX_MULTIPV)
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            self.wait()
+            self._setoption(args)
+        elif command == 'ucinewgame':
+            self.wait()
+            self.searcher.clear()
+            self.game = chess.Game()
+        elif command == 'position':
+            self.wait()
+            self._position(args)
+        elif command == 'go':
+            self.wait()
+            self._go(args)
+        elif command == 'stop':
+            if self._limits is not None:
+                self._limits.stop()
+            self._release.set()
+        elif command == 'ponderhit':
+            if self._limits is not None:
+                self._limits.ponderhit()
+            self._release.set()
+        elif command == 'quit':
+            if self._limits is not None:
+                self._limits.stop()
+            self._release.set()
+            self.wait()
+            return False
+        return True
+
+    def wait(self):
+        """
+        Blocks until any running search has finished and sent its bestmove
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _position(self, args):
+        if 'moves' in args:
+            moves = args[args.index('moves') + 1:]
+            args = args[:args.index('moves')]
+        else:
+            moves = []
+
+        try:
+            if args and args[0] == 'fen':
+                game = chess.Game(batch.check_fen(' '.join(args[1:])))
+            else:
+                game = chess.Game()
+            self.game = game.replay(moves)
+        except (ValueError, chess.InvalidSquareException,
+                chess.InvalidReplayException) as error:
+            self.send('info string invalid position: %s' % error)
+
+    def _setoption(self, args):
+        if 'name' not in args or 'value' not in args:
+            return
+        name = ' '.join(args[args.index('name') + 1:args.index('value')])
+        value = ' '.join(args[args.index('value') + 1:])
+        if name.lower() == 'multipv':
+            try:
+                self.multipv = max(1, min(int(value), MAX_MULTIPV))
+            except ValueError:
+                self.send('info string invalid MultiPV: %s' % value)
+
+    def _go(self, args):
+        options = {}
+        flags = set()
+        searchmoves = None
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite', 'ponder'):
+                flags.add(args[i])
+                i += 1
+            elif args[i] == 'searchmoves':
+                i += 1
+                searchmoves = []
+                while i < len(args) and len(args[i]) in (4, 5) and \
+                        args[i][1].isdigit():
+                    try:
+                        searchmoves.append(self.game._coerce_move(args[i]))
+                    except chess.InvalidSquareException:
+                        pass
+                    i += 1
+                #If none of the moves given could be read, search them all
+                searchmoves = searchmoves or None
+            else:
+                try:
+                    options[args[i]] = int(args[i + 1])
+                except (IndexError, ValueError):
+                    pass
+                i += 2
+
+        game = self.game
+        limits = search.SearchLimits(depth=options.get('depth'),
+                                     nodes=options.get('nodes'),
+                                     movetime=_allotted_time(game, options),
+                                     infinite=bool(flags))
+        if 'mate' in options and limits.depth is None:
+            limits.depth = 2 * options['mate'] - 1
+        if flags:
+            self._release.clear()
+        else:
+            self._release.set()
+
+        self._limits = limits
+        self._thread = threading.Thread(target=self._search,
+                                        args=(game, limits, searchmoves))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _info(self, result, line=None):
+        self.send('info depth %d%s score %s nodes %d nps %d time %d pv %s' % (
+            result.depth, ' multipv %d' % line if line is not None else '',
+            format_score(result), result.nodes, result.nps,
+            int(result.seconds * 1000),
+            ' '.join(move.coordinates() for move in result.pv)))
+
+    def _multipv_info(self, results):
+        for line, result in enumerate(results, 1):
+            self._info(result, line)
+
+    def _search(self, game, limits, searchmoves=None):
+        if self.multipv > 1 or searchmoves is not None:
+            result = self.searcher.search_multipv(
+                game, self.multipv, limits, self._multipv_info,
+                searchmoves)[0]
+        else:
+            result = self.searcher.search(game, limits, self._info)
+        #UCI forbids sending bestmove while pondering or searching infinitely
+        self._release.wait()
+        if result.best_move is None:
+            self.send('bestmove 0000')
+        elif len(result.pv) > 1:
+            self.send('bestmove %s ponder %s' % (result.best_move.coordinates(),
+                                                 result.pv[1].coordinates()))
+        else:
+            self.send('bestmove %s' % result.best_move.coordinates())
+
+def main(input_=None, output=None):
+    """
+    Runs the engine over stdin and stdout until quit or end of input
+    """
+    input_ = input_ or sys.stdin
+    engine = UCIEngine(output)
+    for line in iter(input_.readline, ''):
+        if not engine.handle(line):
+            return
+    engine.handle('quit')
+
+if __name__ == '__main__':
+    main()
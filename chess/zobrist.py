@@ -0,0 +1,138 @@
+# encoding: utf-8
+
+"""
+Zobrist hashing: a 64-bit key per position, built by XORing a fixed random
+number for each piece on each square, the side to move, each castling right
+and the en passant file
+
+    >>> zobrist_hash(chess.Game()) == zobrist_hash(chess.Game())
+    True
+    >>> zobrist_hash(chess.Game()) == zobrist_hash(
+    ...     chess.Game().replay(['g1f3', 'g8f6', 'f3g1', 'f6g8']))
+    True
+
+As with Polyglot opening books, the en passant file only counts when a pawn
+could actually capture there, so transpositions hash alike.
+
+The placement and pawn parts of the key can be kept up to date move by move
+rather than rehashed:
+
+    >>> board = chess.Game().board
+    >>> after = chess.Game().move(chess.BasicMove('e2', 'e4')).board
+    >>> update_keys(board, chess.BasicMove('e2', 'e4'), board_hash(board),
+    ...             pawn_hash(board)) == (board_hash(after), pawn_hash(after))
+    True
+"""
+
+import chess
+from chess import tables
+
+def _build_keys():
+    """
+    Returns the keys, for chess.tables to cache. The random numbers are
+    fixed, so keys are stable across runs and can be stored on disk
+    """
+    import random
+    generator = random.Random(0x5EED)
+    def key():
+        return generator.getrandbits(64)
+    pieces = {}
+    for piece in 'PNBRQKpnbrqk':
+        pieces[piece] = [[key() for _ in xrange(8)] for _ in xrange(8)]
+    black = key()
+    castling = dict((right, key()) for right in 'KQkq')
+    en_passant = [key() for _ in xrange(8)]
+    return pieces, black, castling, en_passant
+
+#PIECE_KEYS[piece][row][col] in _Board coordinates
+PIECE_KEYS, BLACK_KEY, CASTLING_KEYS, EN_PASSANT_KEYS = tables.cached(
+    'zobrist', _build_keys)
+
+def en_passant_key(game):
+    """
+    Returns the en passant part of game's key: the key for the en passant
+    file if a pawn of the side to move is next to the double-pushed pawn,
+    else 0
+    """
+    if game.en_passant is None:
+        return 0
+    row, col = game.en_passant.to_board_coordinates()
+    if game.active == 'w':
+        pawn, pawn_row = 'P', row + 1
+    else:
+        pawn, pawn_row = 'p', row - 1
+    squares = game.board.squares[pawn_row]
+    if (col > 0 and squares[col - 1] == pawn) or \
+            (col < 7 and squares[col + 1] == pawn):
+        return EN_PASSANT_KEYS[col]
+    return 0
+
+def board_hash(board):
+    """
+    Returns the part of the key describing piece placement only
+    """
+    key = 0
+    for row, pieces in enumerate(board.squares):
+        for col, piece in enumerate(pieces):
+            if piece is not None:
+                key ^= PIECE_KEYS[piece][row][col]
+    return key
+
+def pawn_hash(board):
+    """
+    Returns the part of the key describing pawn placement only
+    """
+    key = 0
+    for row, pieces in enumerate(board.squares):
+        for col, piece in enumerate(pieces):
+            if piece == 'P' or piece == 'p':
+                key ^= PIECE_KEYS[piece][row][col]
+    return key
+
+def update_keys(board, move, board_key, pawn_key):
+    """
+    Returns (board key, pawn key) after move, given the keys of board before
+    it. The move, which must be legal, isn't applied
+    """
+    start_row, start_col = move.start.to_board_coordinates()
+    end_row, end_col = move.end.to_board_coordinates()
+    squares = board.squares
+    piece = squares[start_row][start_col]
+    captured = squares[end_row][end_col]
+
+    board_key ^= PIECE_KEYS[piece][start_row][start_col]
+    placed = piece if move.promotion is None else move.promotion
+    board_key ^= PIECE_KEYS[placed][end_row][end_col]
+    if captured is not None:
+        board_key ^= PIECE_KEYS[captured][end_row][end_col]
+        if captured == 'P' or captured == 'p':
+            pawn_key ^= PIECE_KEYS[captured][end_row][end_col]
+
+    if piece == 'P' or piece == 'p':
+        pawn_key ^= PIECE_KEYS[piece][start_row][start_col]
+        if move.promotion is None:
+            pawn_key ^= PIECE_KEYS[piece][end_row][end_col]
+        if captured is None and start_col != end_col:
+            #En passant: the captured pawn is beside the start square
+            taken = squares[start_row][end_col]
+            board_key ^= PIECE_KEYS[taken][start_row][end_col]
+            pawn_key ^= PIECE_KEYS[taken][start_row][end_col]
+    elif (piece == 'K' or piece == 'k') and abs(end_col - start_col) == 2:
+        rook = 'R' if piece == 'K' else 'r'
+        rook_start, rook_end = (7, 5) if end_col == 6 else (0, 3)
+        board_key ^= PIECE_KEYS[rook][start_row][rook_start] ^ \
+            PIECE_KEYS[rook][start_row][rook_end]
+    return board_key, pawn_key
+
+def zobrist_hash(game):
+    """
+    Returns the 64-bit key of game's position. Clocks aren't included
+    """
+    key = board_hash(game.board) ^ en_passant_key(game)
+    if game.active == 'b':
+        key ^= BLACK_KEY
+    castling = game.castling.fen()
+    if castling != '-':
+        for right in castling:
+            key ^= CASTLING_KEYS[right]
+    return key
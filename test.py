@@ -1,10 +1,71 @@
 import doctest
 import unittest
+import json
+import os
+import shutil
+import tempfile
+import socket
+import subprocess
+import sys
+import threading
+import StringIO
+import struct
+import time
+import random
+import atexit
+
+#Tables built while testing are cached in a throwaway directory, not the
+#user's own cache
+_CACHE_DIR = tempfile.mkdtemp()
+os.environ['CHESS_CACHE_DIR'] = _CACHE_DIR
+atexit.register(shutil.rmtree, _CACHE_DIR, True)
+
 import chess
-from chess import Game, BoardSquare, InvalidSquareException, BasicMove, NoPieceAtSquareException, MoveMissingPromotionException, InvalidPromotionDataException
+import chess.stats
+import chess.search
+import chess.uci
+import chess.server
+import chess.batch
+import chess.epd
+import chess.san
+import chess.suite
+import chess.pgn
+import chess.match
+import chess.zobrist
+import chess.explorer
+import chess.mate
+import chess.pawns
+import chess.attacks
+import chess.distributed
+import chess.tables
+import chess.fuzz
+import chess.ponder
+import chess.shared
+import chess.scheduler
+import benchmarks.run
+from chess import Game, BoardSquare, InvalidSquareException, BasicMove, NoPieceAtSquareException, MoveMissingPromotionException, InvalidPromotionDataException, InvalidReplayException, InvalidMoveException
 
 def load_tests(loader, tests, pattern):
     tests.addTests(doctest.DocTestSuite(chess))
+    tests.addTests(doctest.DocTestSuite(chess.stats))
+    tests.addTests(doctest.DocTestSuite(chess.search))
+    tests.addTests(doctest.DocTestSuite(chess.uci))
+    tests.addTests(doctest.DocTestSuite(chess.batch))
+    tests.addTests(doctest.DocTestSuite(chess.epd))
+    tests.addTests(doctest.DocTestSuite(chess.san))
+    tests.addTests(doctest.DocTestSuite(chess.pgn))
+    tests.addTests(doctest.DocTestSuite(chess.match))
+    tests.addTests(doctest.DocTestSuite(chess.zobrist))
+    tests.addTests(doctest.DocTestSuite(chess.explorer))
+    tests.addTests(doctest.DocTestSuite(chess.mate))
+    tests.addTests(doctest.DocTestSuite(chess.attacks))
+    tests.addTests(doctest.DocTestSuite(chess.distributed))
+    tests.addTests(doctest.DocTestSuite(chess.pawns))
+    tests.addTests(doctest.DocTestSuite(chess.tables))
+    tests.addTests(doctest.DocTestSuite(chess.fuzz))
+    tests.addTests(doctest.DocTestSuite(chess.ponder))
+    tests.addTests(doctest.DocTestSuite(chess.shared))
+    tests.addTests(doctest.DocTestSuite(chess.scheduler))
     tests.addTests(doctest.DocFileSuite('README.rst'))
     return tests
 
@@ -33,6 +94,37 @@ class TestChess(unittest.TestCase):
         test(self.SIMPLE_ROOK_FEN)
         #TODO More fens
 
+    def test_lazy_constructor(self):
+        for fen in (self.STARTING_FEN, self.CHECK_FEN,
+                    'rnbqkbnr/pppppppp/8/8/P7/8/1PPPPPPP/RNBQKBNR b KQkq a3 0 1'):
+            game = Game(fen, lazy=True)
+            self.assertNotIn('board', game.__dict__)
+            self.assertEqual(game.fen(), fen)
+            self.assertEqual(game.active, fen.split(' ')[1])
+            self.assertNotIn('board', game.__dict__)
+
+            #The board is parsed on first use
+            self.assertEqual(game.board.fen(), fen.split(' ')[0])
+            self.assertEqual(game.fen(), fen)
+            self.assertEqual(game.legal_moves(), Game(fen).legal_moves())
+
+        #Non-canonical boards are normalised as before
+        game = Game('44/8/8/8/8/8/8/K6k w - - 0 1', lazy=True)
+        self.assertEqual(game.fen(), '8/8/8/8/8/8/8/K6k w - - 0 1')
+
+        game = Game('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                    lazy=True).move(BasicMove('e2', 'e4'))
+        self.assertEqual(game.fen(), 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/'
+                         'RNBQKBNR b KQkq e3 0 1')
+
+    def test_fen_cache(self):
+        game = Game(self.STARTING_FEN)
+        self.assertIs(game.board.fen(), game.board.fen())
+
+        game.board.apply_move(BasicMove('e2', 'e4'), None)
+        self.assertEqual(game.board.fen(),
+                         'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR')
+
     def test_squares(self):
         BoardSquare('e5')
         BoardSquare('a1')
@@ -254,5 +346,1648 @@ class TestChess(unittest.TestCase):
         self.assertSetEqual(game.valid_ends('d7'), self._squarify(['b5', 'c6']))
 
 
+    def test_replay(self):
+        moves = [BasicMove('e2', 'e4'), 'c7c5', 'g1f3', BasicMove('a7', 'a5')]
+        game = Game()
+
+        expected = game
+        for move in moves:
+            if not isinstance(move, BasicMove):
+                move = BasicMove.from_coordinates(move)
+            expected = expected.move(move)
+
+        self.assertEqual(game.replay(moves).fen(), expected.fen())
+        self.assertEqual(game.fen(), self.STARTING_FEN)
+        self.assertEqual([g.fen() for g in game.iter_replay(moves)][-1],
+                         expected.fen())
+
+    def test_replay_promotion(self):
+        game = Game('4k3/P7/8/8/8/8/8/4K3 w - - 0 1').replay(['a7a8q'])
+        self.assertEqual(game.fen(), 'Q3k3/8/8/8/8/8/8/4K3 b - - 0 1')
+
+    def test_replay_invalid(self):
+        try:
+            Game().replay(['e2e4', 'e7e5', 'e1e3'])
+            self.fail('Should not accept an invalid king move')
+        except InvalidReplayException as e:
+            self.assertEqual(e.ply, 2)
+            self.assertIsInstance(e.error, InvalidMoveException)
+
+        #Pinned piece can't move
+        try:
+            Game('4k3/4r3/8/8/8/8/4B3/4K3 w - - 0 1').replay(['e2d3'])
+            self.fail('Should not accept moving a pinned piece')
+        except InvalidReplayException as e:
+            self.assertEqual(e.ply, 0)
+
+        try:
+            Game().replay(['e2e4', 'e4e5'])
+            self.fail('Should not accept moving out of turn')
+        except InvalidReplayException as e:
+            self.assertEqual(e.ply, 1)
+
+        try:
+            Game().replay(['e2e4', 'e7ex'])
+            self.fail('Should not accept a malformed move')
+        except InvalidReplayException as e:
+            self.assertEqual(e.ply, 1)
+            self.assertIsInstance(e.error, InvalidSquareException)
+
+    def test_is_legal(self):
+        game = Game()
+        self.assertTrue(game.is_legal(BasicMove('g1', 'f3')))
+        self.assertTrue(game.is_legal('e2e4'))
+        self.assertFalse(game.is_legal('e2e5'))
+        self.assertFalse(game.is_legal('e7e5'))
+        self.assertFalse(game.is_legal('f1c4'))
+        self.assertFalse(game.is_legal('c3c4'))
+        self.assertFalse(game.is_legal('nonsense'))
+        for malformed in ('abcd', 'e2eX', 'eXe4', 'e2e', 'e2e4qq', 'i2i4',
+                          'e2e9q'):
+            self.assertFalse(game.is_legal(malformed))
+
+        #Pinned bishop
+        game = Game('4k3/4r3/8/8/8/8/4B3/4K3 w - - 0 1')
+        self.assertFalse(game.is_legal('e2d3'))
+        self.assertTrue(game.is_legal('e1d1'))
+
+        #Must leave check
+        game = Game(self.CHECK_FEN)
+        self.assertFalse(game.is_legal('a8a7'))
+        self.assertTrue(game.is_legal('d8d7'))
+
+    def test_is_legal_special_moves(self):
+        game = Game('r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1')
+        self.assertTrue(game.is_legal('e1g1'))
+        self.assertTrue(game.is_legal('e1c1'))
+        self.assertFalse(Game('3rkr2/8/8/8/8/8/8/R3K2R w KQ - 0 1').is_legal(
+            'e1g1'))
+        self.assertFalse(Game('4k3/8/8/8/8/8/8/R3K3 w KQ - 0 1').is_legal(
+            'e1g1'))
+
+        game = Game('4k3/8/8/8/pP6/8/8/4K3 b - b3 0 1')
+        self.assertTrue(game.is_legal('a4b3'))
+
+        game = Game('4k3/P7/8/8/8/8/8/4K3 w - - 0 1')
+        self.assertFalse(game.is_legal('a7a8'))
+        self.assertTrue(game.is_legal('a7a8q'))
+        self.assertTrue(game.is_legal(BasicMove('a7', 'a8', 'N')))
+        self.assertFalse(game.is_legal(BasicMove('a7', 'a8', 'n')))
+
+    def test_is_legal_agrees_with_valid_ends(self):
+        for fen in (self.STARTING_FEN, self.CHECK_FEN,
+                    'r6r/k7/8/8/8/8/8/R3K2R b KQ - 1 1',
+                    '4rk2/8/8/8/8/8/8/R3K2R w KQ - 0 1'):
+            game = Game(fen)
+            for start_file in 'abcdefgh':
+                for start_rank in xrange(1, 9):
+                    start = BoardSquare(start_file, start_rank)
+                    piece = game.board.piece_at_board_square(start)
+                    if piece is None or chess._colour_of_piece(piece) != \
+                            game.active:
+                        continue
+                    valid_ends = game.valid_ends(start)
+                    for end_file in 'abcdefgh':
+                        for end_rank in xrange(1, 9):
+                            end = BoardSquare(end_file, end_rank)
+                            self.assertEqual(
+                                game._is_legal_move(BasicMove(start, end),
+                                                    piece),
+                                end in valid_ends, '%s %s%s' % (fen, start,
+                                                                end))
+
+
+    def test_generate_moves(self):
+        game = Game()
+        moves = list(game.generate_moves())
+        self.assertEqual(len(moves), 20)
+        self.assertEqual(list(game.pseudo_legal_captures()), [])
+
+        #Captures and promotions come before quiet moves
+        game = Game('r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1')
+        moves = [str(move) for move in game.generate_moves()]
+        self.assertEqual(moves[:8], ['(b7 -> a8) -> Q', '(b7 -> a8) -> R',
+                                     '(b7 -> b8) -> Q', '(b7 -> a8) -> N',
+                                     '(b7 -> a8) -> B', '(b7 -> b8) -> R',
+                                     '(b7 -> b8) -> N', '(b7 -> b8) -> B'])
+        self.assertEqual(len(moves), 13)
+        self.assertEqual(len(list(game.generate_moves(quiets=False))), 8)
+
+    def test_generate_moves_hash_move(self):
+        game = Game()
+        hash_move = BasicMove('b1', 'c3')
+        moves = list(game.generate_moves(hash_move=hash_move))
+        self.assertEqual(moves[0], hash_move)
+        self.assertEqual(len(moves), 20)
+
+        #Illegal hash moves are ignored
+        moves = list(game.generate_moves(hash_move=BasicMove('e1', 'e2')))
+        self.assertEqual(len(moves), 20)
+
+    def test_generate_moves_agrees_with_valid_ends(self):
+        for fen in (self.STARTING_FEN, self.CHECK_FEN,
+                    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+                    'w KQkq - 0 1',
+                    'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq '
+                    'f6 0 3'):
+            game = Game(fen)
+            expected = set()
+            for file_ in 'abcdefgh':
+                for rank_ in xrange(1, 9):
+                    start = BoardSquare(file_, rank_)
+                    piece = game.board.piece_at_board_square(start)
+                    if piece is None or chess._colour_of_piece(piece) != \
+                            game.active:
+                        continue
+                    for end in game.valid_ends(start):
+                        expected.add((str(start), str(end)))
+            generated = set((str(move.start), str(move.end))
+                            for move in game.generate_moves())
+            self.assertSetEqual(generated, expected, fen)
+
+    def test_perft(self):
+        def perft(game, depth):
+            if depth == 0:
+                return 1
+            nodes = 0
+            for move in game.generate_moves():
+                nodes += perft(game.move(move), depth - 1)
+            return nodes
+
+        self.assertEqual(perft(Game(), 2), 400)
+        self.assertEqual(perft(Game(
+            'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+            'w KQkq - 0 1'), 2), 2039)
+
+
+
+class TestStats(unittest.TestCase):
+
+    def tearDown(self):
+        chess.stats.disable()
+        chess.stats.reset()
+
+    def test_disabled_by_default(self):
+        self.assertFalse(chess.stats.is_enabled())
+        original = Game.__dict__['move']
+        Game().move(BasicMove('e2', 'e4'))
+        self.assertEqual(chess.stats.snapshot()['counters']['moves'], 0)
+
+        chess.stats.enable()
+        self.assertIsNot(Game.__dict__['move'], original)
+        chess.stats.disable()
+        self.assertIs(Game.__dict__['move'], original)
+
+    def test_counters(self):
+        chess.stats.enable()
+        chess.stats.reset()
+
+        game = Game(TestChess.STARTING_FEN)
+        game = game.move(BasicMove('e2', 'e4'))
+        game.valid_ends('e7')
+        self.assertFalse(game.is_stalemate())
+
+        counters = chess.stats.snapshot()['counters']
+        self.assertEqual(counters['moves'], 1)
+        self.assertEqual(counters['fen_parses'], 1)
+        self.assertEqual(counters['positions'], 2)
+        self.assertEqual(counters['board_copies'], 3)
+        self.assertEqual(counters['move_generation'], 2)
+        self.assertTrue(counters['attack_queries'] > 0)
+
+        probes = json.loads(chess.stats.to_json())['probes']
+        self.assertEqual(probes['Game.move']['calls'], 1)
+        self.assertEqual(probes['_Board._copy']['calls'],
+                         counters['board_copies'])
+        self.assertTrue(probes['Game.move']['seconds'] > 0)
+
+        chess.stats.reset()
+        self.assertEqual(chess.stats.snapshot()['counters']['moves'], 0)
+
+    def test_hot_paths(self):
+        chess.stats.enable()
+        chess.stats.reset()
+        game = Game().move(BasicMove('e2', 'e4'))
+        self.assertEqual(chess.stats.snapshot()['counters']['board_copies'],
+                         1)
+
+        chess.stats.reset()
+        game.replay(['e7e5', 'g1f3'])
+        chess.search.make_move(game, BasicMove('e7', 'e5'))
+        self.assertEqual(chess.stats.snapshot()['counters']['board_copies'],
+                         2)
+
+        chess.stats.reset()
+        moves = list(game.generate_moves())
+        counters = chess.stats.snapshot()['counters']
+        self.assertGreaterEqual(counters['legality_checks'], len(moves))
+
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_operations(self):
+        for name, calls in benchmarks.run.operations():
+            self.assertTrue(calls, name)
+            for call in calls:
+                call()
+
+    def test_compare(self):
+        def results(ops_per_sec, bytes_per_op):
+            return {'results': {'move': {'ops_per_sec': ops_per_sec,
+                                         'bytes_per_op': bytes_per_op}}}
+
+        baseline = results(1000.0, 100.0)
+        regressed = lambda rows: [row[:2] for row in rows if row[4]]
+
+        self.assertEqual(regressed(benchmarks.run.compare(
+            results(950.0, 105.0), baseline)), [])
+        self.assertEqual(regressed(benchmarks.run.compare(
+            results(850.0, 100.0), baseline)), [('move', 'ops_per_sec')])
+        self.assertEqual(regressed(benchmarks.run.compare(
+            results(850.0, 100.0), baseline, overrides={'move': 0.2})), [])
+        self.assertEqual(regressed(benchmarks.run.compare(
+            results(1000.0, 150.0), baseline)), [('move', 'bytes_per_op')])
+
+        current = results(1000.0, 100.0)
+        current['imports'] = {'chess': 4.0}
+        self.assertEqual(regressed(benchmarks.run.compare(current, baseline)),
+                         [])
+        baseline['imports'] = {'chess': 2.0}
+        self.assertEqual(regressed(benchmarks.run.compare(current, baseline)),
+                         [('import chess', 'import_ms')])
+        self.assertEqual(regressed(benchmarks.run.compare(
+            current, baseline, import_tolerance=1.0)), [])
+
+
+
+class TestSearch(unittest.TestCase):
+
+    def test_mate_in_two(self):
+        game = Game('r5k1/5ppp/8/8/8/8/4R3/4R1K1 w - - 0 1')
+        result = chess.search.Searcher().search(
+            game, chess.search.SearchLimits(depth=3))
+        self.assertEqual(result.mate_in(), 2)
+        self.assertEqual(result.best_move.end.rank_, 8)
+        self.assertEqual(len(result.pv), 3)
+
+    def test_wins_material(self):
+        game = Game('4k3/8/8/3q4/8/8/8/3RK3 w - - 0 1')
+        result = chess.search.Searcher().search(
+            game, chess.search.SearchLimits(depth=2))
+        self.assertEqual(result.best_move, BasicMove('d1', 'd5'))
+        self.assertTrue(result.score > 0)
+
+    def test_no_moves(self):
+        result = chess.search.Searcher().search(
+            Game('rr2k3/8/8/8/8/8/8/K7 w - - 0 1'))
+        self.assertIsNone(result.best_move)
+        self.assertEqual(result.mate_in(), 0)
+
+    def test_limits(self):
+        searcher = chess.search.Searcher()
+        result = searcher.search(Game(), chess.search.SearchLimits(nodes=500))
+        self.assertTrue(result.nodes <= 500)
+        self.assertIsNotNone(result.best_move)
+
+        limits = chess.search.SearchLimits()
+        limits.stop()
+        result = searcher.search(Game(), limits)
+        self.assertEqual(result.depth, 0)
+        self.assertIsNotNone(result.best_move)
+
+    def test_selectivity(self):
+        game = Game('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+                    'w KQkq - 0 1')
+        limits = chess.search.SearchLimits(depth=3)
+        pruned = chess.search.Searcher().search(game, limits)
+        full = chess.search.Searcher(null_move=False, lmr=False,
+                                     futility=False,
+                                     razoring=False).search(game, limits)
+        self.assertTrue(pruned.nodes < full.nodes)
+        self.assertEqual(sorted(pruned.stats), sorted(chess.search.STATS))
+        self.assertTrue(pruned.stats['futility_prunes'] > 0)
+        self.assertFalse(any(full.stats.values()))
+
+        #Still finds mates with everything on
+        result = chess.search.Searcher().search(
+            Game('r5k1/5ppp/8/8/8/8/4R3/4R1K1 w - - 0 1'),
+            chess.search.SearchLimits(depth=5))
+        self.assertEqual(result.mate_in(), 2)
+
+    def test_caches(self):
+        searcher = chess.search.Searcher()
+        result = searcher.search(Game('r1bqkb1r/pppp1ppp/2n2n2/4p3/4P3/2N2N2/'
+                                      'PPPP1PPP/R1BQKB1R w KQkq - 4 4'),
+                                 chess.search.SearchLimits(depth=3))
+        self.assertIsNotNone(result.best_move)
+        self.assertTrue(searcher.pawn_table.hit_rate > 0.5)
+        self.assertTrue(0 < searcher.eval_cache.hit_rate < 1)
+        self.assertTrue(len(searcher.pawn_table) <
+                        len(searcher.eval_cache))
+
+        cache = chess.search.EvalCache(max_entries=2)
+        for key in xrange(3):
+            cache.store(key, key)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(2), 2)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_null_move(self):
+        game = chess.search.make_null_move(
+            Game('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1'))
+        self.assertEqual(game.fen(), '4k3/8/8/3pP3/8/8/8/4K3 b - - 1 1')
+        self.assertFalse(chess.search.has_pieces(game, 'w'))
+        self.assertTrue(chess.search.has_pieces(Game(), 'b'))
+
+    def test_multipv(self):
+        def plain():
+            return chess.search.Searcher(null_move=False, lmr=False,
+                                         futility=False, razoring=False)
+
+        game = Game('r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R '
+                    'w KQ - 0 8')
+        results = plain().search_multipv(
+            game, 4, chess.search.SearchLimits(depth=2))
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(result.best_move.coordinates()
+                                 for result in results)), 4)
+        scores = [result.score for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(scores[0], plain().search(
+            game, chess.search.SearchLimits(depth=2)).score)
+        for result in results:
+            self.assertEqual(result.depth, 2)
+            self.assertEqual(result.pv[0], result.best_move)
+            game.replay(result.pv)
+            #Exact, not just a bound
+            self.assertEqual(result.score, -plain().search(
+                game.move(result.best_move),
+                chess.search.SearchLimits(depth=1)).score)
+
+        game = Game('k7/8/1K6/8/8/8/8/7R w - - 0 1')
+        results = chess.search.Searcher().search_multipv(
+            game, 5, chess.search.SearchLimits(depth=3),
+            moves=[BasicMove('h1', 'h7'), BasicMove('h1', 'g1')])
+        self.assertEqual([result.best_move.coordinates()
+                          for result in results], ['h1h7', 'h1g1'])
+        self.assertEqual(results[0].mate_in(), 2)
+
+        results = chess.search.Searcher().search_multipv(
+            Game('rr2k3/8/8/8/8/8/8/K7 w - - 0 1'), 3)
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(results[0].best_move)
+        self.assertEqual(results[0].score, -chess.search.MATE_SCORE)
+
+
+class TestPawns(unittest.TestCase):
+
+    def structure(self, fen):
+        return chess.pawns.analyse(Game(fen).board)
+
+    def test_terms(self):
+        structure = self.structure('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
+        self.assertEqual(structure.score, 0)
+
+        #Doubled, isolated c pawns; d5 is passed
+        structure = self.structure('4k3/1p6/8/3P4/8/2P5/2P5/4K3 w - - 0 1')
+        self.assertEqual(structure.doubled, {'w': 1, 'b': 0})
+        self.assertEqual(structure.passed, {'w': 1, 'b': 0})
+        self.assertEqual(structure.isolated, {'w': 0, 'b': 1})
+
+        #d6 can't advance safely, and c5 is past supporting it: backward
+        structure = self.structure('4k3/2p1p3/3p4/8/8/8/8/4K3 w - - 0 1')
+        self.assertEqual(structure.backward, {'w': 0, 'b': 0})
+        structure = self.structure('4k3/8/3p4/2p5/4P3/8/8/4K3 b - - 0 1')
+        self.assertEqual(structure.backward, {'w': 0, 'b': 1})
+
+    def test_mirrored(self):
+        white = self.structure('4k3/8/8/8/3P4/8/PP3PPP/4K3 w - - 0 1')
+        black = self.structure('4k3/pp3ppp/8/3p4/8/8/8/4K3 w - - 0 1')
+        self.assertEqual(white.score, -black.score)
+        self.assertEqual(white.passed['w'], black.passed['b'])
+
+    def test_shelter(self):
+        board = Game('6k1/5p1p/6p1/8/8/8/5PPP/6K1 w - - 0 1').board
+        self.assertEqual(chess.pawns.king_shelter(board, 'w', 7, 6), 30)
+        self.assertEqual(chess.pawns.king_shelter(board, 'b', 0, 6), -25)
+        self.assertEqual(chess.pawns.king_shelter(board, 'w', 3, 6), 0)
+
+    def test_incremental_keys(self):
+        game = Game('r3k2r/p1ppqpb1/bn2pnp1/3PN3/Pp2P3/2N2Q1p/1PPBBPPP/R3K2R '
+                    'b KQkq a3 0 1')
+        board = game.board
+        keys = (chess.zobrist.board_hash(board),
+                chess.zobrist.pawn_hash(board))
+        for move in game.legal_moves():
+            after = game.move(move).board
+            self.assertEqual(chess.zobrist.update_keys(board, move, *keys),
+                             (chess.zobrist.board_hash(after),
+                              chess.zobrist.pawn_hash(after)))
+
+
+class TestAttackMap(unittest.TestCase):
+
+    LINES = [
+        (None, ['e2e4', 'd7d5', 'e4d5', 'd8d5', 'b1c3', 'd5e5', 'g1e2',
+                'e5e4']),
+        #Castling both ways, en passant and promotion
+        ('r3k2r/6Pp/8/3pP3/8/8/7P/R3K2R w KQkq d6 0 1',
+         ['e5d6', 'e8c8', 'e1g1', 'h7h5', 'g7h8q', 'd8h8']),
+    ]
+
+    def assertFresh(self, board):
+        fresh = chess.attacks.AttackMap(board.squares)
+        attack_map = board.attack_map
+        self.assertEqual(map(sorted, attack_map.targets),
+                         map(sorted, fresh.targets))
+        self.assertEqual(attack_map.attackers, fresh.attackers)
+        self.assertEqual(attack_map.kings, fresh.kings)
+
+    def test_incremental(self):
+        for fen, moves in self.LINES:
+            game = Game(fen)
+            game.board.enable_attack_map()
+            for position in game.iter_replay(moves):
+                self.assertFresh(position.board)
+                plain = Game(position.fen())
+                self.assertEqual(position.board.check_status(),
+                                 plain.board.check_status())
+                self.assertEqual(
+                    sorted(move.coordinates()
+                           for move in position.generate_moves()),
+                    sorted(move.coordinates()
+                           for move in plain.generate_moves()))
+
+    def test_queries(self):
+        game = Game('4k3/8/8/8/8/8/3r4/R3K3 w Q - 0 1')
+        game.board.enable_attack_map()
+        attack_map = game.board.attack_map
+        self.assertTrue(game.board.is_attacked('d1', 'b'))
+        self.assertFalse(game.board.is_attacked('c1', 'b'))
+        self.assertEqual(attack_map.attacker_count(7, 3, 'w'), 2)
+        self.assertEqual(attack_map.king_zone_attacks('w'), 3)
+        self.assertFalse(game.is_legal('e1c1'))
+        self.assertFalse(game.is_legal('e1d1'))
+        self.assertTrue(game.is_legal('e1f1'))
+
+        #Moving the rook off the file discovers check
+        game = game.move(BasicMove('e1', 'f1')).move(BasicMove('d2', 'a2'))
+        self.assertFalse(game.board.in_check('w'))
+        game = Game('4k3/4r3/8/8/8/8/4R3/4K3 w - - 0 1')
+        game.board.enable_attack_map()
+        self.assertFalse(game.is_legal('e2d2'))
+        self.assertTrue(game.is_legal('e2e5'))
+        self.assertEqual(game.move(BasicMove('e2', 'e7')).board.check_status(),
+                         set(['b']))
+
+    def test_copies(self):
+        game = Game()
+        game.board.enable_attack_map()
+        child = game.move(BasicMove('e2', 'e4'))
+        self.assertIsNot(child.board.attack_map, game.board.attack_map)
+        self.assertFresh(game.board)
+        self.assertFresh(child.board)
+        self.assertIsNone(Game().board.attack_map)
+
+
+class TestTables(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self):
+        self.builds += 1
+        return {'rays': [[(0, 1, 1), (0, 2, 2)]], 'keys': [1 << 63, 5]}
+
+    def cached(self):
+        return chess.tables.cached('test', self.build,
+                                   directory=self.directory)
+
+    def test_round_trip(self):
+        self.assertEqual(self.cached(), self.build())
+        self.assertEqual(self.cached(), self.build())
+        self.assertEqual(self.builds, 3)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_invalid_files_rebuilt(self):
+        self.cached()
+        path = chess.tables.cache_path('test', self.build,
+                                       directory=self.directory)
+        with open(path, 'rb') as cache_file:
+            contents = cache_file.read()
+        for damaged in (contents[:-1] + 'x', contents[:10], '',
+                        contents.replace(chess.tables.MAGIC, 'NOTTABLE')):
+            with open(path, 'wb') as cache_file:
+                cache_file.write(damaged)
+            builds = self.builds
+            self.assertEqual(self.cached(), {'rays': [[(0, 1, 1), (0, 2, 2)]],
+                                             'keys': [1 << 63, 5]})
+            self.assertEqual(self.builds, builds + 1)
+        with open(path, 'rb') as cache_file:
+            self.assertEqual(cache_file.read(), contents)
+
+    def test_key(self):
+        paths = set(chess.tables.cache_path('test', self.build, key,
+                                            self.directory)
+                    for key in (None, {'P': 100}, {'P': 90}))
+        self.assertEqual(len(paths), 3)
+        chess.tables.cached('test', self.build, 1, self.directory)
+        chess.tables.cached('test', self.build, 2, self.directory)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_failed_write(self):
+        #A directory in the way of the cache file makes the rename fail
+        path = chess.tables.cache_path('test', self.build,
+                                       directory=self.directory)
+        os.mkdir(path)
+        self.assertEqual(self.cached(), self.build())
+        self.assertEqual(os.listdir(self.directory),
+                         [os.path.basename(path)])
+
+    def test_disabled(self):
+        environ = os.environ.copy()
+        os.environ['CHESS_CACHE_DIR'] = ''
+        try:
+            self.assertIsNone(chess.tables.cache_dir())
+            chess.tables.cached('test', self.build)
+            chess.tables.cached('test', self.build)
+            self.assertEqual(self.builds, 2)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_lazy_imports(self):
+        script = ('import sys, chess, chess.search; '
+                  'print sorted(set(["chess.attacks", "threading"]) & '
+                  'set(sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=os.path.dirname(
+                                             os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), '[]')
+
+
+class _NoEnPassant(chess.fuzz.Backend):
+    name = 'no en passant'
+
+    def legal_moves(self, game):
+        moves = chess.fuzz.Backend.legal_moves(self, game)
+        if game.en_passant is None:
+            return moves
+        return set(move for move in moves if move[2:4] != str(game.en_passant)
+                   or game.board.piece_at_board_square(move[:2]) not in 'Pp')
+
+
+class TestFuzz(unittest.TestCase):
+
+    def test_backends_agree(self):
+        report = chess.fuzz.fuzz(games=2, positions=3, plies=6,
+                                 perft_depth=1, seed=5)
+        self.assertEqual(report.failures, [])
+        self.assertEqual([report.perft[fen] for fen in chess.fuzz.SEEDS],
+                         [20, 48, 14, 6, 44])
+        self.assertEqual(report.positions, 5 + 2 * 7 + 3)
+        self.assertTrue(all(ratio > 1
+                            for ratio in report.ratios().values()))
+
+    def test_random_positions(self):
+        rng = random.Random(1)
+        fens = [chess.fuzz.random_position(rng) for _ in xrange(50)]
+        self.assertTrue(all(chess.fuzz._is_valid(fen) for fen in fens))
+        self.assertTrue(any(fen.split(' ')[2] != '-' for fen in fens))
+        self.assertTrue(any(fen.split(' ')[3] != '-' for fen in fens))
+
+    def test_shrink(self):
+        fen = 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/Pp2P3/2N2Q1p/1PPBBPPP/R3K2R b ' \
+            'KQkq a3 0 1'
+        self.assertEqual(chess.fuzz.check_position(fen, [_NoEnPassant()]),
+                         ['no en passant legal moves: missing b4a3, extra -'])
+        self.assertEqual(chess.fuzz.shrink(fen, [_NoEnPassant()]),
+                         '4k3/8/8/8/Pp6/8/8/4K3 b - a3 0 1')
+
+    def test_failure(self):
+        report = chess.fuzz.fuzz(games=0, positions=5, seed=1,
+                                 backends=[_NoEnPassant()], max_failures=1)
+        failure, = report.failures
+        self.assertEqual(failure.moves, [])
+        self.assertEqual(len(failure.minimal.split(' ')[0].translate(
+            None, '/12345678')), 4)
+        self.assertNotEqual(failure.minimal.split(' ')[3], '-')
+
+
+class TestDistributed(unittest.TestCase):
+
+    def setUp(self):
+        self.coordinator = chess.distributed.Coordinator(heartbeat_timeout=0.5)
+        self.coordinator.start()
+        self.threads = []
+
+    def tearDown(self):
+        self.coordinator.close()
+        for thread in self.threads:
+            thread.join()
+
+    def start_worker(self):
+        worker = chess.distributed.Worker(self.coordinator.address,
+                                          heartbeat_interval=0.1)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        self.threads.append(thread)
+        return worker
+
+    def fake_worker(self):
+        """
+        Connects and takes a unit, but never answers
+        """
+        sock = socket.create_connection(self.coordinator.address)
+        sock.sendall('{"op": "hello", "name": "fake"}\n')
+        rfile = sock.makefile('rb')
+        self.assertEqual(json.loads(rfile.readline())['op'], 'work')
+        return sock, rfile
+
+    def test_perft(self):
+        workers = [self.start_worker() for _ in xrange(3)]
+        total, divide = self.coordinator.perft(
+            Game('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+                 'w KQkq - 0 1'), 2)
+        self.assertEqual(total, 2039)
+        self.assertEqual(len(divide), 48)
+        self.assertEqual(divide['e1g1'], 43)
+        self.assertEqual(self.coordinator.perft(Game(), 0), (1, {}))
+        self.coordinator.close()
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(sum(worker.units for worker in workers), 48)
+
+    def test_search_and_analyse(self):
+        self.start_worker()
+        self.start_worker()
+        result = self.coordinator.search(
+            Game('r5k1/5ppp/8/8/8/8/4R3/4R1K1 w - - 0 1'), 3)
+        self.assertEqual(result.best_move, BasicMove('e2', 'e8'))
+        self.assertEqual(result.mate_in(), 2)
+        self.assertEqual([move.coordinates() for move in result.pv],
+                         ['e2e8', 'a8e8', 'e1e8'])
+
+        fens = ['4k3/8/8/3q4/8/8/8/3RK3 w - - 0 1',
+                'rr2k3/8/8/8/8/8/8/K7 w - - 0 1'] * 3
+        results = self.coordinator.analyse(fens, 2, chunk_size=4)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0][0], 'd1d5')
+        self.assertEqual(results[1], (None, -chess.search.MATE_SCORE))
+        self.assertEqual(results[4], results[0])
+
+    def test_lost_workers(self):
+        #One worker disconnects mid-unit, one goes silent
+        units = [('perft', {'fen': Game().fen(), 'depth': 1})] * 4
+        results = []
+        job = threading.Thread(
+            target=lambda: results.extend(self.coordinator.run(units)))
+        job.start()
+        disconnected, rfile = self.fake_worker()
+        disconnected.close()
+        silent = self.fake_worker()
+        self.start_worker()
+        job.join()
+        self.assertEqual(results, [20] * 4)
+        self.assertEqual(self.coordinator.stats['reassigned'], 2)
+        silent[0].close()
+
+    def test_errors(self):
+        self.start_worker()
+        self.assertRaises(chess.distributed.DistributedException,
+                          self.coordinator.run, [('perft', {'fen': 'x'})])
+        self.assertRaises(chess.distributed.DistributedException,
+                          self.coordinator.run, [('nonsense', {})])
+        self.assertEqual(self.coordinator.run([('perft', {'fen': Game().fen(),
+                                                          'depth': 2})]),
+                         [400])
+
+
+class TestPonder(unittest.TestCase):
+    FEN = ('r1bqkb1r/pppp1ppp/2n2n2/4p3/4P3/2N2N2/PPPP1PPP/R1BQKB1R '
+           'w KQkq - 4 4')
+
+    def pondered(self, depth):
+        session = chess.ponder.PonderSession(Game(self.FEN))
+        result = session.think(chess.search.SearchLimits(depth=2))
+        session.play(result.best_move)
+        self.assertIsNotNone(session.expected)
+        deadline = time.time() + 60
+        while (session.ponder_result is None or
+               session.ponder_result.depth < depth) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        return session
+
+    def test_hit_reuses_search(self):
+        session = self.pondered(3)
+        expected = session.expected
+        cold = chess.search.Searcher().search(
+            session.game.move(expected), chess.search.SearchLimits(depth=3))
+        with session:
+            result = session.opponent_moved(
+                expected.coordinates(), chess.search.SearchLimits(depth=3))
+        self.assertEqual((session.hits, session.misses), (1, 0))
+        self.assertEqual(result.depth, 3)
+        self.assertLess(result.nodes, cold.nodes)
+
+    def test_miss(self):
+        session = self.pondered(1)
+        reply = [move for move in session.game.legal_moves()
+                 if move.coordinates() != session.expected.coordinates()][0]
+        with session:
+            result = session.opponent_moved(
+                reply, chess.search.SearchLimits(depth=2))
+        self.assertEqual((session.hits, session.misses), (0, 1))
+        self.assertTrue(session.game.is_legal(result.best_move))
+        self.assertIsNone(session._thread)
+
+    def test_no_prediction(self):
+        game = Game(self.FEN)
+        with chess.ponder.PonderSession(game) as session:
+            session.play('a2a3')
+            self.assertIsNone(session.expected)
+            result = session.opponent_moved(
+                'f8c5', chess.search.SearchLimits(depth=1))
+        self.assertEqual(session.misses, 1)
+        self.assertEqual(result.depth, 1)
+
+
+class TestScheduler(unittest.TestCase):
+    FEN = TestPonder.FEN
+
+    def setUp(self):
+        self.scheduler = chess.scheduler.Scheduler(workers=1)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def submit(self, priority, **budget):
+        return self.scheduler.submit(Game(self.FEN), priority, **budget)
+
+    def wait_running(self, job):
+        deadline = time.time() + 10
+        while job.state == chess.scheduler.QUEUED and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(job.state, chess.scheduler.RUNNING)
+
+    def test_priorities(self):
+        scheduler = chess.scheduler
+        blocker = self.submit(scheduler.BULK, movetime=0.5)
+        self.wait_running(blocker)
+        bulk = self.submit(scheduler.BULK, depth=1)
+        normal = self.submit(scheduler.NORMAL, depth=1)
+        interactive = self.submit(scheduler.INTERACTIVE, depth=1)
+        for job in (blocker, bulk, normal, interactive):
+            job.wait(30)
+            self.assertEqual(job.state, scheduler.DONE)
+            self.assertIsNotNone(job.result.best_move)
+        self.assertLess(interactive.finished, normal.finished)
+        self.assertLess(normal.finished, blocker.finished)
+        self.assertLess(blocker.finished, bulk.finished)
+        self.assertGreaterEqual(blocker.preemptions, 1)
+        #The time used before preemption counts against the budget
+        self.assertLess(blocker.service_seconds, 0.75)
+
+        metrics = self.scheduler.metrics()
+        self.assertEqual(metrics['bulk']['done'], 2)
+        self.assertEqual(metrics['bulk']['preempted'], blocker.preemptions)
+        self.assertEqual(metrics['interactive']['latency']['count'], 1)
+        self.assertEqual(metrics['normal']['queue']['count'], 1)
+
+    def test_cancel(self):
+        running = self.submit(chess.scheduler.BULK, movetime=60)
+        queued = self.submit(chess.scheduler.BULK, movetime=60)
+        self.wait_running(running)
+        self.assertTrue(queued.cancel())
+        self.assertEqual(queued.state, chess.scheduler.CANCELLED)
+        started = time.time()
+        self.assertTrue(running.cancel())
+        running.wait(10)
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(running.state, chess.scheduler.CANCELLED)
+        self.assertFalse(running.cancel())
+        self.assertEqual(self.scheduler.metrics()['bulk']['cancelled'], 2)
+
+    def test_deadlines(self):
+        #An interactive job can't be preempted by another
+        blocker = self.submit(chess.scheduler.INTERACTIVE, movetime=1.0)
+        self.wait_running(blocker)
+        expired = self.submit(chess.scheduler.INTERACTIVE, deadline=0.1)
+        expired.wait(0.6)
+        self.assertEqual(expired.state, chess.scheduler.EXPIRED)
+        self.assertIsNone(expired.result)
+
+        blocker.wait(10)
+        started = time.time()
+        job = self.submit(chess.scheduler.INTERACTIVE, deadline=0.3)
+        job.wait(10)
+        self.assertEqual(job.state, chess.scheduler.DONE)
+        self.assertIsNotNone(job.result.best_move)
+        self.assertLess(time.time() - started, 1.0)
+
+    def test_worker_dies(self):
+        scheduler = chess.scheduler
+        job = self.submit(scheduler.BULK, movetime=60)
+        self.wait_running(job)
+        self.scheduler._slots[0].process.terminate()
+        job.wait(10)
+        self.assertEqual(job.state, scheduler.FAILED)
+        self.assertEqual(self.scheduler.restarts, 1)
+
+        #The replacement worker runs jobs, and can still be preempted
+        blocker = self.submit(scheduler.BULK, movetime=60)
+        self.wait_running(blocker)
+        urgent = self.submit(scheduler.INTERACTIVE, depth=1)
+        urgent.wait(10)
+        self.assertEqual(urgent.state, scheduler.DONE)
+        self.assertGreaterEqual(blocker.preemptions, 1)
+        blocker.cancel()
+
+        #As is a worker that dies while idle
+        blocker.wait(10)
+        self.scheduler._slots[0].process.terminate()
+        self.scheduler._slots[0].process.join()
+        job = self.submit(scheduler.NORMAL, depth=1)
+        job.wait(10)
+        self.assertEqual(job.state, scheduler.DONE)
+        self.assertEqual(self.scheduler.restarts, 2)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.submit, chess.scheduler.NORMAL)
+        self.scheduler.close()
+        self.assertRaises(chess.scheduler.SchedulerException, self.submit,
+                          chess.scheduler.NORMAL, depth=1)
+
+
+class TestUCI(unittest.TestCase):
+
+    def setUp(self):
+        self.output = StringIO.StringIO()
+        self.engine = chess.uci.UCIEngine(self.output)
+
+    def lines(self):
+        return self.output.getvalue().splitlines()
+
+    def test_handshake(self):
+        self.engine.handle('uci')
+        self.engine.handle('isready')
+        self.assertEqual(self.lines()[-2:], ['uciok', 'readyok'])
+
+    def test_position(self):
+        self.engine.handle('position startpos moves e2e4 e7e5 g1f3')
+        self.assertEqual(self.engine.game.fen(), 'rnbqkbnr/pppp1ppp/8/4p3/'
+                         '4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2')
+
+        self.engine.handle('position fen 4k3/P7/8/8/8/8/8/4K3 w - - 0 1 moves '
+                           'a7a8q')
+        self.assertEqual(self.engine.game.fen(),
+                         'Q3k3/8/8/8/8/8/8/4K3 b - - 0 1')
+
+        self.engine.handle('position startpos moves e2e5')
+        self.assertTrue(self.lines()[-1].startswith('info string'))
+
+    def test_invalid_fen(self):
+        self.engine.handle('position fen k7/8/1K6/8/8/8/8/7R w - - 0 1')
+        for fen in ('8/8/8 w - - 0 1', '4k3/8/8/8/8/8/8/4KX2 w - - 0 1'):
+            self.engine.handle('position fen ' + fen)
+            self.assertTrue(self.lines()[-1].startswith(
+                'info string invalid position'))
+        #The last good position is kept, and can still be searched
+        self.assertEqual(self.engine.game.fen(),
+                         'k7/8/1K6/8/8/8/8/7R w - - 0 1')
+        self.engine.handle('go depth 2')
+        self.engine.wait()
+        self.assertEqual(self.lines()[-1], 'bestmove h1h8')
+
+    def test_go_depth(self):
+        self.engine.handle('position fen k7/8/1K6/8/8/8/8/7R w - - 0 1')
+        self.engine.handle('go depth 2')
+        self.engine.wait()
+        lines = self.lines()
+        self.assertTrue(lines[0].startswith('info depth 1 '))
+        self.assertIn('score mate 1', lines[-2])
+        self.assertEqual(lines[-1], 'bestmove h1h8')
+
+    def test_multipv(self):
+        self.engine.handle('setoption name MultiPV value 3')
+        self.engine.handle('position fen k7/8/1K6/8/8/8/8/7R w - - 0 1')
+        self.engine.handle('go depth 3')
+        self.engine.wait()
+        lines = self.lines()
+        self.assertEqual([line.split()[4] for line in lines[-4:-1]],
+                         ['1', '2', '3'])
+        self.assertIn('score mate 1 ', lines[-4])
+        self.assertIn('score mate 2 ', lines[-3])
+        self.assertEqual(lines[-1], 'bestmove h1h8')
+
+        self.engine.handle('setoption name MultiPV value 1')
+        self.engine.handle('go depth 3 searchmoves h1h7 h1g1')
+        self.engine.wait()
+        self.assertTrue(self.lines()[-1].startswith('bestmove h1h7 '))
+
+        #Moves with bad squares are skipped
+        self.engine.handle('go depth 3 searchmoves z9z9 h1g1')
+        self.engine.wait()
+        self.assertTrue(self.lines()[-1].startswith('bestmove h1g1 '))
+        self.engine.handle('go depth 2 searchmoves z9z9')
+        self.engine.wait()
+        self.assertEqual(self.lines()[-1], 'bestmove h1h8')
+
+    def test_infinite_search_stays_responsive(self):
+        self.engine.handle('position startpos')
+        self.engine.handle('go infinite')
+        time.sleep(0.2)
+        started = time.time()
+        self.engine.handle('isready')
+        self.assertTrue(time.time() - started < 0.1)
+        self.assertIn('readyok', self.lines())
+        self.assertFalse([line for line in self.lines()
+                          if line.startswith('bestmove')])
+        self.engine.handle('stop')
+        self.engine.wait()
+        self.assertTrue(self.lines()[-1].startswith('bestmove '))
+
+    def test_ponderhit(self):
+        self.engine.handle('position startpos')
+        self.engine.handle('go ponder movetime 100')
+        time.sleep(0.2)
+        self.assertFalse([line for line in self.lines()
+                          if line.startswith('bestmove')])
+        self.engine.handle('ponderhit')
+        self.engine.wait()
+        self.assertTrue(self.lines()[-1].startswith('bestmove '))
+
+
+
+class TestServer(unittest.TestCase):
+
+    def test_manager(self):
+        manager = chess.server.SessionManager()
+        response = manager.handle({'op': 'new'})
+        self.assertTrue(response['ok'])
+        game_id = response['id']
+
+        response = manager.handle({'op': 'moves', 'id': game_id,
+                                   'square': 'g1'})
+        self.assertEqual(sorted(response['moves']), ['g1f3', 'g1h3'])
+
+        for move in ('f2f3', 'e7e5', 'g2g4'):
+            response = manager.handle({'op': 'move', 'id': game_id,
+                                       'move': move})
+            self.assertEqual(response['status'], 'active')
+        response = manager.handle({'op': 'move', 'id': game_id,
+                                   'move': 'd8h4'})
+        self.assertEqual(response['status'], 'checkmate')
+
+        response = manager.handle({'op': 'move', 'id': game_id,
+                                   'move': 'e2e4'})
+        self.assertFalse(response['ok'])
+
+        self.assertTrue(manager.handle({'op': 'delete', 'id': game_id})['ok'])
+        self.assertFalse(manager.handle({'op': 'get', 'id': game_id})['ok'])
+        self.assertFalse(manager.handle({'op': 'bogus'})['ok'])
+
+        for fen in ('4k3/8/8/8/8/8/8/8 w - - 0 1',
+                    '4k3/8/8/8/8/8/8/4K3 x - - 0 1',
+                    '4k3/8/8/8/8/8/8/4K3 w KX - 0 1',
+                    '4k3/8/8/8/8/8/8/4K3 w - e3 0 1',
+                    '4k3/8/8/8/8/8/8/4K3 w - - a 1', 5):
+            self.assertFalse(manager.handle({'op': 'new', 'fen': fen})['ok'])
+        self.assertEqual(len(manager), 0)
+
+        metrics = manager.handle({'op': 'metrics'})
+        self.assertEqual(metrics['games'], 0)
+        self.assertEqual(metrics['latency']['move']['count'], 5)
+        self.assertTrue(metrics['latency']['move']['p99'] >=
+                        metrics['latency']['move']['p50'])
+
+    def test_tcp(self):
+        manager = chess.server.SessionManager(workers=1)
+        server = chess.server.SessionServer(('127.0.0.1', 0), manager)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            connection = socket.create_connection(server.server_address)
+            stream = connection.makefile('rw')
+
+            def request(**kwargs):
+                stream.write(json.dumps(kwargs) + '\n')
+                stream.flush()
+                return json.loads(stream.readline())
+
+            game_id = request(op='new', fen=TestChess.CHECK_FEN)['id']
+            self.assertEqual(request(op='get', id=game_id)['status'], 'check')
+            response = request(op='move', id=game_id, move='a8a7')
+            self.assertFalse(response['ok'])
+            response = request(op='move', id=game_id, move='d8d7')
+            self.assertEqual(response['status'], 'active')
+
+            stream.write('not json\n')
+            stream.flush()
+            self.assertFalse(json.loads(stream.readline())['ok'])
+
+            #Bad FENs are refused, and the connection carries on
+            for fen in ('8/8 w - - 0 1', 'X7/8/8/8/8/8/8/8 w - - 0 1'):
+                response = request(op='new', fen=fen)
+                self.assertFalse(response['ok'])
+                self.assertIn('invalid FEN', response['error'])
+                self.assertEqual(request(op='get', id=game_id)['status'],
+                                 'active')
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            manager.close()
+
+
+
+class TestPositionBatch(unittest.TestCase):
+
+    FENS = [
+        TestChess.STARTING_FEN,
+        TestChess.CHECK_FEN,
+        'rnbqkbnr/pppppppp/8/8/P7/8/1PPPPPPP/RNBQKBNR b KQkq a3 0 1',
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w Kq - 3 17',
+        '4k3/8/8/8/8/8/8/R3K3 b - - 99 300',
+    ]
+
+    def test_round_trip(self):
+        batch = chess.batch.PositionBatch()
+        for fen in self.FENS:
+            batch.append_fen(fen)
+        batch.append(Game(self.FENS[3]))
+
+        self.assertEqual(len(batch), 6)
+        self.assertEqual(list(batch.fens()), self.FENS + [self.FENS[3]])
+        self.assertEqual(batch[-1].fen(), self.FENS[3])
+        self.assertEqual(batch.nbytes(), 6 * chess.batch.RECORD.size)
+
+        for i, fen in enumerate(self.FENS):
+            record = batch.record(i)
+            self.assertEqual(chess.batch.unpack_game(record).fen(), fen)
+            self.assertEqual(record, chess.batch.pack_game(Game(fen)))
+
+        #Materialised games are independent, and playable
+        game = batch[0].move(BasicMove('e2', 'e4'))
+        self.assertEqual(batch[0].fen(), self.FENS[0])
+        self.assertEqual(game.en_passant, BoardSquare('e3'))
+
+    def test_views(self):
+        batch = chess.batch.PositionBatch(Game(fen) for fen in self.FENS)
+
+        view = batch[1:5:2]
+        self.assertEqual([game.fen() for game in view],
+                         [self.FENS[1], self.FENS[3]])
+        self.assertIs(view._columns, batch._columns)
+        self.assertEqual(view[::-1][0].fen(), self.FENS[3])
+        self.assertRaises(TypeError, view.append, Game())
+
+        self.assertEqual(batch.sides(), ['w', 'b', 'b', 'w', 'b'])
+        black = batch.filter_side('b')
+        self.assertEqual(list(black.fens()), [self.FENS[1], self.FENS[2],
+                                              self.FENS[4]])
+        self.assertEqual(len(black[1:].filter_side('w')), 0)
+
+        self.assertEqual(batch.material_signatures()[-1], 'KRk')
+        self.assertEqual(list(batch.filter_material('KRk').fens()),
+                         [self.FENS[4]])
+        self.assertEqual(len(batch.filter_material(
+            'KQRRBBNNPPPPPPPPkqrrbbnnpppppppp')), 3)
+
+    def test_invalid(self):
+        batch = chess.batch.PositionBatch()
+        self.assertRaises(ValueError, batch.append_fen, '8/8 w - - 0 1')
+        self.assertRaises(ValueError, batch.append_fen,
+                          'xnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq '
+                          '- 0 1')
+        self.assertEqual(len(batch), 0)
+
+    def test_decode_fen(self):
+        for fen in self.FENS + ['8/8/8/8/8/8/8/K6k w - h3 0 1']:
+            self.assertEqual(chess.batch.decode_fen(
+                *chess.batch.encode_fen(fen)), fen)
+
+
+class TestSharedPool(unittest.TestCase):
+    FENS = TestPositionBatch.FENS
+
+    def test_pack_into(self):
+        batch = chess.batch.PositionBatch(Game(fen) for fen in self.FENS)
+        size = chess.batch.RECORD.size
+        buffer = bytearray(size * (len(self.FENS) + 1))
+        self.assertEqual(batch[::2].pack_into(buffer, size), 3)
+        self.assertEqual(chess.batch.unpack_game(buffer, size * 2).fen(),
+                         self.FENS[2])
+        self.assertEqual(buffer[:size], bytearray(size))
+
+    def test_map(self):
+        result = struct.Struct('<H')
+        games = [Game(fen) for fen in self.FENS] * 3
+        expected = [chess.shared.legal_move_count(game) for game in games]
+        for workers in (0, 2):
+            with chess.shared.SharedPool(chess.shared.legal_move_count,
+                                         result, workers=workers,
+                                         capacity=4, chunksize=3) as pool:
+                self.assertEqual(pool.map(games), expected)
+                self.assertEqual(pool.map(chess.batch.PositionBatch(games)),
+                                 expected)
+                self.assertEqual(pool.map([]), [])
+
+    def test_fields(self):
+        def fullmove(board, side, castling, en_passant, halfmove, fullmove):
+            return (fullmove, side)
+        batch = chess.batch.PositionBatch(Game(fen) for fen in self.FENS)
+        with chess.shared.SharedPool(fullmove, struct.Struct('<HB'),
+                                     workers=1, decode=False) as pool:
+            self.assertEqual(pool.map(batch),
+                             [(1, 0), (1, 1), (1, 1), (17, 0), (300, 1)])
+
+
+class TestEPD(unittest.TestCase):
+
+    EPD = (
+        '2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - '
+        'bm Qg6; id "WAC.001";\n'
+        '\n'
+        'r1b1kb1r/3q1ppp/pBp1pn2/8/Np3P2/5B2/PPP3PP/R2Q1RK1 w kq - '
+        'am Qxd7+; c0 "avoid the queen trade; really"; id "WAC.002"\r\n'
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1\n'
+        '8/8/8/8/8/8/8/K6k b - - hmvc 12; fmvn 40;\n'
+        'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1\n'
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1\n'
+        '4k3/8/8/8/8/8/8/4K3 w - - bm "unterminated;\n'
+        '4k3/8/8/8/8/8/8/4K3 w - e3'
+    )
+
+    def reader(self, errors='skip', block_size=16):
+        return chess.epd.EPDReader(StringIO.StringIO(self.EPD), errors,
+                                   block_size)
+
+    def test_records(self):
+        reader = self.reader()
+        records = list(reader)
+        self.assertEqual(len(records), 5)
+        self.assertEqual(reader.malformed, 3)
+        self.assertEqual(reader.lines, 9)
+
+        self.assertEqual(records[0].bm, ['Qg6'])
+        self.assertEqual(records[0].id, 'WAC.001')
+        self.assertEqual(records[0].am, [])
+        self.assertEqual(records[1].am, ['Qxd7+'])
+        self.assertEqual(records[1].c0, 'avoid the queen trade; really')
+        self.assertEqual(records[1].fen.split(' ')[4:], ['0', '1'])
+        self.assertEqual(records[2].operations, {})
+        self.assertEqual(records[2].fen, TestChess.STARTING_FEN)
+        self.assertEqual(records[3].fen, '8/8/8/8/8/8/8/K6k b - - 12 40')
+        self.assertEqual(records[4].fen, '4k3/8/8/8/8/8/8/4K3 w - e3 0 1')
+
+        game = records[0].game()
+        self.assertEqual(game.fen(), records[0].fen)
+        self.assertTrue(game.is_legal(BasicMove('g3', 'g6')))
+
+    def test_errors(self):
+        self.assertRaises(chess.epd.MalformedLineException, list,
+                          self.reader('raise'))
+        try:
+            list(self.reader('raise'))
+        except chess.epd.MalformedLineException as error:
+            self.assertEqual(error.line_number, 6)
+            self.assertTrue(error.line.startswith('rnbqkbnr/pppppppp/9'))
+
+        reported = []
+        self.assertEqual(len(list(self.reader(reported.append))), 5)
+        self.assertEqual([error.line_number for error in reported], [6, 7, 8])
+        self.assertRaises(ValueError, chess.epd.EPDReader,
+                          StringIO.StringIO(''), 'ignore')
+
+    def test_games_and_batch(self):
+        #Operations are ignored, so a line whose operations alone are
+        #malformed still gives a position
+        reader = self.reader()
+        fens = list(reader.fens())
+        self.assertEqual(len(fens), 6)
+        self.assertEqual(reader.malformed, 2)
+        self.assertEqual(fens[4], '4k3/8/8/8/8/8/8/4K3 w - - 0 1')
+        self.assertEqual([game.fen() for game in self.reader().games()],
+                         fens)
+        self.assertEqual([game.fen() for game in
+                          self.reader().games(lazy=False)], fens)
+
+        batch = self.reader().to_batch()
+        self.assertEqual(list(batch.fens()), fens)
+        self.reader().to_batch(batch)
+        self.assertEqual(len(batch), 12)
+
+    def test_write(self):
+        output = StringIO.StringIO()
+        records = list(self.reader())
+        with chess.epd.EPDWriter(output, block_size=64) as writer:
+            for record in records:
+                writer.write_record(record)
+            writer.write_fen(Game())
+            writer.write_epd(Game(), [('bm', ['e4', 'd4']), ('id', 'start')])
+        output.seek(0)
+
+        written = list(chess.epd.EPDReader(output))
+        self.assertEqual(written[:5], records)
+        self.assertEqual(written[5].fen, TestChess.STARTING_FEN)
+        self.assertEqual(written[6].bm, ['e4', 'd4'])
+        self.assertEqual(written[6].id, 'start')
+        self.assertEqual(output.getvalue().count('\n'), 7)
+
+        output = StringIO.StringIO()
+        batch = chess.batch.PositionBatch(Game(fen)
+                                          for fen in TestPositionBatch.FENS)
+        with chess.epd.EPDWriter(output) as writer:
+            writer.write_batch(batch)
+        self.assertEqual(output.getvalue().splitlines(),
+                         TestPositionBatch.FENS)
+
+        self.assertRaises(ValueError, chess.epd.format_operations,
+                          {'c0': 'say "hi"'})
+
+
+
+class TestSAN(unittest.TestCase):
+
+    def assertRoundTrip(self, fen):
+        game = Game(fen)
+        legal = game.legal_moves()
+        sans = [chess.san.to_san(game, move, legal) for move in legal]
+        self.assertEqual(len(set(sans)), len(sans))
+        for san, move in zip(sans, legal):
+            parsed = chess.san.parse_san(game, san)
+            self.assertEqual(parsed.coordinates(), move.coordinates())
+        return sans
+
+    def test_round_trip(self):
+        sans = self.assertRoundTrip(
+            'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - '
+            '0 1')
+        self.assertIn('O-O', sans)
+        self.assertIn('O-O-O', sans)
+        self.assertIn('Bxa6', sans)
+        self.assertIn('gxh3', sans)
+
+        sans = self.assertRoundTrip(
+            'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 b kq - 0 1')
+        self.assertIn('bxa1=Q+', sans)
+        self.assertIn('b1=N+', sans)
+
+        sans = self.assertRoundTrip('7k/8/8/8/8/8/8/N1N1K2N w - - 0 1')
+        self.assertIn('Nab3', sans)
+        self.assertIn('Ncb3', sans)
+        sans = self.assertRoundTrip('7k/8/8/8/R7/8/8/R3K3 w - - 0 1')
+        self.assertIn('R1a2', sans)
+        self.assertIn('R4a2', sans)
+
+        #En passant
+        self.assertIn('exd6', self.assertRoundTrip(
+            '4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1'))
+
+    def test_parse(self):
+        game = Game()
+        parse = chess.san.parse_san
+        self.assertEqual(parse(game, 'Nf3!?').coordinates(), 'g1f3')
+        self.assertEqual(parse(game, 'e2e4').coordinates(), 'e2e4')
+        game = Game('r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1')
+        self.assertEqual(parse(game, '0-0-0').coordinates(), 'e8c8')
+        self.assertEqual(parse(game, 'O-O+').coordinates(), 'e8g8')
+
+        for bad in ('Nf4', 'e5', 'Qd4', 'x', 'O-O-O-O', ''):
+            self.assertRaises(chess.san.InvalidSANException, parse, Game(),
+                              bad)
+        self.assertRaises(chess.san.InvalidSANException, parse,
+                          Game('7k/8/8/8/8/8/8/N1N1K2N w - - 0 1'), 'Nb3')
+
+
+class TestSuite(unittest.TestCase):
+
+    EPD = (
+        '6k1/5ppp/8/8/8/8/8/R5K1 w - - bm Ra8#; id "mate.1";\n'
+        'k7/8/1K6/8/8/8/8/7R w - - bm Rh8#; id "mate.2";\n'
+        '4k3/8/8/8/8/8/3q4/4K3 w - - bm Kxd2; id "capture";\n'
+        '7k/8/8/8/8/8/6q1/K6R w - - am Rh2; id "avoid";\n'
+        '4k3/8/8/8/8/8/3q4/4K3 w - - bm Kf1; id "unsound";\n'
+        '4k3/8/8/8/8/8/8/4K3 w - - bm Qh5; id "bad";\n'
+        '4k3/8/8/8/8/8/8/4K3 w - - id "no operations";\n'
+    )
+
+    def records(self):
+        return list(chess.epd.EPDReader(StringIO.StringIO(self.EPD)))
+
+    def test_inline(self):
+        seen = []
+        results = chess.suite.run_suite(self.records(), depth=2,
+                                        progress=seen.append)
+        self.assertEqual(len(seen), 6)
+        self.assertEqual([result.id for result in results],
+                         ['mate.1', 'mate.2', 'capture', 'avoid', 'unsound',
+                          'bad'])
+        self.assertEqual([result.solved for result in results],
+                         [True, True, True, True, False, False])
+        self.assertEqual(results[0].move, 'Ra8#')
+        self.assertTrue(results[5].error)
+
+        summary = chess.suite.summarise(results)
+        self.assertEqual(summary['positions'], 6)
+        self.assertEqual(summary['solved'], 4)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['unsolved'], ['unsound', 'bad'])
+        self.assertEqual(summary['workers'].keys(), ['MainProcess'])
+        self.assertEqual(set(summary['time_to_solve']),
+                         set(['p50', 'p90', 'p99', 'max']))
+        json.dumps(summary)
+
+        self.assertRaises(ValueError, chess.suite.run_suite, self.records())
+
+    def test_malformed_position(self):
+        records = [chess.epd.EPDRecord(fen, {'bm': ['Kf1'], 'id': [id_]})
+                   for fen, id_ in (('8/8 w - - 0 1', 'short'),
+                                    ('X3k3/8/8/8/8/8/8/4K3 w - - 0 1',
+                                     'piece'))]
+        results = chess.suite.run_suite(records + self.records()[:1],
+                                        depth=1)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(results[0].error.startswith('invalid position'))
+        self.assertTrue(results[1].error.startswith('invalid position'))
+        self.assertTrue(results[2].solved)
+
+    def test_pool(self):
+        results = chess.suite.run_suite(self.records()[:4], depth=2,
+                                        workers=2)
+        self.assertTrue(all(result.solved for result in results))
+        summary = chess.suite.summarise(results)
+        self.assertNotIn('MainProcess', summary['workers'])
+        self.assertEqual(sum(figures['positions'] for figures
+                             in summary['workers'].values()), 4)
+
+
+
+class TestMatch(unittest.TestCase):
+
+    def test_play_game(self):
+        engine = chess.match.Engine('A')
+        control = chess.match.TimeControl(depth=2)
+        record = chess.match.play_game((
+            0, '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', engine,
+            chess.match.Engine('B'), control, 10))
+        self.assertEqual(record.moves, ['Ra8#'])
+        self.assertEqual((record.result, record.termination),
+                         ('1-0', 'checkmate'))
+        self.assertEqual(record.score('A'), 1)
+        self.assertEqual(record.score('B'), 0)
+
+        record = chess.match.play_game((
+            1, '8/8/4k3/8/8/8/8/4K3 w - - 0 1', engine,
+            chess.match.Engine('B'), control, 10))
+        self.assertEqual(record.termination, 'insufficient material')
+        self.assertEqual(record.score('B'), 0.5)
+
+        record = chess.match.play_game((
+            2, '7k/8/8/8/8/8/8/R3K3 w - - 0 1', engine,
+            chess.match.Engine('B'), chess.match.TimeControl(depth=1), 6))
+        self.assertEqual(len(record.moves), 6)
+        self.assertEqual(record.termination, 'move limit')
+
+        text = record.pgn()
+        self.assertIn('[SetUp "1"]', text)
+        self.assertIn('[Termination "move limit"]', text)
+        self.assertTrue(text.rstrip().endswith('1/2-1/2'))
+        self.assertRaises(ValueError, chess.match.TimeControl)
+
+    def test_stats(self):
+        stats = chess.match.MatchStats(0, 10)
+        self.assertEqual(stats.elo(), None)
+        self.assertEqual(stats.llr(), 0)
+        for _ in xrange(2):
+            stats.add(1)
+            stats.add(0.5)
+        self.assertEqual(stats.decision(), None)
+        for _ in xrange(30):
+            stats.add(1)
+        stats.add(0)
+        self.assertGreater(stats.elo(), 100)
+        self.assertGreater(stats.elo_error(), 0)
+        self.assertEqual(stats.decision(), 'H1')
+
+        stats = chess.match.MatchStats(0, 10)
+        for _ in xrange(200):
+            stats.add(0)
+            stats.add(0.5)
+        self.assertEqual(stats.decision(), 'H0')
+        json.dumps(stats.to_dict())
+
+    def test_run_match(self):
+        a, b = chess.match.Engine('A'), chess.match.Engine('B')
+        control = chess.match.TimeControl(depth=1)
+        pgn = StringIO.StringIO()
+        seen = []
+        stats, records = chess.match.run_match(
+            a, b, control, 4, workers=0, sprt=False, pgn_file=pgn,
+            progress=lambda record, stats: seen.append(stats.games),
+            max_plies=8)
+        self.assertEqual(stats.games, 4)
+        self.assertEqual(seen, [1, 2, 3, 4])
+        self.assertEqual([(record.white, record.black) for record in records],
+                         [('A', 'B'), ('B', 'A')] * 2)
+        self.assertEqual(records[0].fen, records[1].fen)
+        self.assertEqual(pgn.getvalue().count('[Event '), 4)
+        self.assertRaises(ValueError, chess.match.run_match, a, a, control, 2)
+
+        #Bounds of zero make the test decide after the first game
+        stats, records = chess.match.run_match(
+            a, b, control, 6, workers=2,
+            stats=chess.match.MatchStats(alpha=0.5, beta=0.5), max_plies=8)
+        self.assertEqual(len(records), 1)
+
+
+
+class TestPGN(unittest.TestCase):
+
+    PGN = (
+        '[Event "one"]\n'
+        '[White "a \\"b\\""]\n'
+        '[Result "1-0"]\n'
+        '\n'
+        '1. e4 e5 {main line; really} 2. Nf3 (2. f4 exf4 (2... d5)) Nc6 $1\n'
+        '3. Bb5 a6 ; a comment\n'
+        '4. Ba4 1-0\n'
+        '\n'
+        '[Event "two"]\n'
+        '[SetUp "1"]\n'
+        '[FEN "4k3/8/8/8/8/8/4P3/4K3 b - - 0 1"]\n'
+        '\n'
+        '1... Kd7 2. e4 Kc6 3. e5 Qz9 4. e6 *\n'
+    )
+
+    def test_read(self):
+        games = list(chess.pgn.read_games(StringIO.StringIO(self.PGN)))
+        self.assertEqual(len(games), 2)
+        self.assertEqual(games[0].headers['White'], 'a "b"')
+        self.assertEqual(games[0].moves, ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5',
+                                          'a6', 'Ba4'])
+        self.assertEqual(games[0].result, '1-0')
+        self.assertEqual(len(list(games[0].iter_positions())), 7)
+
+        self.assertEqual(games[1].result, '*')
+        self.assertEqual(games[1].start().active, 'b')
+        #Replay stops at the illegal move
+        self.assertEqual([move.coordinates() for _, move
+                          in games[1].iter_positions()],
+                         ['e8d7', 'e2e4', 'd7c6', 'e4e5'])
+
+    def test_write(self):
+        text = chess.pgn.format_game(
+            {'White': 'x', 'Black': 'y', 'FEN': '4k3/8/8/8/8/8/4P3/4K3 b - - '
+             '0 7'}, ['Kd7', 'e4'], '1/2-1/2', 7, True)
+        self.assertIn('7... Kd7 8. e4 1/2-1/2', text)
+        self.assertRaises(ValueError, chess.pgn.format_game, {}, [], '2-0')
+
+        game = chess.pgn.parse_game(text)
+        self.assertEqual(game.moves, ['Kd7', 'e4'])
+        self.assertEqual(game.result, '1/2-1/2')
+
+        moves = ['e4', 'e5'] * 40
+        text = chess.pgn.format_game({}, moves, '*')
+        self.assertTrue(all(len(line) <= chess.pgn.LINE_WIDTH
+                            for line in text.splitlines()))
+        self.assertEqual(chess.pgn.parse_game(text).moves, moves)
+
+
+class TestExplorer(unittest.TestCase):
+
+    GAMES = [
+        ('1-0', 'e4 e5 Nf3 Nc6 Bb5'),
+        ('0-1', 'e4 c5 Nf3 d6'),
+        ('1/2-1/2', 'Nf3 e5 e4 Nc6'),
+        ('1-0', 'e4 e5 Nf3'),
+        ('*', 'd4 d5'),
+        ('0-1', 'd4 Nf6 c4 e6'),
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pgn = os.path.join(self.directory, 'games.pgn')
+        with open(self.pgn, 'w') as pgn_file:
+            for result, moves in self.GAMES:
+                chess.pgn.write_game(pgn_file, {}, moves.split(), result)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, path):
+        with chess.explorer.OpeningIndex(path) as index:
+            moves = index.lookup(Game())
+            self.assertEqual([(continuation.move.coordinates(),
+                               continuation.white, continuation.draws,
+                               continuation.black)
+                              for continuation in moves],
+                             [('e2e4', 2, 0, 1), ('d2d4', 0, 0, 1),
+                              ('g1f3', 0, 1, 0)])
+            self.assertEqual(moves[0].games, 3)
+
+            #1. e4 e5 2. Nf3 and 1. Nf3 e5 2. e4 transpose
+            game = Game().replay(['e2e4', 'e7e5', 'g1f3'])
+            self.assertEqual([(continuation.move.coordinates(),
+                               continuation.games)
+                              for continuation in index.lookup(game)],
+                             [('b8c6', 2)])
+            self.assertEqual(index.lookup(Game().replay(['a2a4'])), [])
+
+    def test_build(self):
+        path = os.path.join(self.directory, 'inline.idx')
+        figures = chess.explorer.build_index([self.pgn], path)
+        self.assertEqual(figures['games'], 5)
+        self.assertEqual(figures['skipped'], 1)
+        self.assertEqual(figures['shards'], 1)
+        self.check(path)
+
+        path = os.path.join(self.directory, 'pool.idx')
+        figures = chess.explorer.build_index([self.pgn, self.pgn], path,
+                                             workers=2, games_per_shard=2,
+                                             tmpdir=self.directory)
+        self.assertEqual(figures['shards'], 6)
+        with chess.explorer.OpeningIndex(path) as index:
+            self.assertEqual(index.lookup(Game())[0].white, 4)
+            self.assertEqual(len(index), figures['records'])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['games.pgn', 'inline.idx', 'pool.idx'])
+
+    def test_max_ply(self):
+        path = os.path.join(self.directory, 'short.idx')
+        chess.explorer.build_index([self.pgn], path, max_ply=1)
+        with chess.explorer.OpeningIndex(path) as index:
+            self.assertEqual(len(index), 3)
+            self.assertEqual(index.max_ply, 1)
+        self.assertRaises(ValueError, chess.explorer.OpeningIndex, self.pgn)
+
+
+
+class TestMate(unittest.TestCase):
+
+    def assertMate(self, fen, moves, expected):
+        result = chess.mate.MateSolver().solve(Game(fen), moves)
+        self.assertEqual(result.status, 'mate')
+        self.assertEqual(result.mate_in, expected)
+        game = Game(fen).replay(result.line)
+        self.assertTrue(game.is_checkmate())
+        return result
+
+    def test_mates(self):
+        self.assertMate('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 3, 1)
+        result = self.assertMate('7k/8/5K2/8/8/8/8/1R6 w - - 0 1', 3, 2)
+        #The defender's only move is forced
+        self.assertEqual(result.line[1].coordinates(), 'h8h7')
+        result = self.assertMate(
+            'r1b1kb1r/pppp1ppp/5q2/4n3/3KP3/2N3PN/PPP4P/R1BQ1B1R b kq - 0 1',
+            3, 3)
+        self.assertEqual(chess.san.line_to_san(Game(
+            'r1b1kb1r/pppp1ppp/5q2/4n3/3KP3/2N3PN/PPP4P/R1BQ1B1R b kq - 0 1'),
+            result.line[:2]), ['Bc5+', 'Kxc5'])
+
+    def test_no_mate(self):
+        solver = chess.mate.MateSolver()
+        result = solver.solve(Game('8/8/8/8/8/8/k7/2K5 w - - 0 1'), 3)
+        self.assertEqual(result.status, 'no mate')
+        self.assertEqual(result.mate_in, None)
+        self.assertEqual(result.line, [])
+
+        #Mated or stalemated attackers have no mate either
+        self.assertEqual(solver.solve(Game('rr2k3/8/8/8/8/8/8/K7 w - - 0 1'),
+                                      2).status, 'no mate')
+        self.assertEqual(solver.solve(Game('r1r5/1K6/7r/8/8/8/8/8 w - - 0 1'),
+                                      2).status, 'no mate')
+
+    def test_limits(self):
+        game = Game('8/8/8/8/3k4/8/8/2QK4 w - - 0 1')
+        result = chess.mate.MateSolver(max_nodes=50).solve(game, 5)
+        self.assertEqual(result.status, 'unknown')
+        self.assertGreaterEqual(result.nodes, 50)
+        result = chess.mate.MateSolver().solve(game, 5, movetime=0.05)
+        self.assertEqual(result.status, 'unknown')
+
+    def test_table_reuse(self):
+        solver = chess.mate.MateSolver()
+        game = Game('r5k1/5ppp/8/8/8/8/4R3/4R1K1 w - - 0 1')
+        first = solver.solve(game, 2)
+        second = solver.solve(game, 2)
+        self.assertEqual(second.line, first.line)
+        self.assertLess(second.nodes, first.nodes)
+
+        #Switching attacker starts afresh
+        self.assertEqual(solver.solve(Game('k7/8/8/8/8/8/8/K6R b - - 0 1'),
+                                      2).status, 'no mate')
+        self.assertEqual(solver.solve(game, 2).line, first.line)
+
+
 if __name__ == '__main__':
     unittest.main()